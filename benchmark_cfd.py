@@ -0,0 +1,227 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import cfd
+from cfd import CFDModel
+from reactor_network import ReactorNetwork
+
+"""
+Performance benchmark of CFDModel.  Every case runs the same start-up scenario as main.step_3_and_4 (reactor 1 at
+150 degC with both feeds at 2.5 mL/min, reactor 2 fed by reactor 1's outlet) and reports the steps and simulated
+seconds per wall second, the start-up cost (construction, first step and reset_arrays) and the memory of the models.
+The outlet concentrations are recorded too, so a baseline comparison also catches a change that alters the results.
+
+    python benchmark_cfd.py --output baseline.json
+    python benchmark_cfd.py --baseline baseline.json --threshold 0.1
+"""
+
+FLOWRATE_UNITS = 1.667e-8  # m3/s per mL/min
+NX_VALUES = (50, 400, 500, 1500)
+REGRESSION_THRESHOLD = 0.1  # fraction of the baseline steps per second a case may lose
+EQUIVALENCE_TOLERANCE = 1e-9  # largest outlet concentration difference, relative to the largest baseline value
+
+
+def reactor_1(nx: int = 500, **kwargs) -> CFDModel:
+    """
+    :return: Reactor 1 as main.create_reactors configures it, with nx nodes
+    """
+    return CFDModel(1200, 1000, nx=nx, Volume=10e-6, dt=0.005, RateTable=True, **kwargs)
+
+
+def reactor_2(nx: int = 400, **kwargs) -> CFDModel:
+    """
+    :return: Reactor 2 as main.create_reactors configures it, with nx nodes
+    """
+    return CFDModel(1, 1250, nx=nx, Volume=5e-6 + 3.36e-6, dt=0.005, ArrheniusFactor=11.3, ActivationEnergy=23681,
+                    MolecularWeight=346.0, RateTemperatureTolerance=0.0, **kwargs)
+
+
+def _array_bytes(model: CFDModel) -> int:
+    return sum(value.nbytes for value in vars(model).values() if isinstance(value, np.ndarray))
+
+
+def _start(models: list) -> dict:
+    """
+    Takes the first step and resets the models, like compare_schemes.simulate, timing both
+    """
+    started = time.perf_counter()
+    for model in models:
+        model.advance(1)
+    warm_up = time.perf_counter() - started
+    started = time.perf_counter()
+    for model in models:
+        model.reset_arrays()
+    return {'warm_up_seconds': warm_up, 'reset_seconds': time.perf_counter() - started}
+
+
+def _set_inputs(reactors: list) -> None:
+    reactors[0].set_temperature_in_degrees_celsius(150.0)
+    reactors[0].species_A_flowrate = 2.5 * FLOWRATE_UNITS
+    reactors[0].species_B_flowrate = 2.5 * FLOWRATE_UNITS
+    if len(reactors) > 1:
+        reactors[1].set_temperature_in_degrees_celsius(25.0)
+        reactors[1].species_B_flowrate = 2.5 * FLOWRATE_UNITS
+
+
+def run_case(create, duration: float, tick: float, repeat: int) -> dict:
+    """
+    :param create: Returns the reactors of the case, the first feeding the second if there are two
+    :param duration: Reactor time to simulate (s)
+    :param tick: Time simulated by each update, as the control loop does (s)
+    :param repeat: Number of timed runs, the fastest is reported
+    :return: Results of the case
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    reactors = create()
+    construction = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    startup = _start(reactors)
+
+    network = ReactorNetwork()
+    for i, reactor in enumerate(reactors):
+        network.add(reactor, upstream=reactors[i - 1] if i else None)
+
+    wall_times = []
+    outlet = None
+    steps = 0
+    for _ in range(repeat):
+        for reactor in reactors:
+            reactor.reset_arrays()
+        history = []
+        _set_inputs(reactors)
+        steps_before = sum(reactor.total_steps for reactor in reactors)
+        started = time.perf_counter()
+        for _ in range(round(duration / tick)):
+            network.update(dt=tick)
+            history.append([float(reactor.product_concentration) for reactor in reactors])
+        wall_times.append(time.perf_counter() - started)
+        steps = sum(reactor.total_steps for reactor in reactors) - steps_before
+        if outlet is None:
+            outlet = history
+        elif history != outlet:
+            raise RuntimeError('Repeated runs of the same case gave different outlet concentrations')
+
+    wall_time = min(wall_times)
+    return {
+        'nx': [reactor.nx1 for reactor in reactors],
+        'steps': steps,
+        'steps_per_second': steps / wall_time,
+        'sim_seconds_per_wall_second': duration / wall_time,
+        'wall_time': wall_time,
+        'wall_times': wall_times,
+        'construction_seconds': construction,
+        **startup,
+        'memory_bytes': memory,
+        'array_bytes': sum(_array_bytes(reactor) for reactor in reactors),
+        'outlet': outlet,
+    }
+
+
+def run(nx_values=NX_VALUES, duration: float = 600.0, tick: float = 1.0, repeat: int = 5, use_jit: bool = True) -> dict:
+    """
+    Runs a single reactor 1 at each of nx_values and reactor 1 feeding reactor 2 as in main.py
+    :return: Results of every case and of the environment
+    """
+    kernel = 'numba' if use_jit and cfd.njit is not None else 'numpy'
+    cases = {f'single_nx{nx}': (lambda nx=nx: [reactor_1(nx, UseJIT=use_jit)]) for nx in nx_values}
+    cases['chained'] = lambda: [reactor_1(UseJIT=use_jit), reactor_2(UseJIT=use_jit)]
+
+    started = time.perf_counter()
+    reactor_1(50, UseJIT=use_jit).advance(1)  # compiles or loads the kernel, so the first case is not charged for it
+    kernel_load = time.perf_counter() - started
+
+    results = {}
+    for name, create in cases.items():
+        results[name] = run_case(create, duration, tick, repeat)
+        print(f'{name:<16}{results[name]["steps_per_second"]:>14.0f} steps/s'
+              f'{results[name]["sim_seconds_per_wall_second"]:>10.1f}x real time')
+
+    return {
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'kernel': kernel,
+        'kernel_load_seconds': kernel_load,
+        'settings': {'duration': duration, 'tick': tick, 'repeat': repeat},
+        'cases': results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD,
+            tolerance: float = EQUIVALENCE_TOLERANCE) -> list:
+    """
+    :param threshold: Fraction of the baseline steps per second a case may lose
+    :param tolerance: Largest outlet concentration difference, relative to the largest baseline value
+    :return: Description of every regression, result change and case missing from either side, empty if there are
+    none.  Results of different settings or kernels are not compared.
+    """
+    problems = []
+    if results['settings'] != baseline['settings']:
+        problems.append(f'Settings {results["settings"]} differ from the baseline settings {baseline["settings"]}')
+    if results['kernel'] != baseline.get('kernel'):
+        problems.append(f'The {results["kernel"]} kernel was benchmarked, the baseline used the '
+                        f'{baseline.get("kernel")} kernel')
+    if problems:
+        return problems
+    for name in baseline['cases']:
+        if name not in results['cases']:
+            problems.append(f'{name}: in the baseline but not benchmarked')
+    for name, case in results['cases'].items():
+        if name not in baseline['cases']:
+            problems.append(f'{name}: not in the baseline')
+            continue
+        reference = baseline['cases'][name]
+        ratio = case['steps_per_second'] / reference['steps_per_second']
+        print(f'{name:<16}{ratio:>8.2f}x baseline')
+        if ratio < 1.0 - threshold:
+            problems.append(f'{name}: {case["steps_per_second"]:.0f} steps/s, {1.0 - ratio:.0%} slower than the '
+                            f'baseline {reference["steps_per_second"]:.0f} steps/s')
+        outlet = np.array(case['outlet'])
+        expected = np.array(reference['outlet'])
+        if outlet.shape != expected.shape:
+            problems.append(f'{name}: {outlet.shape} outlet concentrations, the baseline has {expected.shape}')
+            continue
+        scale = max(float(np.max(np.abs(expected))), sys.float_info.min)
+        difference = float(np.max(np.abs(outlet - expected))) / scale if outlet.size else 0.0
+        if not difference <= tolerance:
+            problems.append(f'{name}: outlet concentrations differ from the baseline by {difference:.3g} '
+                            f'(relative), more than {tolerance:.3g}')
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark CFDModel and compare against a baseline')
+    parser.add_argument('--nx', type=int, nargs='+', default=list(NX_VALUES), help='nx of the single reactor cases')
+    parser.add_argument('--duration', type=float, default=600.0, help='reactor time simulated per run (s)')
+    parser.add_argument('--tick', type=float, default=1.0, help='time simulated per update (s)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per case, the fastest is reported')
+    parser.add_argument('--no-jit', action='store_true', help='use the NumPy kernel even if numba is installed')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    parser.add_argument('--baseline', default=None, help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='fraction of the baseline steps/s a case may lose')
+    parser.add_argument('--tolerance', type=float, default=EQUIVALENCE_TOLERANCE,
+                        help='largest relative difference of the outlet concentrations from the baseline')
+    args = parser.parse_args()
+
+    results = run(args.nx, args.duration, args.tick, args.repeat, use_jit=not args.no_jit)
+    if args.output is not None:
+        with open(args.output, 'w') as stream:
+            json.dump(results, stream, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as stream:
+            problems = compare(results, json.load(stream), args.threshold, args.tolerance)
+        for problem in problems:
+            print(problem)
+        if problems:
+            exit(1)
+        print('No regressions')
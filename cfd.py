@@ -4,11 +4,28 @@ from numpy import genfromtxt, ndarray
 import math
 import random
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, CFDModel.advance falls back to the NumPy kernel
+    njit = None
+
+try:
+    from scipy.linalg.lapack import dgttrf, dgttrs
+    from scipy.linalg import solve_banded
+except ImportError:  # scipy is optional, the implicit schemes fall back to the Thomas algorithm
+    dgttrf = dgttrs = solve_banded = None
+
 """
 Constants
 """
 const_R = 8.314  # gas constant (J/mol/K)
 
+SCHEME_EXPLICIT = 'explicit'
+SCHEME_IMPLICIT = 'implicit'
+SCHEME_CRANK_NICOLSON = 'crank-nicolson'
+
+_scheme_theta = {SCHEME_EXPLICIT: 0.0, SCHEME_IMPLICIT: 1.0, SCHEME_CRANK_NICOLSON: 0.5}
+
 
 class CFDModel:
     _species_A_flowrate: float
@@ -57,6 +74,15 @@ class CFDModel:
         self.molecular_weight = kwargs['MolecularWeight'] if 'MolecularWeight' in kwargs else 334.17
 
         self.sample_steps = kwargs['SampleSteps'] if 'SampleSteps' in kwargs else 1000
+        self.use_jit = (kwargs['UseJIT'] if 'UseJIT' in kwargs else True) and njit is not None
+        self.scheme = kwargs['Scheme'] if 'Scheme' in kwargs else SCHEME_EXPLICIT  # time integration scheme
+        if self.scheme not in _scheme_theta:
+            raise ValueError(f'Unknown scheme {self.scheme}, expected one of {list(_scheme_theta)}')
+        self.adaptive_time_step = kwargs['AdaptiveTimeStep'] if 'AdaptiveTimeStep' in kwargs else False
+        self.courant_limit = kwargs['CourantLimit'] if 'CourantLimit' in kwargs else 0.9  # fraction of the stable dt
+        # k1 is only re-evaluated once the temperature profile has moved by more than this (degK), None to always
+        self.rate_temperature_tolerance = kwargs['RateTemperatureTolerance'] \
+            if 'RateTemperatureTolerance' in kwargs else None
 
         self.Ea1 = kwargs['ActivationEnergy'] if 'ActivationEnergy' in kwargs else 51080  # activation energy (J/mol)
         self.k01 = kwargs['ArrheniusFactor'] if 'ArrheniusFactor' in kwargs else 923.8  # arrhenius factor (m3/mol/s)
@@ -77,20 +103,36 @@ class CFDModel:
         self._Tn = np.ones(self.nx1)*self.T0
         self._k1 = self.k01 * np.exp(-self.Ea1 / const_R / self._T[1:-1])
         self._tolcheck = np.ones(self.nx1)
+        self._k1_temperature = self._T[1:-1].copy()  # temperature profile k1 was last evaluated at
+
+        self._rate_table = None
+        if 'RateTable' in kwargs and kwargs['RateTable']:
+            self._build_rate_table(*(kwargs['RateTableRange'] if 'RateTableRange' in kwargs else (273.0, 500.0)),
+                                   kwargs['RateTableResolution'] if 'RateTableResolution' in kwargs else 0.01)
+
+        self._work = np.empty(self.nx1 - 2)  # scratch array for the in-place stepping kernel
+        self._reaction = np.empty(self.nx1 - 2)  # reaction term shared by the species updates
+
+        self._operator_key = None  # coefficients the implicit operators were assembled for
+        self._species_solver = None
+        self._temperature_solver = None
 
         self._last_sample_time = None
+        self._last_step_count = 0
+        self._total_steps = 0
+        self._simulated_time = 0.0
 
     def reset_arrays(self):
-        self._tolcheck = np.ones(self.nx1)
-        self._A = np.ones(self.nx1)  # species A solution array
-        self._An = np.ones(self.nx1)  # species A temporary solution array
-        self._B = np.ones(self.nx1)  # species B solution array
-        self._Bn = np.ones(self.nx1)  # species B temporary solution array
-        self._C = np.zeros(self.nx1)  # species C solution array
-        self._Cn = np.zeros(self.nx1)  # species C temporary solution array
-        self._T = np.ones(self.nx1)
-        self._Tn = np.ones(self.nx1)
-        self._k1 = self.k01 * np.exp(-self.Ea1 / const_R / self._T[1:-1])
+        self._tolcheck.fill(1.0)
+        self._A.fill(1.0)  # species A solution array
+        self._An.fill(1.0)  # species A temporary solution array
+        self._B.fill(1.0)  # species B solution array
+        self._Bn.fill(1.0)  # species B temporary solution array
+        self._C.fill(0.0)  # species C solution array
+        self._Cn.fill(0.0)  # species C temporary solution array
+        self._T.fill(1.0)
+        self._Tn.fill(1.0)
+        self._update_rate_constant()
 
     # region Temperature
     @property
@@ -224,65 +266,626 @@ class CFDModel:
         """
         return np.abs((np.linalg.norm(self._tolcheck) - np.linalg.norm(self._Cn)) / np.linalg.norm(self._Cn))
 
-    def _uds(self, species: ndarray, stoichiometry: float):
-        return species[1:-1] - self.stream_velocity * (self.dt1 / self.dx1) * (species[1:-1] - species[:-2]) \
-               + self.D1 * self.dt1 / self.dx1 ** 2 * (species[2:] - 2 * species[1:-1] + species[:-2]) \
-               + stoichiometry * self._k1 * self._An[1:-1] * self._Bn[1:-1] * self.dt1
+    def _build_rate_table(self, minimum: float, maximum: float, resolution: float) -> None:
+        """
+        Tabulates the Arrhenius rate constant for linear interpolation in the compiled kernel.  Temperatures outside
+        the table are evaluated exactly.  (NumPy's vectorised exp is faster than a table lookup done with NumPy
+        calls, so the NumPy kernel keeps evaluating exp.)
+        :param minimum: Lowest tabulated temperature (degK)
+        :param maximum: Highest tabulated temperature (degK)
+        :param resolution: Temperature spacing of the table (degK)
+        :return: None
+        """
+        temperatures = np.arange(minimum, maximum + resolution, resolution)
+        self._rate_table = self.k01 * np.exp(-self.Ea1 / const_R / temperatures)
+        self._rate_table_slope = np.diff(self._rate_table)
+        self._rate_table_minimum = minimum
+        self._rate_table_resolution = resolution
+
+        # linear interpolation error is at most resolution^2/8 * max|k1''|, relative to k1 that is max|k1''/k1|
+        theta = self.Ea1 / const_R
+        curvature = np.abs(theta ** 2 / temperatures ** 4 - 2 * theta / temperatures ** 3)
+        self._rate_table_error_bound = float(resolution ** 2 / 8 * np.max(curvature) * math.exp(theta * resolution /
+                                                                                              minimum ** 2))
 
-    def update(self, dt = None) -> None:
+    @property
+    def rate_table_error_bound(self) -> float:
         """
-        Function that uses all defined and calculated values to solve for the reaction progression in the tubular reactor
+        Bound on the relative error of the interpolated rate constant over the table range, e.g. 8e-8 for the default
+        51080 J/mol activation energy tabulated every 0.01 K from 273 to 500 K
+        :return: Relative error, None when there is no table
+        """
+        return self._rate_table_error_bound if self._rate_table is not None else None
+
+    def _update_rate_constant(self) -> None:
+        """
+        Re-evaluates the Arrhenius rate constant from the interior temperature profile in place, unless the profile
+        is within RateTemperatureTolerance of the one k1 was last evaluated at
         :return: None
         """
-        now = time.time()
-        num_steps = 1000
-        if dt is None:
-            if not self._last_sample_time:
-                self._last_sample_time = now
-            else:
-                time_difference = now - self._last_sample_time
-                num_steps = time_difference / self.dt1
-                self._last_sample_time = now
+        if self.rate_temperature_tolerance is not None:
+            work = self._work
+            np.subtract(self._T[..., 1:-1], self._k1_temperature, out=work)
+            np.abs(work, out=work)
+            if work.max() <= self.rate_temperature_tolerance:
+                return
+            np.copyto(self._k1_temperature, self._T[..., 1:-1])
+        np.divide(-self.Ea1 / const_R, self._T[..., 1:-1], out=self._k1)
+        np.exp(self._k1, out=self._k1)
+        np.multiply(self.k01, self._k1, out=self._k1)
+
+    def _uds(self, species: ndarray, out: ndarray, reaction: ndarray, stoichiometry: float,
+             cfl: float, diffusion_number: float) -> None:
+        """
+        Upwind differencing of one species, written into the interior of the new solution array
+        :param species: Previous solution array of the species
+        :param out: Interior view of the new solution array
+        :param reaction: Reaction term k1*A*B*dt evaluated on the previous solution
+        :param stoichiometry: -1.0 for consumed species, 1.0 for the product
+        :param cfl: Courant number u*dt/dx
+        :param diffusion_number: D1*dt/dx^2
+        :return: None
+        """
+        work = self._work
+        np.subtract(species[..., 1:-1], species[..., :-2], out=work)
+        np.multiply(cfl, work, out=work)
+        np.subtract(species[..., 1:-1], work, out=out)
+        np.multiply(2, species[..., 1:-1], out=work)
+        np.subtract(species[..., 2:], work, out=work)
+        np.add(work, species[..., :-2], out=work)
+        np.multiply(diffusion_number, work, out=work)
+        np.add(out, work, out=out)
+        if stoichiometry < 0:
+            np.subtract(out, reaction, out=out)
         else:
-            num_steps = dt / self.dt1
+            np.add(out, reaction, out=out)
 
-        stepcount = 0
+    def _step(self, cfl: float, diffusion_number: float, inlet_A: float, inlet_B: float,
+              wall_temperature: float, wall_loss: float) -> None:
+        """
+        Advances the solution arrays by one time step.  The previous solution is kept by swapping the solution and
+        temporary arrays rather than copying them, and all arithmetic is done in place, so a step does not allocate.
+        :param cfl: Courant number u*dt/dx
+        :param diffusion_number: D1*dt/dx^2
+        :param inlet_A: Species A stream concentration at the inlet (mol/m3)
+        :param inlet_B: Species B stream concentration at the inlet (mol/m3)
+        :param wall_temperature: Temperature outside the tubing (degK)
+        :param wall_loss: h*D*pi
+        :return: None
+        """
+        nx = self.nx1
+        work = self._work
+
+        self._T[..., 0] = self.T0  # impose dirichlet BC
+        self._T[..., nx - 1] = self._T[..., nx - 2]  # impose neumann BC
+        self._T, self._Tn = self._Tn, self._T  # update temporary array
+        T, Tn = self._T, self._Tn
+        T[..., 0] = Tn[..., 0]
+        T[..., nx - 1] = Tn[..., nx - 1]
+
+        interior = T[..., 1:-1]
+        np.subtract(Tn[..., 1:-1], Tn[..., :-2], out=work)  # advection
+        np.multiply(cfl, work, out=work)
+        np.subtract(Tn[..., 1:-1], work, out=interior)
+        np.multiply(2, Tn[..., 1:-1], out=work)  # conduction
+        np.subtract(Tn[..., 2:], work, out=work)
+        np.add(work, Tn[..., :-2], out=work)
+        np.multiply(self.lam, work, out=work)
+        np.add(interior, work, out=interior)
+        np.subtract(Tn[..., 1:-1], wall_temperature, out=work)  # heat loss through the tubing wall
+        np.multiply(wall_loss, work, out=work)
+        np.multiply(work, self.dt1, out=work)
+        np.divide(work, self.p, out=work)
+        np.divide(work, self.Cp, out=work)
+        np.multiply(work, self.xl1, out=work)
+        np.divide(work, self.V1, out=work)
+        np.subtract(interior, work, out=interior)
+        np.multiply(self.dHr, self._k1, out=work)  # heat of reaction
+        np.multiply(work, self._A[..., 1:-1], out=work)
+        np.multiply(work, self._B[..., 1:-1], out=work)
+        np.divide(work, self.p, out=work)
+        np.divide(work, self.Cp, out=work)
+        np.multiply(work, self.dt1, out=work)
+        np.subtract(interior, work, out=interior)
+        self._update_rate_constant()
+
+        self._A[..., 0] = inlet_A
+        self._B[..., 0] = inlet_B
+        self._A[..., nx - 1] = self._A[..., nx - 2]
+        self._B[..., nx - 1] = self._B[..., nx - 2]
+        self._C[..., nx - 1] = self._C[..., nx - 2]
+
+        self._A, self._An = self._An, self._A
+        self._B, self._Bn = self._Bn, self._B
+        self._C, self._Cn = self._Cn, self._C
+        for new, old in ((self._A, self._An), (self._B, self._Bn), (self._C, self._Cn)):
+            new[..., 0] = old[..., 0]
+            new[..., nx - 1] = old[..., nx - 1]
+
+        # the reaction term is shared by all three species; only its sign differs
+        reaction = self._reaction
+        np.multiply(self._k1, self._An[..., 1:-1], out=reaction)
+        np.multiply(reaction, self._Bn[..., 1:-1], out=reaction)
+        np.multiply(reaction, self.dt1, out=reaction)
+
+        self._uds(self._An, self._A[..., 1:-1], reaction, -1.0, cfl, diffusion_number)
+        self._uds(self._Bn, self._B[..., 1:-1], reaction, -1.0, cfl, diffusion_number)
+        self._uds(self._Cn, self._C[..., 1:-1], reaction, 1.0, cfl, diffusion_number)
+
+    def _assemble_operators(self, cfl: float, diffusion_number: float, wall_loss: float) -> None:
+        """
+        Factorises the left hand side matrices of the theta scheme for the current flowrate.  Interior nodes are the
+        unknowns; the inlet is a Dirichlet condition and the outlet a zero-gradient condition folded into the last row.
+        :return: None
+        """
+        theta = _scheme_theta[self.scheme]
+        n = self.nx1 - 2
+        heat_loss = wall_loss * self.dt1 / self.p / self.Cp * self.xl1 / self.V1
+
+        diagonal = np.full(n, 1.0 + theta * (cfl + 2 * diffusion_number))
+        diagonal[-1] = 1.0 + theta * (cfl + diffusion_number)
+        self._species_solver = _TridiagonalSolver(np.full(n - 1, -theta * (cfl + diffusion_number)), diagonal,
+                                                  np.full(n - 1, -theta * diffusion_number))
+
+        diagonal = np.full(n, 1.0 + theta * (cfl + 2 * self.lam + heat_loss))
+        diagonal[-1] = 1.0 + theta * (cfl + self.lam + heat_loss)
+        self._temperature_solver = _TridiagonalSolver(np.full(n - 1, -theta * (cfl + self.lam)), diagonal,
+                                                      np.full(n - 1, -theta * self.lam))
+        self._operator_key = (self.scheme, self.dt1, cfl, diffusion_number, wall_loss)
+
+    def _implicit_step(self, cfl: float, diffusion_number: float, inlet_A: float, inlet_B: float,
+                       wall_temperature: float, wall_loss: float) -> None:
+        """
+        Advances the solution by one theta scheme step: advection, dispersion, conduction and wall heat loss are
+        implicit (backward Euler or Crank-Nicolson), the reaction terms are explicit.
+        :return: None
+        """
+        if self._operator_key != (self.scheme, self.dt1, cfl, diffusion_number, wall_loss):
+            self._assemble_operators(cfl, diffusion_number, wall_loss)
+        theta = _scheme_theta[self.scheme]
+        nx = self.nx1
+        heat_loss = wall_loss * self.dt1 / self.p / self.Cp * self.xl1 / self.V1
+
+        T = self._T
+        T[0] = self.T0
+        T[nx - 1] = T[nx - 2]
+        rhs = T[1:-1] + (1 - theta) * (_transport(T, cfl, self.lam) - heat_loss * T[1:-1]) + heat_loss * wall_temperature \
+              - self.dHr * self._k1 * self._A[1:-1] * self._B[1:-1] / self.p / self.Cp * self.dt1
+        rhs[0] += theta * (cfl + self.lam) * T[0]
+        T[1:-1] = self._temperature_solver.solve(rhs[:, np.newaxis])[:, 0]
+        T[nx - 1] = T[nx - 2]
+        self._update_rate_constant()
+
+        self._A[0] = inlet_A
+        self._B[0] = inlet_B
+        species = (self._A, self._B, self._C)
+        for s in species:
+            s[nx - 1] = s[nx - 2]
+        reaction = self._k1 * self._A[1:-1] * self._B[1:-1] * self.dt1
+        rhs = np.empty((nx - 2, 3), order='F')
+        for column, (s, stoichiometry) in enumerate(zip(species, (-1.0, -1.0, 1.0))):
+            rhs[:, column] = s[1:-1] + (1 - theta) * _transport(s, cfl, diffusion_number) + stoichiometry * reaction
+            rhs[0, column] += theta * (cfl + diffusion_number) * s[0]
+        solution = self._species_solver.solve(rhs)
+        for column, s in enumerate(species):
+            s[1:-1] = solution[:, column]
+            s[nx - 1] = s[nx - 2]
+
+    def advance(self, n_steps: int, inlet_A_history: ndarray = None, outlet_history: ndarray = None) -> None:
+        """
+        Advances the solution by n_steps time steps of dt1.  Everything that is constant over the batch (Courant and
+        diffusion numbers, wall heat loss, inlet concentrations) is evaluated once, then the steps run in the compiled
+        kernel when numba is installed or in the NumPy kernel otherwise.
+        :param n_steps: Number of time steps
+        :param inlet_A_history: Species A stream concentration at the inlet for each step (mol/m3), e.g. the outlet
+        history of an upstream reactor, instead of the constant species_A_stream_concentration
+        :param outlet_history: Array that receives the outlet product concentration (mol/m3) after each step
+        :return: None
+        """
+        if n_steps <= 0:
+            return
+
+        cfl = self.stream_velocity * (self.dt1 / self.dx1)
+        diffusion_number = self.D1 * self.dt1 / self.dx1 ** 2
+        inlet_A = float(self.species_A_stream_concentration)
+        inlet_B = float(self.species_B_stream_concentration)
+        wall_temperature = float(self.temperature)
+        wall_loss = self.h * self.D * math.pi
+
+        if self.scheme == SCHEME_EXPLICIT and self.use_jit:
+            tolerance = -1.0 if self.rate_temperature_tolerance is None else float(self.rate_temperature_tolerance)
+            table = (_empty_table, _empty_table, 0.0, 1.0) if self._rate_table is None else \
+                (self._rate_table, self._rate_table_slope, self._rate_table_minimum, 1.0 / self._rate_table_resolution)
+            swapped = _explicit_kernel(n_steps, self._A, self._An, self._B, self._Bn, self._C, self._Cn,
+                                       self._T, self._Tn, self._k1, inlet_A, inlet_B, self.T0, wall_temperature,
+                                       cfl, diffusion_number, self.lam, wall_loss, self.dHr, self.p, self.Cp,
+                                       self.xl1, self.V1, self.k01, -self.Ea1 / const_R, self.dt1,
+                                       self._k1_temperature, tolerance, *table,
+                                       _empty_table if inlet_A_history is None else inlet_A_history,
+                                       _empty_table if outlet_history is None else outlet_history)
+            if swapped:
+                self._A, self._An = self._An, self._A
+                self._B, self._Bn = self._Bn, self._B
+                self._C, self._Cn = self._Cn, self._C
+                self._T, self._Tn = self._Tn, self._T
+        else:
+            step = self._step if self.scheme == SCHEME_EXPLICIT else self._implicit_step
+            for n in range(n_steps):
+                if inlet_A_history is not None:
+                    inlet_A = inlet_A_history[n]
+                step(cfl, diffusion_number, inlet_A, inlet_B, wall_temperature, wall_loss)
+                if outlet_history is not None:
+                    outlet_history[n] = self._C[..., self.nx1 - 1]
+
+        np.copyto(self._tolcheck, self._C)
+
+    def _steady_state_residual(self, u: ndarray, inlet: ndarray, wall_temperature: float, velocity: float,
+                               k01: float, Ea1: float):
+        """
+        Residual of the steady state equations and its Jacobian in banded form.  The unknowns are interleaved per node
+        as A, B, C, T so the Jacobian has four bands either side of the diagonal.
+        :param u: Unknowns, shape (nx, 4)
+        :param inlet: Inlet values of A, B, C and T
+        :param wall_temperature: Temperature outside the tubing (degK)
+        :param velocity: Average velocity (m/s)
+        :param k01: Arrhenius factor
+        :param Ea1: Activation energy (J/mol)
+        :return: Residual (4*nx,), banded Jacobian (9, 4*nx)
+        """
+        nx = self.nx1
+        advection = velocity / self.dx1
+        dispersion = np.array([self.D1, self.D1, self.D1, self.a]) / self.dx1 ** 2
+        heat_loss = self.h * self.D * math.pi / self.p / self.Cp * self.xl1 / self.V1
+        heat_of_reaction = self.dHr / self.p / self.Cp
+
+        A, B, T = u[1:-1, 0], u[1:-1, 1], u[1:-1, 3]
+        k1 = k01 * np.exp(-Ea1 / const_R / T)
+        dk1_dT = k1 * Ea1 / const_R / T ** 2
+        rate = k1 * A * B
+
+        residual = np.empty((nx, 4))
+        residual[0] = u[0] - inlet
+        residual[nx - 1] = u[nx - 1] - u[nx - 2]
+        residual[1:-1] = -advection * (u[1:-1] - u[:-2]) + dispersion * (u[2:] - 2 * u[1:-1] + u[:-2])
+        residual[1:-1, 0] -= rate
+        residual[1:-1, 1] -= rate
+        residual[1:-1, 2] += rate
+        residual[1:-1, 3] -= heat_loss * (T - wall_temperature) + heat_of_reaction * rate
+
+        # jacobian[4 + row - column, column] = d residual[row] / d u[column]
+        n = 4 * nx
+        jacobian = np.zeros((9, n))
+        rows = np.arange(n).reshape(nx, 4)
+
+        def add(row, column, value):
+            np.add.at(jacobian, (4 + row - column, column), value)
+
+        add(rows[0], rows[0], 1.0)
+        add(rows[-1], rows[-1], 1.0)
+        add(rows[-1], rows[-2], -1.0)
+        interior = rows[1:-1]
+        add(interior, interior, -advection - 2 * dispersion)
+        add(interior, rows[:-2], advection + dispersion)
+        add(interior, rows[2:], dispersion)
+        add(interior[:, 3], interior[:, 3], -heat_loss)
+        for variable, stoichiometry in ((0, -1.0), (1, -1.0), (2, 1.0), (3, -heat_of_reaction)):
+            add(interior[:, variable], interior[:, 0], stoichiometry * k1 * B)
+            add(interior[:, variable], interior[:, 1], stoichiometry * k1 * A)
+            add(interior[:, variable], interior[:, 3], stoichiometry * dk1_dT * A * B)
+        return residual.ravel(), jacobian
+
+    def _newton_steady_state(self, inlet: ndarray, wall_temperature: float, velocity: float, k01: float, Ea1: float,
+                             max_iterations: int) -> ndarray:
+        """
+        Damped Newton iteration on the banded Jacobian of _steady_state_residual, starting from the inlet values
+        :return: Steady state unknowns, shape (nx, 4)
+        """
+        nx = self.nx1
+        u = np.empty((nx, 4))
+        u[:] = inlet
+        u[1:, 3] = wall_temperature
+        parameters = (inlet, wall_temperature, velocity, k01, Ea1)
+
+        residual, jacobian = self._steady_state_residual(u, *parameters)
+        norm = np.linalg.norm(residual)
+        for iteration in range(max_iterations):
+            step = _solve_banded((4, 4), jacobian, -residual).reshape(nx, 4)
+            damping = 1.0
+            while True:
+                trial = u + damping * step
+                if np.all(trial[:, 3] > 0):
+                    trial_residual, trial_jacobian = self._steady_state_residual(trial, *parameters)
+                    trial_norm = np.linalg.norm(trial_residual)
+                    if trial_norm < norm or damping < 1e-4:
+                        break
+                damping /= 2
+            u, residual, jacobian, norm = trial, trial_residual, trial_jacobian, trial_norm
+            if damping * np.linalg.norm(step) <= self.reltol * np.linalg.norm(u):
+                return u
+        raise RuntimeError(f'Steady state did not converge in {max_iterations} iterations')
+
+    def solve_steady_state(self, max_iterations: int = 50) -> tuple:
+        """
+        Solves the steady state A/B/C/T boundary value problem for the current flowrates, stock concentrations and
+        temperature directly, by damped Newton iteration on the banded Jacobian, instead of marching update() until
+        the profiles stop changing.  The solution replaces the current profiles.
+        :param max_iterations: Maximum number of Newton iterations
+        :return: Steady state A, B, C and T profiles
+        """
+        inlet = np.array([self.species_A_stream_concentration, self.species_B_stream_concentration,
+                          self._C[0], self.T0], dtype=float)
+        u = self._newton_steady_state(inlet, float(self.temperature), self.stream_velocity, self.k01, self.Ea1,
+                                      max_iterations)
+
+        for array, column in ((self._A, 0), (self._An, 0), (self._B, 1), (self._Bn, 1), (self._C, 2), (self._Cn, 2),
+                              (self._T, 3), (self._Tn, 3), (self._tolcheck, 2)):
+            array[:] = u[:, column]
+        self._update_rate_constant()
+        return self._A.copy(), self._B.copy(), self._C.copy(), self._T.copy()
+
+    # region Time step
+    @property
+    def time_step(self) -> float:
+        """
+        :return: Time step currently used by the solver (s)
+        """
+        return self.dt1
 
-        while stepcount < num_steps:
+    @property
+    def last_step_count(self) -> int:
+        """
+        :return: Number of time steps taken by the last call to update
+        """
+        return self._last_step_count
 
-            self._T[0] = self.T0  # impose dirichlet BC
-            self._T[self.nx1 - 1] = self._T[self.nx1 - 2]  # impose neumann BC
-            self._Tn = self._T.copy()  # update temporary array
+    @property
+    def total_steps(self) -> int:
+        """
+        :return: Number of time steps taken since the model was created
+        """
+        return self._total_steps
 
-            self._T[1:-1] = self._Tn[1:-1] - (
-                        self.stream_velocity * (self.dt1 / self.dx1) * (self._Tn[1:-1] - self._Tn[:-2])) \
-                            + self.lam * (self._Tn[2:] - 2 * self._Tn[1:-1] + self._Tn[:-2]) \
-                            - self.h * self.D * math.pi * (self._Tn[
-                                                           1:-1] - self.temperature) * self.dt1 / self.p / self.Cp * self.xl1 / self.V1 \
-                            - self.dHr * self._k1 * self._A[1:-1] * self._B[1:-1] / self.p / self.Cp * self.dt1
-            self._k1 = self.k01 * np.exp(-self.Ea1 / const_R / self._T[1:-1])
+    @property
+    def simulated_time(self) -> float:
+        """
+        :return: Reactor time simulated since the model was created (s)
+        """
+        return self._simulated_time
 
-            self._A[0] = self.species_A_stream_concentration
-            self._B[0] = self.species_B_stream_concentration
-            self._A[self.nx1 - 1] = self._A[self.nx1 - 2]
-            self._B[self.nx1 - 1] = self._B[self.nx1 - 2]
-            self._C[self.nx1 - 1] = self._C[self.nx1 - 2]
+    @property
+    def stable_time_step(self) -> float:
+        """
+        Largest time step the scheme takes without losing positivity or accuracy, from the advection (stream_velocity),
+        dispersion (D1), conduction (lam), wall heat loss and reaction rates.  For the explicit scheme this keeps every
+        update coefficient non-negative.  The implicit and Crank-Nicolson schemes treat the transport terms with weight
+        theta implicitly, so only the explicit remainder, (1 - theta) of the transport and all of the reaction, limits
+        the step; the explicit advection/conduction limit does not apply to them.  As those schemes are stable at any
+        Courant number but smear the reaction front once it moves more than one node per step, their step is also
+        limited to a Courant number of one.
+        :return: Time step (s), infinite if nothing limits it
+        """
+        theta = _scheme_theta[self.scheme]
+        advection = np.max(np.abs(self.stream_velocity)) / self.dx1
+        dispersion = 2 * self.D1 / self.dx1 ** 2
+        conduction = 2 * self.a / self.dx1 ** 2
+        heat_loss = self.h * self.D * math.pi / self.p / self.Cp * self.xl1 / self.V1
+        hottest = max(np.max(self._T), self.temperature, self.T0)
+        reaction = np.max(self.k01 * np.exp(-self.Ea1 / const_R / hottest)) * max(
+            np.max(np.abs(self.species_A_stream_concentration)), np.max(np.abs(self.species_B_stream_concentration)),
+            np.max(np.abs(self._A)), np.max(np.abs(self._B)))
+        rate = max((1 - theta) * (advection + dispersion) + reaction, (1 - theta) * (advection + conduction + heat_loss))
+        if theta > 0:
+            rate = max(rate, advection)  # accuracy limit, Courant number one
+        return float(1.0 / rate) if rate > 0 else math.inf
+
+    def _set_time_step(self, dt: float) -> None:
+        self.dt1 = dt
+        self.lam = self.a * self.dt1 / self.dx1 ** 2  # heat transfer coefficient
 
-            self._An = self._A.copy()
-            self._Bn = self._B.copy()
-            self._Cn = self._C.copy()
+    # endregion
 
-            self._A[1:-1] = self._uds(self._An, -1.0)  # UDS(u1, dt1, dx1, D1, k1, An, An, Bn, -1.0)
-            self._B[1:-1] = self._uds(self._Bn, -1.0)  # UDS(u1, dt1, dx1, D1, k1, Bn, An, Bn, -1.0)
-            self._C[1:-1] = self._uds(self._Cn, 1.0)  # UDS(u1, dt1, dx1, D1, k1, Cn, An, Bn, 1.0)
+    def _record_steps(self, num_steps: int) -> None:
+        self._last_step_count = num_steps
+        self._total_steps += num_steps
+        self._simulated_time += num_steps * self.dt1
 
-            self._tolcheck = self._C.copy()
-            stepcount += 1  # update counter
+    def update(self, dt = None) -> None:
+        """
+        Function that uses all defined and calculated values to solve for the reaction progression in the tubular reactor
+        When AdaptiveTimeStep is set, the time step is re-evaluated from the current flowrates and profiles and the
+        elapsed time is covered with the fewest steps that stay within CourantLimit of stable_time_step, which for the
+        implicit and Crank-Nicolson schemes is an accuracy limit rather than the explicit stability limit.
+        :return: None
+        """
+        num_steps, time_step, self._last_sample_time = step_count(
+            dt, self.dt1, self._last_sample_time,
+            (lambda: self.courant_limit * self.stable_time_step) if self.adaptive_time_step else None)
+        if time_step != self.dt1:
+            self._set_time_step(time_step)
+
+        self.advance(num_steps)
+        self._record_steps(num_steps)
+
+
+def step_count(dt, time_step: float, last_sample_time, stable_time_step=None) -> tuple:
+    """
+    Number of time steps needed to cover dt, or the wall time since last_sample_time when dt is None.  The first wall
+    time call, without a last_sample_time, takes 1000 steps.
+    :param dt: Time to cover (s), None for the wall time since the last call
+    :param time_step: Current time step (s)
+    :param last_sample_time: Wall time returned by the previous call, None on the first call
+    :param stable_time_step: Function returning the largest time step allowed, when given the time is covered with
+    the fewest steps within it instead of with steps of time_step
+    :return: Number of steps, time step to take them with (s) and wall time to pass to the next call
+    """
+    num_steps = 1000
+    if dt is None:
+        now = time.time()
+        if last_sample_time:
+            num_steps = (now - last_sample_time) / time_step
+        last_sample_time = now
+    else:
+        num_steps = dt / time_step
+
+    if stable_time_step is not None and num_steps > 0:
+        elapsed = num_steps * time_step
+        num_steps = max(math.ceil(elapsed / stable_time_step()), 1)
+        time_step = elapsed / num_steps
+
+    return max(math.ceil(num_steps), 0), time_step, last_sample_time
+
+
+def _solve_banded(l_and_u: tuple, ab: ndarray, b: ndarray) -> ndarray:
+    """
+    Solves a banded system stored as for scipy.linalg.solve_banded, using scipy when available and Gaussian
+    elimination without pivoting otherwise
+    """
+    if solve_banded is not None:
+        return solve_banded(l_and_u, ab, b)
+    lower, upper = l_and_u
+    n = ab.shape[1]
+    dense = np.zeros((n, lower + upper + 1))  # row i holds columns i - lower to i + upper
+    for diagonal in range(-lower, upper + 1):
+        band = ab[upper - diagonal]
+        rows = np.arange(max(0, -diagonal), min(n, n - diagonal))
+        dense[rows, lower + diagonal] = band[rows + diagonal]
+    x = np.array(b, dtype=float)
+    for i in range(n):
+        pivot_row = dense[i, lower:]
+        for k in range(1, min(lower, n - 1 - i) + 1):
+            factor = dense[i + k, lower - k] / pivot_row[0]
+            dense[i + k, lower - k:lower - k + upper + 1] -= factor * pivot_row
+            x[i + k] -= factor * x[i]
+    for i in range(n - 1, -1, -1):
+        width = min(upper, n - 1 - i)
+        x[i] = (x[i] - dense[i, lower + 1:lower + 1 + width] @ x[i + 1:i + 1 + width]) / dense[i, lower]
+    return x
+
+
+def _transport(species: ndarray, cfl: float, diffusion_number: float) -> ndarray:
+    """
+    Upwind advection plus central dispersion of a solution array, evaluated on the interior nodes
+    """
+    return -cfl * (species[1:-1] - species[:-2]) + diffusion_number * (species[2:] - 2 * species[1:-1] + species[:-2])
+
+
+class _TridiagonalSolver:
+    """
+    LU factorisation of a constant tridiagonal matrix, reused for every time step until the flowrate changes.  Uses
+    LAPACK gttrf/gttrs through scipy when available and the Thomas algorithm otherwise.
+    """
+
+    def __init__(self, lower: ndarray, diagonal: ndarray, upper: ndarray):
+        if dgttrf is not None:
+            self._factors = dgttrf(lower, diagonal, upper)[:5]
+        else:
+            n = diagonal.shape[0]
+            self._lower = lower.tolist()
+            self._upper = [0.0] * (n - 1)
+            self._pivot = [float(diagonal[0])] + [0.0] * (n - 1)
+            for i in range(1, n):
+                self._upper[i - 1] = upper[i - 1] / self._pivot[i - 1]
+                self._pivot[i] = diagonal[i] - self._lower[i - 1] * self._upper[i - 1]
+
+    def solve(self, rhs: ndarray) -> ndarray:
+        """
+        :param rhs: Right hand sides, one per column
+        :return: Solutions, one per column
+        """
+        if dgttrf is not None:
+            x, info = dgttrs(*self._factors, rhs, overwrite_b=1)
+            return x
+        lower, upper, pivot = self._lower, self._upper, self._pivot
+        n = rhs.shape[0]
+        for column in range(rhs.shape[1]):
+            x = rhs[:, column].tolist()  # plain floats are much faster than array elements in these sweeps
+            x[0] /= pivot[0]
+            for i in range(1, n):
+                x[i] = (x[i] - lower[i - 1] * x[i - 1]) / pivot[i]
+            for i in range(n - 2, -1, -1):
+                x[i] -= upper[i] * x[i + 1]
+            rhs[:, column] = x
+        return rhs
+
+
+_empty_table = np.empty(0)
+
+
+def _explicit_kernel(n_steps, A, An, B, Bn, C, Cn, T, Tn, k1, inlet_A, inlet_B, T0, wall_temperature,
+                     cfl, diffusion_number, lam, wall_loss, dHr, p, Cp, xl, V, k01, Ea_R, dt,
+                     k1_temperature, tolerance, table, table_slope, table_minimum, table_inverse_resolution,
+                     inlet_A_history, outlet_history):
+    """
+    Loop form of CFDModel._step for numba.  The terms are evaluated in the same order as the NumPy kernel.  A negative
+    tolerance re-evaluates k1 every step, an empty table evaluates exp, an empty inlet history uses inlet_A and an
+    empty outlet history records nothing.
+    :return: True if the solution ended up in the temporary arrays
+    """
+    nx = A.shape[0]
+    for step in range(n_steps):
+        T[0] = T0
+        T[nx - 1] = T[nx - 2]
+        T, Tn = Tn, T
+        T[0] = Tn[0]
+        T[nx - 1] = Tn[nx - 1]
+        for i in range(1, nx - 1):
+            advection = cfl * (Tn[i] - Tn[i - 1])
+            conduction = lam * (Tn[i + 1] - 2 * Tn[i] + Tn[i - 1])
+            heat_loss = wall_loss * (Tn[i] - wall_temperature) * dt / p / Cp * xl / V
+            heat_of_reaction = dHr * k1[i - 1] * A[i] * B[i] / p / Cp * dt
+            T[i] = Tn[i] - advection + conduction - heat_loss - heat_of_reaction
+        changed = tolerance < 0
+        for i in range(1, nx - 1):
+            if changed:
+                break
+            changed = not abs(T[i] - k1_temperature[i - 1]) <= tolerance
+        if changed:
+            last = table.shape[0] - 1
+            for i in range(1, nx - 1):
+                k1_temperature[i - 1] = T[i]
+                x = (T[i] - table_minimum) * table_inverse_resolution
+                if 0 <= x < last:
+                    j = int(x)
+                    k1[i - 1] = table[j] + (x - j) * table_slope[j]
+                else:
+                    k1[i - 1] = k01 * math.exp(Ea_R / T[i])
+
+        A[0] = inlet_A_history[step] if inlet_A_history.shape[0] > 0 else inlet_A
+        B[0] = inlet_B
+        A[nx - 1] = A[nx - 2]
+        B[nx - 1] = B[nx - 2]
+        C[nx - 1] = C[nx - 2]
+        A, An = An, A
+        B, Bn = Bn, B
+        C, Cn = Cn, C
+        A[0] = An[0]
+        B[0] = Bn[0]
+        C[0] = Cn[0]
+        A[nx - 1] = An[nx - 1]
+        B[nx - 1] = Bn[nx - 1]
+        C[nx - 1] = Cn[nx - 1]
+        for i in range(1, nx - 1):
+            reaction = k1[i - 1] * An[i] * Bn[i] * dt
+            A[i] = An[i] - cfl * (An[i] - An[i - 1]) + diffusion_number * (An[i + 1] - 2 * An[i] + An[i - 1]) - reaction
+            B[i] = Bn[i] - cfl * (Bn[i] - Bn[i - 1]) + diffusion_number * (Bn[i + 1] - 2 * Bn[i] + Bn[i - 1]) - reaction
+            C[i] = Cn[i] - cfl * (Cn[i] - Cn[i - 1]) + diffusion_number * (Cn[i + 1] - 2 * Cn[i] + Cn[i - 1]) + reaction
+        if outlet_history.shape[0] > 0:
+            outlet_history[step] = C[nx - 1]
+    return n_steps % 2 == 1
+
+
+if njit is not None:
+    _explicit_kernel = njit(cache=True)(_explicit_kernel)
 
 
 if __name__ == '__main__':
+    from reactor_network import ReactorNetwork
+
     reactor_1 = CFDModel(1200, 1000, nx=1500, Volume=10e-6)
     reactor_2 = CFDModel(0, 1250, Volume=5e-6, ActivationEnergy=23681, ArrheniusFactor=11.3, nx=750)
+    network = ReactorNetwork()
+    network.add(reactor_1)
+    network.add(reactor_2, upstream=reactor_1)
 
     start_time = time.time()
 
@@ -304,12 +907,8 @@ if __name__ == '__main__':
                 else:
                     reactor_1.species_B_flowrate = 2.5 * 1.66667e-8
     
-                reactor_1.update()
-
-                reactor_2.species_A_flowrate = reactor_1.species_A_flowrate + reactor_1.species_B_flowrate
                 reactor_2.species_B_flowrate = 2.5 * 1.66667e-8
-                reactor_2.species_A_stock_concentration = reactor_1.default_product_concentration
-                reactor_2.update()
+                network.update()
 
                 t = time.time() - start_time
                 print(f'The predicted product output concentration at {t} seconds is:\n'
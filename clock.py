@@ -0,0 +1,58 @@
+import time
+from datetime import datetime
+
+"""
+Clocks for the control loop.  Clock is wall time; ReplayClock is a simulated time that replay.py moves forward itself,
+so a recorded run can be replayed faster than real time.
+"""
+
+
+class Clock:
+    """
+    Wall clock
+    """
+
+    def time(self) -> float:
+        """
+        :return: Seconds since the epoch
+        """
+        return time.time()
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.time())
+
+    def monotonic(self) -> float:
+        """
+        :return: Seconds that never jump backwards, for deadlines
+        """
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class ReplayClock(Clock):
+    """
+    Clock that only moves when told to, starting at the time a recording started
+    """
+
+    def __init__(self, start_time: float):
+        """
+        :param start_time: Seconds since the epoch the clock starts at
+        """
+        self._time = start_time
+
+    def time(self) -> float:
+        return self._time
+
+    def monotonic(self) -> float:
+        return self._time
+
+    def advance(self, seconds: float) -> None:
+        self._time += seconds
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Moves the clock forward instead of waiting, only meant for code that runs on the replay thread
+        """
+        self.advance(seconds)
@@ -0,0 +1,59 @@
+import time
+import numpy as np
+from cfd import CFDModel, SCHEME_EXPLICIT, SCHEME_IMPLICIT, SCHEME_CRANK_NICOLSON
+
+"""
+Stability and accuracy comparison of the CFDModel time integration schemes on the two-reactor configuration used by
+main.py.  Every case is compared against the explicit scheme at the dt main.py runs with.
+"""
+
+REFERENCE_DT = 0.005
+
+
+def simulate(scheme: str, dt: float, duration: float = 600.0, tick: float = 1.0):
+    """
+    Runs reactor 1 feeding reactor 2 through a start-up and a flowrate step, coupling them once per tick like
+    main.step_3_and_4 does
+    :return: Outlet concentration history (mg/mL) of both reactors and the wall time taken (s)
+    """
+    reactor1 = CFDModel(1200, 1000, nx=500, Volume=10e-6, dt=dt, Scheme=scheme)
+    reactor2 = CFDModel(1, 1250, nx=400, Volume=5e-6 + 3.36e-6, dt=dt, ArrheniusFactor=11.3, ActivationEnergy=23681,
+                        MolecularWeight=346.0, Scheme=scheme)
+    reactor1.advance(1)  # compile the kernels before timing
+    reactor2.advance(1)
+    reactor1.reset_arrays()
+    reactor2.reset_arrays()
+
+    history = []
+    start = time.perf_counter()
+    with np.errstate(all='ignore'):
+        for t in np.arange(0.0, duration, tick):
+            flowrate = 2.5 if t < duration / 2 else 1.7
+            reactor1.set_temperature_in_degrees_celsius(150.0)
+            reactor1.species_A_flowrate = flowrate * 1.667e-8
+            reactor1.species_B_flowrate = flowrate * 1.667e-8
+            reactor1.update(dt=tick)
+
+            reactor2.set_temperature_in_degrees_celsius(25.0)
+            reactor2.species_A_flowrate = reactor1.combined_flowrate
+            reactor2.species_B_flowrate = 2.5 * 1.667e-8
+            reactor2.species_A_stock_concentration = reactor1.default_product_concentration
+            reactor2.update(dt=tick)
+
+            history.append((reactor1.product_concentration, reactor2.product_concentration))
+    return np.array(history), time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    reference, reference_time = simulate(SCHEME_EXPLICIT, REFERENCE_DT)
+    scale = np.max(np.abs(reference), axis=0)
+
+    print(f'{"Scheme":>16}{"dt (s)":>10}{"Wall time (s)":>16}{"Speedup":>10}'
+          f'{"Max error R1 (%)":>20}{"Max error R2 (%)":>20}')
+    for scheme, dt in [(SCHEME_EXPLICIT, REFERENCE_DT), (SCHEME_EXPLICIT, 0.05), (SCHEME_EXPLICIT, 0.1),
+                       (SCHEME_IMPLICIT, 0.05), (SCHEME_IMPLICIT, 0.1), (SCHEME_IMPLICIT, 0.5),
+                       (SCHEME_CRANK_NICOLSON, 0.05), (SCHEME_CRANK_NICOLSON, 0.1), (SCHEME_CRANK_NICOLSON, 0.5)]:
+        history, wall_time = simulate(scheme, dt)
+        error = np.max(np.abs(history - reference), axis=0) / scale * 100
+        print(f'{scheme:>16}{dt:>10}{wall_time:>16.3f}{reference_time / wall_time:>10.1f}'
+              f'{error[0]:>20.3g}{error[1]:>20.3g}')
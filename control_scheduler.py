@@ -0,0 +1,181 @@
+import heapq
+import math
+import time
+from clock import Clock
+
+"""
+Fixed-rate scheduler for the control loop.  Each task runs on its own grid of deadlines, start + phase + n * period on
+the monotonic time of the clock, so the period does not stretch by the time the tasks take.  A task that finishes after
+its next deadline has overrun: with SKIP the ticks it missed are dropped and it runs again at the next deadline still
+ahead, with COALESCE it runs once straight away in place of the missed ticks.  Either way it stays on its grid.
+
+With a ReplayClock the scheduler advances the clock itself and a replay runs deterministically.
+"""
+
+SKIP = 'skip'
+COALESCE = 'coalesce'
+
+
+class ScheduledTask:
+    """
+    A task of a ControlScheduler and its statistics.  Execution times are measured on the wall clock, lateness (jitter)
+    on the clock of the scheduler.
+    """
+
+    def __init__(self, name: str, period: float, function, phase: float = 0.0, overrun: str = SKIP):
+        """
+        :param name: Name in the statistics
+        :param period: Time between runs (s)
+        :param function: Called without arguments
+        :param phase: Offset of the first run from the start of the scheduler (s)
+        :param overrun: SKIP or COALESCE
+        """
+        if period <= 0:
+            raise ValueError(f'Period of {name} must be positive')
+        if overrun not in (SKIP, COALESCE):
+            raise ValueError(f'Unknown overrun policy {overrun}')
+        self.name = name
+        self.period = period
+        self.function = function
+        self.phase = phase
+        self.overrun = overrun
+        self.deadline = None
+        self.reset_statistics()
+
+    def reset_statistics(self) -> None:
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.total_execution_time = 0.0
+        self.max_execution_time = 0.0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def run(self, now: float) -> None:
+        """
+        Runs the function and records its lateness and execution time, exceptions are printed and counted
+        :param now: Time of the scheduler clock the task starts at
+        """
+        lateness = now - self.deadline
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        started = time.perf_counter()
+        try:
+            self.function()
+        except Exception as ex:
+            self.errors += 1
+            print(f'{type(ex)} occurred while running {self.name}: {ex}')
+        execution_time = time.perf_counter() - started
+        self.total_execution_time += execution_time
+        self.max_execution_time = max(self.max_execution_time, execution_time)
+        self.runs += 1
+
+    def schedule_next(self, now: float) -> None:
+        """
+        Moves the deadline to the next tick of the grid, dropping or coalescing the ticks that have passed
+        :param now: Time of the scheduler clock the task finished at
+        """
+        self.deadline += self.period
+        if self.deadline > now:
+            return
+        missed = math.floor((now - self.deadline) / self.period) + 1  # ticks at or before now
+        self.overruns += 1
+        if self.overrun == SKIP:
+            self.deadline += missed * self.period
+            self.skipped_ticks += missed
+        else:
+            self.deadline += (missed - 1) * self.period
+            self.skipped_ticks += missed - 1
+
+    @property
+    def statistics(self) -> dict:
+        runs = max(self.runs, 1)
+        return {
+            'period': self.period,
+            'runs': self.runs,
+            'errors': self.errors,
+            'overruns': self.overruns,
+            'skipped_ticks': self.skipped_ticks,
+            'mean_execution_time': self.total_execution_time / runs,
+            'max_execution_time': self.max_execution_time,
+            'mean_jitter': self.total_lateness / runs,
+            'max_jitter': self.max_lateness,
+        }
+
+
+class ControlScheduler:
+    """
+    Runs tasks at independent fixed rates on one thread.  Tasks due at the same time run in the order they were added.
+    """
+
+    def __init__(self, clock: Clock = None):
+        """
+        :param clock: Clock the deadlines are kept on, Clock() by default
+        """
+        self._clock = clock if clock is not None else Clock()
+        self._tasks = []
+        self._stop_requested = False
+
+    @property
+    def tasks(self) -> list:
+        return list(self._tasks)
+
+    def add(self, name: str, period: float, function, **kwargs) -> ScheduledTask:
+        """
+        Adds a task, see ScheduledTask for the keywords
+        :return: The task
+        """
+        task = ScheduledTask(name, period, function, **kwargs)
+        self._tasks.append(task)
+        return task
+
+    def stop(self) -> None:
+        """
+        Makes run return once the task it is waiting for is due, at most one period later
+        """
+        self._stop_requested = True
+
+    def run(self, duration: float = None) -> None:
+        """
+        Runs the tasks until stop is called or for duration seconds of the clock
+        """
+        self._stop_requested = False
+        start = self._clock.monotonic()
+        end = start + duration if duration is not None else math.inf
+        queue = []
+        for order, task in enumerate(self._tasks):
+            task.deadline = start + task.phase
+            queue.append((task.deadline, order, task))
+        heapq.heapify(queue)
+
+        while queue and not self._stop_requested:
+            deadline, order, task = queue[0]
+            if deadline >= end:
+                break
+            now = self._clock.monotonic()
+            if deadline > now:
+                self._clock.sleep(deadline - now)
+                continue
+            task.run(now)
+            task.schedule_next(self._clock.monotonic())
+            heapq.heapreplace(queue, (task.deadline, order, task))
+
+    @property
+    def statistics(self) -> dict:
+        """
+        :return: Statistics of each task, keyed by name
+        """
+        return {task.name: task.statistics for task in self._tasks}
+
+    def report(self) -> str:
+        """
+        :return: Table of the task statistics, times in ms
+        """
+        lines = [f'{"Task":<12}{"Period":>8}{"Runs":>9}{"Overruns":>10}{"Skipped":>9}{"Errors":>8}'
+                 f'{"Exec mean":>11}{"Exec max":>10}{"Jitter mean":>13}{"Jitter max":>12}']
+        for name, s in self.statistics.items():
+            lines.append(f'{name:<12}{s["period"] * 1e3:>8.0f}{s["runs"]:>9}{s["overruns"]:>10}{s["skipped_ticks"]:>9}'
+                         f'{s["errors"]:>8}{s["mean_execution_time"] * 1e3:>11.3f}{s["max_execution_time"] * 1e3:>10.3f}'
+                         f'{s["mean_jitter"] * 1e3:>13.3f}{s["max_jitter"] * 1e3:>12.3f}')
+        return '\n'.join(lines)
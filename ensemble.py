@@ -0,0 +1,202 @@
+import time
+import numpy as np
+from numpy import ndarray
+from cfd import CFDModel, SCHEME_EXPLICIT, const_R
+
+
+def _stream_concentration(stock_concentration, flowrate: ndarray, combined_flowrate: ndarray) -> ndarray:
+    """
+    Stream concentration of each member, zero where there is no flow
+    """
+    numerator = np.multiply(stock_concentration, flowrate, dtype=float)
+    return np.divide(numerator, combined_flowrate, out=np.zeros_like(numerator), where=combined_flowrate != 0)
+
+
+class EnsembleCFDModel(CFDModel):
+    """
+    Variants of one reactor advanced together.  Every solution array is (members x nx) and each time step runs the
+    NumPy kernel of CFDModel once for all members.
+    """
+
+    def __init__(self, species_A_concentration: float, species_B_concentration: float, members: int, **kwargs):
+        """
+        Takes the same keyword arguments as CFDModel.  ArrheniusFactor and ActivationEnergy may also be arrays with
+        one value per member, as may SpeciesAFlowrateScale and SpeciesBFlowrateScale, the relative error of each
+        member's flow meter calibration slope (1.0 is the measured flowrate).
+        :param species_A_concentration: Stock concentration of species A (acrylate) (mol/m3)
+        :param species_B_concentration: Stock concentration of species B (fluoro) (mol/m3)
+        :param members: Number of ensemble members
+        """
+        scheme = kwargs['Scheme'] if 'Scheme' in kwargs else SCHEME_EXPLICIT
+        if scheme != SCHEME_EXPLICIT:
+            raise ValueError(f'EnsembleCFDModel only supports the {SCHEME_EXPLICIT} scheme')
+        self.members = members
+        self._species_A_flowrate_scale = np.broadcast_to(
+            np.asarray(kwargs.pop('SpeciesAFlowrateScale', 1.0), dtype=float), (members,)).copy()
+        self._species_B_flowrate_scale = np.broadcast_to(
+            np.asarray(kwargs.pop('SpeciesBFlowrateScale', 1.0), dtype=float), (members,)).copy()
+        activation_energy = kwargs.pop('ActivationEnergy', 51080)
+        arrhenius_factor = kwargs.pop('ArrheniusFactor', 923.8)
+        kwargs['UseJIT'] = False
+        kwargs['RateTable'] = False  # the rate table is only used by the compiled kernel
+        super().__init__(species_A_concentration, species_B_concentration, **kwargs)
+
+        # per member parameters are columns so they broadcast along x
+        self.Ea1 = np.broadcast_to(np.asarray(activation_energy, dtype=float), (members,)).reshape(members, 1).copy()
+        self.k01 = np.broadcast_to(np.asarray(arrhenius_factor, dtype=float), (members,)).reshape(members, 1).copy()
+
+        shape = (members, self.nx1)
+        self._A = np.ones(shape)  # species A solution array
+        self._An = np.ones(shape)  # species A temporary solution array
+        self._B = np.ones(shape)  # species B solution array
+        self._Bn = np.ones(shape)  # species B temporary solution array
+        self._C = np.zeros(shape)  # species C solution array
+        self._Cn = np.zeros(shape)  # species C temporary solution array
+        self._T = np.full(shape, self.T0)
+        self._Tn = np.full(shape, self.T0)
+        self._tolcheck = np.ones(shape)
+        self._k1_temperature = self._T[:, 1:-1].copy()
+        # evaluated here as CFDModel does, with RateTemperatureTolerance an isothermal reactor never re-evaluates it
+        self._k1 = self.k01 * np.exp(-self.Ea1 / const_R / self._T[:, 1:-1])
+        self._work = np.empty((members, self.nx1 - 2))
+        self._reaction = np.empty((members, self.nx1 - 2))
+        self._update_rate_constant()
+
+    # region Concentration
+    @property
+    def species_B_stream_concentration(self) -> ndarray:
+        """
+        :return: Fluoro (species B) molar stream concentration of each member (mol/m3)
+        """
+        return _stream_concentration(self.species_B_stock_concentration, self.species_B_flowrate,
+                                     self.combined_flowrate)
+
+    @property
+    def species_A_stream_concentration(self) -> ndarray:
+        """
+        :return: Acrylate (species A) molar stream concentration of each member (mol/m3)
+        """
+        return _stream_concentration(self.species_A_stock_concentration, self.species_A_flowrate,
+                                     self.combined_flowrate)
+
+    @property
+    def product_concentration(self) -> ndarray:
+        """
+        Product concentration of each member (mg/mL)
+        :return:
+        """
+        return (self._C[:, self.nx1 - 1] / 1000) * 334.17
+
+    @property
+    def default_product_concentration(self) -> ndarray:
+        """
+        Product concentration of each member (mol/m^3)
+        :return:
+        """
+        return self._C[:, self.nx1 - 1]
+
+    def product_concentration_percentiles(self, percentiles=(5.0, 50.0, 95.0)) -> ndarray:
+        """
+        Spread of the predicted product concentration over the ensemble, e.g. to divert on the lower band rather than
+        on a single prediction
+        :param percentiles: Percentiles to return (0-100)
+        :return: Product concentration at each percentile (mg/mL)
+        """
+        return np.percentile(self.product_concentration, percentiles)
+
+    # endregion
+
+    # region Flowrate
+    @property
+    def species_A_flowrate(self) -> ndarray:
+        """
+        :return: Acrylate flowrate of each member (m3/s)
+        """
+        return self._species_A_flowrate * self._species_A_flowrate_scale
+
+    @species_A_flowrate.setter
+    def species_A_flowrate(self, value):
+        self._species_A_flowrate = value
+
+    @property
+    def species_B_flowrate(self) -> ndarray:
+        """
+        :return: Fluoro flowrate of each member (m3/s)
+        """
+        return self._species_B_flowrate * self._species_B_flowrate_scale
+
+    @species_B_flowrate.setter
+    def species_B_flowrate(self, value):
+        self._species_B_flowrate = value
+
+    # endregion
+
+    def solve_steady_state(self, max_iterations: int = 50) -> tuple:
+        """
+        Solves the steady state of each member with the banded Newton solver of CFDModel, using the member's flowrates
+        and rate constants.  The solutions replace the current profiles.
+        :param max_iterations: Maximum number of Newton iterations per member
+        :return: Steady state A, B, C and T profiles, each (members x nx)
+        """
+        wall_temperature = float(self.temperature)
+        inlet_A = np.broadcast_to(self.species_A_stream_concentration, (self.members,))
+        inlet_B = np.broadcast_to(self.species_B_stream_concentration, (self.members,))
+        velocity = np.broadcast_to(self.stream_velocity, (self.members,))
+        for m in range(self.members):
+            inlet = np.array([inlet_A[m], inlet_B[m], self._C[m, 0], self.T0], dtype=float)
+            u = self._newton_steady_state(inlet, wall_temperature, velocity[m], self.k01[m, 0], self.Ea1[m, 0],
+                                          max_iterations)
+            for array, column in ((self._A, 0), (self._An, 0), (self._B, 1), (self._Bn, 1), (self._C, 2),
+                                  (self._Cn, 2), (self._T, 3), (self._Tn, 3), (self._tolcheck, 2)):
+                array[m] = u[:, column]
+        self._update_rate_constant()
+        return self._A.copy(), self._B.copy(), self._C.copy(), self._T.copy()
+
+    def advance(self, n_steps: int, inlet_A_history: ndarray = None, outlet_history: ndarray = None) -> None:
+        """
+        Advances every member by n_steps time steps of dt1
+        :param n_steps: Number of time steps
+        :param inlet_A_history: Species A stream concentration of each member at the inlet for each step (mol/m3),
+        shape (n_steps, members)
+        :param outlet_history: Array that receives the outlet product concentration of each member (mol/m3) after each
+        step, shape (n_steps, members)
+        :return: None
+        """
+        if n_steps <= 0:
+            return
+
+        cfl = (self.stream_velocity * (self.dt1 / self.dx1))[:, np.newaxis]
+        diffusion_number = self.D1 * self.dt1 / self.dx1 ** 2
+        inlet_A = self.species_A_stream_concentration
+        inlet_B = self.species_B_stream_concentration
+        wall_temperature = float(self.temperature)
+        wall_loss = self.h * self.D * np.pi
+
+        for n in range(n_steps):
+            if inlet_A_history is not None:
+                inlet_A = inlet_A_history[n]
+            self._step(cfl, diffusion_number, inlet_A, inlet_B, wall_temperature, wall_loss)
+            if outlet_history is not None:
+                outlet_history[n] = self._C[:, self.nx1 - 1]
+
+        np.copyto(self._tolcheck, self._C)
+
+
+if __name__ == '__main__':
+    members = 500
+    rng = np.random.default_rng(0)
+    reactor_1 = EnsembleCFDModel(1200, 1000, members, nx=500, Volume=10e-6, dt=0.005,
+                                 ArrheniusFactor=923.8 * rng.lognormal(0.0, 0.1, members),
+                                 ActivationEnergy=rng.normal(51080, 500, members),
+                                 SpeciesAFlowrateScale=rng.normal(1.0, 0.02, members),
+                                 SpeciesBFlowrateScale=rng.normal(1.0, 0.02, members))
+    reactor_1.set_temperature_in_degrees_celsius(150.0)
+    reactor_1.species_A_flowrate = 2.5 * 1.66667e-8
+    reactor_1.species_B_flowrate = 2.5 * 1.66667e-8
+
+    start_time = time.perf_counter()
+    reactor_1.update(dt=10.0)
+    elapsed = time.perf_counter() - start_time
+    print(f'{members} members, {reactor_1.last_step_count} steps in {elapsed:0.3} s '
+          f'({elapsed / reactor_1.last_step_count * 1000:0.3} ms per step)')
+    print(f'Product concentration 5/50/95 percentiles: {reactor_1.product_concentration_percentiles()} mg/mL')
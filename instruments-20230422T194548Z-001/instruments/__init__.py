@@ -4,4 +4,12 @@ from .pump import Pump
 from .valve import Valve
 from .synTQ import SynTQ
 from .balance import Balance
-from .pressure_transmitter import PressureTransmitter
\ No newline at end of file
+from .pressure_transmitter import PressureTransmitter
+from .tailer import FileTailer
+from .instrument import SAMPLES_ALL, SAMPLES_NEWEST
+from .bulk import iter_log, read_log, parse_lines
+from .connection import NodeRedConnection, ConnectionManager, shared_connections
+from .connection import FRAMING_RAW, FRAMING_NEWLINE, read_all_sensors
+from .instrument import NodeRedInstrument
+from .aio import InstrumentLoop
+from .metrics import MetricsServer, SummaryReporter, histogram, registry
\ No newline at end of file
@@ -0,0 +1,700 @@
+import asyncio
+import concurrent.futures
+import time
+from threading import Thread
+from .balance import Balance
+from .connection import _NodeRedEndpoint, FRAMING_RAW, CONNECTION_OPTIONS
+from .instrument import Instrument, NodeRedInstrument
+from .metrics import histogram
+from .pressure_transmitter import PressureTransmitter
+from .tailer import FileTailer
+
+"""
+Instruments on one asyncio event loop: the instrument files are tailed by a task, every Node-RED endpoint is one
+stream connection with one task that receives its replies and reconnects it, and the actuators are set with
+coroutines.  Any number of instruments then costs one thread.
+
+InstrumentLoop runs the loop on its own thread and hands out blocking facades with the interface of the threaded
+classes, so code written for those, like main.py, can use either:
+
+    instruments = InstrumentLoop()
+    flow_meter = instruments.file_instrument(FlowMeter, 'Fluoro.csv', 0.0038, -0.7274)
+    pump = instruments.pump('10.1.10.104', 56001)
+    pump.speed_percent = 50.0
+"""
+
+
+class AsyncFileTailer(FileTailer):
+    """
+    FileTailer running as a task on the event loop it is created on instead of on its own thread.  On Linux the loop
+    wakes the task up on inotify events, elsewhere the task polls with the same backoff.  The files are read and the
+    offsets saved on the loop's default executor, so a slow share does not hold up the other instruments on the loop;
+    callbacks are called on the loop.
+    """
+
+    def _start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self._inotify is not None:
+            self._loop.add_reader(self._inotify.fileno(), self._on_inotify_event)
+        self._task = self._loop.create_task(self._run_async())
+
+    def _stop(self):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is not self._loop and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._cancel_async(), self._loop).result(10.0)
+        elif not self._loop.is_closed():
+            self._cancel()
+
+    async def _cancel_async(self):
+        self._cancel()
+        try:
+            await self._task  # let the task finish cancelling before the loop can be stopped
+        except asyncio.CancelledError:
+            pass
+
+    def _cancel(self):
+        if self._inotify is not None:
+            self._loop.remove_reader(self._inotify.fileno())
+        self._task.cancel()
+
+    def _on_inotify_event(self):
+        self._inotify.drain()
+        self._wakeup.set()
+
+    async def _poll_async(self) -> bool:
+        """
+        _poll with the file access off the loop
+        :return: True if any file had new lines
+        """
+        read = await self._loop.run_in_executor(None, self._read)
+        if read:
+            self._dispatch(read)
+            await self._loop.run_in_executor(None, self._save_offsets, read)
+        return bool(read)
+
+    async def _run_async(self):
+        interval = self._min_interval
+        while not self._close_requested:
+            if await self._poll_async():
+                interval = self._min_interval
+            else:
+                interval = min(interval * 2, self._max_interval)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       self._max_interval if self._inotify is not None else interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+class _AsyncPendingRequest:
+    """
+    Request sent by an AsyncNodeRedConnection whose reply may not have arrived yet
+    """
+
+    def __init__(self, request_id: int, command: str, future: asyncio.Future):
+        self.id = request_id
+        self.command = command
+        self.sent = time.monotonic()
+        self.future = future
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    def resolve(self, value) -> None:
+        if not self.future.done():
+            self.future.set_result(value)
+
+
+class AsyncNodeRedConnection(_NodeRedEndpoint):
+    """
+    NodeRedConnection on an event loop: one task receives the replies and pushed readings and reconnects with
+    exponential backoff, replaying the latest command sent with replay=True.  The framings and the coalescing of
+    actuator commands are those of NodeRedConnection; deferred commands and keepalives are sent by loop callbacks.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 10.0, connect_timeout: float = 2.0,
+                 min_backoff: float = 0.5, max_backoff: float = 30.0, framing: str = FRAMING_RAW,
+                 min_command_interval: float = 0.05, keepalive: float = 5.0):
+        """
+        :param host: Node-RED host
+        :param port: TCP port of the endpoint
+        :param timeout: Timeout of requests (s)
+        :param connect_timeout: Timeout of one connection attempt (s)
+        :param min_backoff: Wait before the first reconnection attempt (s)
+        :param max_backoff: Longest wait between reconnection attempts (s)
+        :param framing: FRAMING_RAW or FRAMING_NEWLINE
+        :param min_command_interval: Shortest time between actuator commands (s)
+        :param keepalive: Time after which an actuator's state is sent again (s), None to only send changes
+        """
+        super().__init__(host, port, timeout, min_backoff, max_backoff, framing, min_command_interval, keepalive)
+        self._connect_timeout = connect_timeout
+        self._service_handle = None
+        self._reader = None
+        self._writer = None
+        self._retry_in = min_backoff
+        self._request_lock = None
+        self._loop = None
+        self._task = None
+        self._close_requested = False
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        :return: Event loop the connection was started on, None before start
+        """
+        return self._loop
+
+    async def start(self) -> bool:
+        """
+        Makes the first connection attempt and starts the task that receives and reconnects
+        :return: True if connected
+        """
+        self._request_lock = asyncio.Lock()
+        self._loop = asyncio.get_running_loop()
+        connected = await self.open()
+        self._task = self._loop.create_task(self._run())
+        return connected
+
+    async def open(self) -> bool:
+        """
+        Makes one connection attempt, replaying the latest command on success
+        :return: True if connected
+        """
+        if self._writer is not None:
+            return True
+        started = time.monotonic()
+        try:
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                                self._connect_timeout)
+        except (OSError, asyncio.TimeoutError) as ex:
+            self._retry_in = self._connect_failed(ex)
+            return False
+        self._connect_succeeded(started)
+        if self._replay is not None and self._write(self._replay) and self._commanded:
+            self._command_sent(time.monotonic())
+        self._reschedule()
+        return self._writer is not None
+
+    def _disconnect(self, ex: Exception = None) -> None:
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._reader = None
+        self._writer = None
+        self._retry_in = self._backoff
+        self._connection_lost(ex)
+
+    def _write(self, data: bytes) -> bool:
+        try:
+            self._writer.write(data)
+            return True
+        except (OSError, RuntimeError) as ex:
+            self._disconnect(ex)
+            return False
+
+    async def _run(self):
+        while not self._close_requested:
+            if self._writer is None:
+                await asyncio.sleep(self._retry_in)
+                if not self._close_requested and await self.open():
+                    self._reconnects += 1
+                continue
+            try:
+                data = await self._reader.read(4096)
+            except OSError as ex:
+                self._disconnect(ex)
+                continue
+            if not data:
+                self._disconnect(ConnectionResetError('Connection closed by Node-RED'))
+                continue
+            for message in self._decoder.feed(data):
+                if self._dispatch(message):
+                    for callback in list(self._subscribers):
+                        try:
+                            callback(message)
+                        except Exception as ex:
+                            print(f'{type(ex)} occurred while processing data pushed by Node-RED at {self}: {ex}')
+
+    async def send(self, data: bytes, replay: bool = False) -> bool:
+        """
+        Sends a command
+        :param data: Command
+        :param replay: Remember the command and send it again after a reconnection
+        :return: True if the command was sent, False if the connection is down
+        """
+        if replay:
+            self._replay = data
+        if self._writer is None or not self._write(data):
+            return False
+        try:
+            await self._writer.drain()
+        except (OSError, AttributeError):
+            return False  # the receiving task notices the failure and reconnects
+        return True
+
+    def command(self, data: bytes, repeat: bool = None) -> bool:
+        """
+        Commands the state of an actuator, see NodeRedConnection.command.  Does not wait for the network.
+        """
+        now = time.monotonic()
+        sent = True
+        if self._coalesce(data, repeat, now):
+            sent = self._writer is not None and self._write(data)
+            if sent:
+                self._command_sent(now)
+        self._reschedule()
+        return sent
+
+    def _reschedule(self) -> None:
+        """
+        Schedules the next deferred command or keepalive
+        """
+        if self._service_handle is not None:
+            self._service_handle.cancel()
+            self._service_handle = None
+        due = self._next_command()
+        if due is None or self._writer is None or self._close_requested:
+            return  # open reschedules once reconnected
+        self._service_handle = asyncio.get_running_loop().call_later(max(due[2] - time.monotonic(), 0.0),
+                                                                     self._service)
+
+    def _service(self) -> None:
+        self._service_handle = None
+        due = self._next_command()
+        now = time.monotonic()
+        if due is not None and now >= due[2] and self._writer is not None:
+            data, keepalive, _ = due
+            if self._write(data):
+                self._command_sent(now, keepalive)
+        self._reschedule()
+
+    async def request(self, command: str, timeout: float = None):
+        """
+        Sends a request and waits for the reply, one request at a time with FRAMING_RAW
+        :param command: Request, e.g. 'GetMass'
+        :param timeout: Longest wait (s), the connection's timeout by default
+        :return: Decoded reply, None if the connection is down
+        """
+        if self._framing == FRAMING_RAW:
+            async with self._request_lock:
+                return await self._request(command, timeout)
+        return await self._request(command, timeout)
+
+    async def _request(self, command: str, timeout: float):
+        if self._writer is None:
+            self._failed_requests += 1
+            return None
+        request = _AsyncPendingRequest(self._next_id, command, asyncio.get_running_loop().create_future())
+        self._next_id += 1
+        self._pending.append(request)
+        if not self._write(self._encode(command, request.id)):
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(request.future),
+                                          timeout if timeout is not None else self._timeout)
+        except asyncio.TimeoutError:
+            self._disconnect(TimeoutError(f'No reply to {command} from Node-RED'))
+            return None
+
+    def subscribe(self, command: str, callback: callable) -> None:
+        """
+        Asks Node-RED to push readings and calls callback with each of them on the loop.  The request is sent again
+        after every reconnection.
+        :param command: Request that starts the pushes, e.g. 'SubscribeMass'
+        :param callback: Called with every decoded reading
+        """
+        assert callable(callback)
+        self._subscribers.append(callback)
+        self._replay = self._encode(command)
+        if self._writer is not None:
+            self._write(self._replay)
+
+    async def close(self) -> None:
+        self._close_requested = True
+        self._reschedule()
+        self._disconnect()
+        if self._task is not None:
+            self._task.cancel()
+
+
+class AsyncConnectionManager:
+    """
+    Holds one AsyncNodeRedConnection per endpoint
+    """
+
+    def __init__(self):
+        self._connections = {}
+        self._started = {}
+
+    async def connect(self, host: str, port: int, keep_if_down: bool = True, **kwargs) -> AsyncNodeRedConnection:
+        """
+        Returns the connection to an endpoint, connecting it first if this is the first request for it
+        :param keep_if_down: Keep a new connection whose first attempt failed and reconnect it in the background;
+        otherwise it is closed and not kept
+        :param kwargs: Passed to AsyncNodeRedConnection
+        :return: Connection, it may still be down
+        """
+        created = (host, port) not in self._connections
+        if created:
+            connection = AsyncNodeRedConnection(host, port, **kwargs)
+            self._connections[(host, port)] = connection
+            self._started[(host, port)] = asyncio.get_running_loop().create_task(connection.start())
+        connection = self._connections[(host, port)]
+        connected = await asyncio.shield(self._started[(host, port)])
+        if created and not connected and not keep_if_down:
+            del self._connections[(host, port)]
+            del self._started[(host, port)]
+            await connection.close()
+        return connection
+
+    @property
+    def connections(self) -> list:
+        return list(self._connections.values())
+
+    @property
+    def statistics(self) -> dict:
+        """
+        :return: Statistics of each connection, keyed by 'host:port'
+        """
+        return {str(connection): connection.statistics for connection in self.connections}
+
+    async def close(self) -> None:
+        for connection in self.connections:
+            await connection.close()
+
+
+async def connect(connections: AsyncConnectionManager, host: str, port: int, **kwargs) -> AsyncNodeRedConnection:
+    """
+    Connects an instrument to a Node-RED endpoint, see connection.connect
+    :keyword framing: FRAMING_RAW or FRAMING_NEWLINE, used if the endpoint is not connected yet
+    """
+    connection = await connections.connect(host, port, keep_if_down=False, **kwargs)
+    if not connection.connected:
+        print(f'Could not connect to the Raspberry Pi')
+        raise BrokenPipeError(f'No Raspberry Pi found')
+    return connection
+
+
+class AsyncPump:
+    """
+    Pump set with a coroutine
+    """
+
+    def __init__(self, connection: AsyncNodeRedConnection, deadband: float = 0.0):
+        """
+        :param deadband: Smallest change of speed sent to the pump (%), smaller changes are suppressed
+        """
+        self._connection = connection
+        self._percent = 0.0
+        self._commanded = False
+        self._deadband = deadband
+
+    @property
+    def connection(self) -> AsyncNodeRedConnection:
+        return self._connection
+
+    @property
+    def speed_percent(self) -> float:
+        return self._percent
+
+    async def set_speed_percent(self, value: float) -> bool:
+        """
+        :param value: Speed, limited to 0 to 100 %
+        :return: False if the command could not be sent, it is sent once Node-RED is reconnected
+        """
+        if not isinstance(value, float):
+            raise TypeError
+        value = min(max(value, 0.0), 100.0)
+        repeat = self._commanded and abs(value - self._percent) <= self._deadband
+        if not repeat:
+            self._percent = value
+            self._commanded = True
+        return self._connection.command(str(value).encode('utf-8'), repeat=repeat)
+
+
+class AsyncValve:
+    """
+    Valve set with a coroutine
+    """
+
+    def __init__(self, connection: AsyncNodeRedConnection):
+        self._connection = connection
+        self._open = False
+
+    @property
+    def connection(self) -> AsyncNodeRedConnection:
+        return self._connection
+
+    @property
+    def open(self) -> bool:
+        return self._open
+
+    async def set_open(self, value: bool) -> bool:
+        """
+        :return: False if the command could not be sent, it is sent once Node-RED is reconnected
+        """
+        if not isinstance(value, bool):
+            raise TypeError
+        self._open = value
+        return self._connection.command(str(value).encode('utf-8'))
+
+
+class AsyncNodeRedInstrument(NodeRedInstrument):
+    """
+    NodeRedInstrument on an event loop.  value never does any network traffic, it is the latest reading; read
+    requests a new one unless the instrument is subscribed.
+    """
+
+    def __init__(self, connection: AsyncNodeRedConnection, *args, **kwargs):
+        """
+        :param connection: Connection to the instrument's endpoint
+        :keyword subscribe: Have Node-RED push readings instead of requesting each one
+        """
+        self._subscribed = kwargs.pop('subscribe') if 'subscribe' in kwargs else False
+        Instrument.__init__(self, *args, **kwargs)
+        self._host = connection.host
+        self._port = connection.port
+        self._cb = None
+        self._reading = None
+        self._connection = connection
+        if self._subscribed:
+            self._connection.subscribe(self.subscribe_command, self._process_message)
+
+    def request_value(self) -> concurrent.futures.Future:
+        """
+        Schedules read on the connection's event loop without waiting for the reply, for threads other than the loop's,
+        e.g. read_all_sensors.  Like PendingRequest, the returned future's result(timeout) is the reading; on the loop
+        itself await read instead, waiting for the future there would block the loop.
+        """
+        return asyncio.run_coroutine_threadsafe(self.read(), self._connection.loop)
+
+    @property
+    def value(self):
+        reading = self._reading
+        return reading[0] if reading is not None else None
+
+    async def read(self):
+        """
+        :return: A new reading, the latest pushed one if subscribed, None if Node-RED did not reply
+        """
+        if self._subscribed:
+            return self.value
+        value = await self._connection.request(self.request_command)
+        if value is not None:
+            self._reading = (value, time.time(), time.monotonic())
+        return value
+
+
+class AsyncBalance(AsyncNodeRedInstrument):
+    request_command = Balance.request_command
+    subscribe_command = Balance.subscribe_command
+    quantity = Balance.quantity
+
+
+class AsyncPressureTransmitter(AsyncNodeRedInstrument):
+    request_command = PressureTransmitter.request_command
+    subscribe_command = PressureTransmitter.subscribe_command
+    quantity = PressureTransmitter.quantity
+
+
+class SyncPump:
+    """
+    Blocking facade of an AsyncPump with the interface of Pump.  Setting the speed does not wait for the network.
+    """
+
+    def __init__(self, instruments, pump: AsyncPump):
+        self._instruments = instruments
+        self._pump = pump
+        self._write_time = histogram('actuator_write_seconds', 'Pump and valve commands, not waiting for the network',
+                                     actuator=f'pump {pump.connection}')
+
+    @property
+    def connection(self) -> AsyncNodeRedConnection:
+        return self._pump.connection
+
+    @property
+    def speed_percent(self) -> float:
+        return self._pump.speed_percent
+
+    @speed_percent.setter
+    def speed_percent(self, value: float):
+        try:
+            with self._write_time.time():
+                self._instruments.run(self._pump.set_speed_percent(value))
+        except Exception as ex:
+            print(ex)
+
+
+class SyncValve:
+    """
+    Blocking facade of an AsyncValve with the interface of Valve.  Switching does not wait for the network.
+    """
+
+    def __init__(self, instruments, valve: AsyncValve):
+        self._instruments = instruments
+        self._valve = valve
+        self._write_time = histogram('actuator_write_seconds', 'Pump and valve commands, not waiting for the network',
+                                     actuator=f'valve {valve.connection}')
+
+    @property
+    def connection(self) -> AsyncNodeRedConnection:
+        return self._valve.connection
+
+    @property
+    def open(self) -> bool:
+        return self._valve.open
+
+    @open.setter
+    def open(self, value: bool):
+        try:
+            with self._write_time.time():
+                self._instruments.run(self._valve.set_open(value))
+        except Exception as ex:
+            print(ex)
+
+
+class SyncSensor:
+    """
+    Blocking facade of an AsyncNodeRedInstrument with the interface of Balance and PressureTransmitter
+    """
+
+    def __init__(self, instruments, sensor: AsyncNodeRedInstrument):
+        self._instruments = instruments
+        self._sensor = sensor
+        self._read_time = histogram('node_red_read_seconds', 'Round trip of a reading requested from Node-RED',
+                                    instrument=type(sensor).__name__)
+
+    @property
+    def connection(self) -> AsyncNodeRedConnection:
+        return self._sensor.connection
+
+    @property
+    def subscribed(self) -> bool:
+        return self._sensor.subscribed
+
+    def on_message(self, callback: callable):
+        """
+        :param callback: Called on the event loop thread with every pushed reading
+        """
+        self._sensor.on_message(callback)
+
+    def request_value(self) -> concurrent.futures.Future:
+        """
+        Sends the request for a new reading without waiting for the reply, see read_all_sensors
+        """
+        return self._sensor.request_value()
+
+    @property
+    def value(self):
+        if self._sensor.subscribed:
+            return self._sensor.value
+        try:
+            with self._read_time.time():
+                return self._instruments.run(self._sensor.read())
+        except Exception as ex:
+            print(f'{type(ex)} exception occurred while getting {self._sensor.quantity} from Node-RED: {ex}')
+            return None
+
+    @property
+    def timestamp(self) -> float:
+        return self._sensor.timestamp
+
+    @property
+    def staleness(self) -> float:
+        return self._sensor.staleness
+
+
+class InstrumentLoop:
+    """
+    Runs one event loop on its own thread for all the instruments of a program: an AsyncFileTailer for the instrument
+    files and an AsyncConnectionManager for Node-RED.  The factories return instruments usable from any thread.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.connections = AsyncConnectionManager()
+        self.tailer = self.run(self._create_tailer())
+
+    @staticmethod
+    async def _create_tailer() -> AsyncFileTailer:
+        return AsyncFileTailer()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def run(self, coroutine, timeout: float = None):
+        """
+        Runs a coroutine on the loop and waits for its result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def submit(self, coroutine):
+        """
+        Runs a coroutine on the loop without waiting for it
+        :return: concurrent.futures.Future of its result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def file_instrument(self, instrument_class, path: str, *args, **kwargs):
+        """
+        Creates a FileInstrument, e.g. a FlowMeter, tailed on the loop; its callbacks are called on the loop thread
+        """
+        return instrument_class(path, *args, tailer=self.tailer, **kwargs)
+
+    def pump(self, host: str, port: int, **kwargs) -> SyncPump:
+        """
+        :keyword deadband: Smallest change of speed sent to the pump (%), smaller changes are suppressed
+        :keyword min_command_interval: Shortest time between commands (s)
+        :keyword keepalive: Time after which the speed is sent again (s), None to only send changes
+        """
+        deadband = kwargs.pop('deadband') if 'deadband' in kwargs else 0.0
+        return SyncPump(self, AsyncPump(self.run(connect(self.connections, host, port, **kwargs)), deadband))
+
+    def valve(self, host: str, port: int, **kwargs) -> SyncValve:
+        """
+        :keyword min_command_interval: Shortest time between commands (s)
+        :keyword keepalive: Time after which the state is sent again (s), None to only send changes
+        """
+        return SyncValve(self, AsyncValve(self.run(connect(self.connections, host, port, **kwargs))))
+
+    def balance(self, host: str, port: int, **kwargs) -> SyncSensor:
+        """
+        :keyword subscribe: Have Node-RED push readings instead of requesting each one
+        :keyword framing: FRAMING_RAW or FRAMING_NEWLINE
+        """
+        return SyncSensor(self, self.run(self._create_sensor(AsyncBalance, host, port, **kwargs)))
+
+    def pressure_transmitter(self, host: str, port: int, **kwargs) -> SyncSensor:
+        """
+        :keyword subscribe: Have Node-RED push readings instead of requesting each one
+        :keyword framing: FRAMING_RAW or FRAMING_NEWLINE
+        """
+        return SyncSensor(self, self.run(self._create_sensor(AsyncPressureTransmitter, host, port, **kwargs)))
+
+    async def _create_sensor(self, sensor_class, host: str, port: int, **kwargs) -> AsyncNodeRedInstrument:
+        connection_kwargs = {name: kwargs.pop(name) for name in CONNECTION_OPTIONS if name in kwargs}
+        return sensor_class(await connect(self.connections, host, port, **connection_kwargs), **kwargs)
+
+    def close(self) -> None:
+        if not self._loop.is_running():
+            return
+        self.run(self.connections.close())
+        self.tailer.close()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10.0)
+        self._loop.close()
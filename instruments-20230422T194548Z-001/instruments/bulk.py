@@ -0,0 +1,65 @@
+from itertools import islice
+import numpy as np
+from numpy import ndarray
+
+"""
+Bulk parsing of instrument logs, e.g. to analyse or backfill a whole day of flow meter data.  The header length and
+value column come from the FileInstrument classes, so the bulk and the live readers parse the same files the same way.
+"""
+
+
+def parse_lines(lines: list, instrument_class) -> ndarray:
+    """
+    Parses the values of a batch of log lines at once
+    :param lines: Lines of the log, without the header
+    :param instrument_class: FileInstrument subclass that reads this kind of log, e.g. FlowMeter
+    :return: Uncalibrated values, lines that do not hold a value are left out
+    """
+    if not lines:
+        return np.empty(0)
+    if instrument_class.value_column is not None:
+        try:
+            return np.loadtxt(lines, delimiter=',', quotechar='"', usecols=instrument_class.value_column, dtype=float,
+                              comments=None, ndmin=1)
+        except ValueError:
+            pass  # a malformed or blank line in the batch, parse it line by line instead
+
+    values = []
+    for line in lines:
+        try:
+            values.append(instrument_class.parse_value(line))
+        except (IndexError, ValueError):
+            pass
+    return np.array(values, dtype=float)
+
+
+def iter_log(path: str, instrument_class, m: float = 1.0, b: float = 0.0, chunk_rows: int = 100000):
+    """
+    Reads an instrument log in chunks so memory stays bounded however long the log is
+    :param path: Log written by the instrument
+    :param instrument_class: FileInstrument subclass that reads this kind of log, e.g. FlowMeter
+    :param m: Calibration slope applied to every value
+    :param b: Calibration offset applied to every value
+    :param chunk_rows: Lines parsed per chunk
+    :return: Generator of arrays with the calibrated values of each chunk
+    """
+    with open(path) as stream:
+        for _ in islice(stream, instrument_class.header_lines):
+            pass
+        while True:
+            lines = list(islice(stream, chunk_rows))
+            if not lines:
+                return
+            values = parse_lines(lines, instrument_class)
+            if m != 1.0 or b != 0.0:
+                values = values * m + b
+            yield values
+
+
+def read_log(path: str, instrument_class, m: float = 1.0, b: float = 0.0, chunk_rows: int = 100000) -> ndarray:
+    """
+    Reads every value of an instrument log, see iter_log
+    :return: Calibrated values
+    """
+    chunks = list(iter_log(path, instrument_class, m, b, chunk_rows))
+    return np.concatenate(chunks) if chunks else np.empty(0)
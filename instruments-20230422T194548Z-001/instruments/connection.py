@@ -0,0 +1,765 @@
+import codecs
+import json
+import socket
+import threading
+import time
+from collections import deque
+from threading import Thread
+
+FRAMING_RAW = 'raw'  # bare commands, replies may follow each other without a delimiter, one request at a time
+FRAMING_NEWLINE = 'newline'  # newline delimited JSON with request IDs, requests may be pipelined
+
+CONNECTION_OPTIONS = ('framing', 'min_command_interval', 'keepalive')  # instrument keywords passed to the connection
+
+
+class JSONStreamDecoder:
+    """
+    Splits the bytes received from Node-RED into JSON values, however the replies are split across or coalesced into
+    reads.  With delimited=True every value ends with a newline; otherwise values may follow each other directly and
+    a number at the very end of the received data is taken to be complete.
+    """
+    max_buffer = 1 << 16  # undecodable data longer than this is dropped (characters)
+
+    def __init__(self, delimited: bool = False):
+        self._delimited = delimited
+        self._text = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self.errors = 0
+
+    def reset(self) -> None:
+        self._text.reset()
+        self._buffer = ''
+
+    def feed(self, data: bytes) -> list:
+        """
+        :param data: Bytes received
+        :return: Values completed by data
+        """
+        self._buffer += self._text.decode(data)
+        if self._delimited:
+            *lines, self._buffer = self._buffer.split('\n')
+            values = []
+            for line in lines:
+                values.extend(self._decode(line, final=True))
+        else:
+            values = self._decode(self._buffer, final=False)
+        if len(self._buffer) > self.max_buffer:
+            self.errors += 1
+            self._buffer = ''
+        return values
+
+    def _decode(self, text: str, final: bool) -> list:
+        values = []
+        position = 0
+        while True:
+            while position < len(text) and text[position].isspace():
+                position += 1
+            if position == len(text):
+                break
+            if not final and not self._complete(text, position):
+                break  # the rest of the value has not arrived yet
+            try:
+                value, position = self._decoder.raw_decode(text, position)
+            except json.JSONDecodeError:
+                self.errors += 1
+                position = self._resync(text, position + 1)
+                continue
+            values.append(value)
+        if not final:
+            self._buffer = text[position:]
+        return values
+
+    @staticmethod
+    def _complete(text: str, position: int) -> bool:
+        """
+        :return: True if the object, array or string starting at position has been closed, always True for numbers
+        and literals
+        """
+        if text[position] not in '{["':
+            return True
+        depth = 0
+        in_string = False
+        escaped = False
+        for i in range(position, len(text)):
+            character = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif character == '\\':
+                    escaped = True
+                elif character == '"':
+                    in_string = False
+                    if depth == 0:
+                        return True
+            elif character == '"':
+                in_string = True
+            elif character in '{[':
+                depth += 1
+            elif character in '}]':
+                depth -= 1
+                if depth == 0:
+                    return True
+        return False
+
+    @staticmethod
+    def _resync(text: str, position: int) -> int:
+        """
+        :return: Position of the next value that may be valid after undecodable data
+        """
+        starts = [i for i in (text.find('{', position), text.find('[', position)) if i >= 0]
+        return min(starts) if starts else len(text)
+
+
+class PendingRequest:
+    """
+    Request sent to Node-RED whose reply may not have arrived yet
+    """
+
+    def __init__(self, connection, request_id: int, command: str):
+        self._connection = connection
+        self.id = request_id
+        self.command = command
+        self.sent = time.monotonic()
+        self._done = threading.Event()
+        self._value = None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def resolve(self, value) -> None:
+        self._value = value
+        self._done.set()
+
+    def result(self, timeout: float = None):
+        """
+        Waits for the reply, reading from the connection if no other thread is
+        :param timeout: Longest wait (s), the connection's timeout by default
+        :return: Decoded reply, None if the connection failed or timed out
+        """
+        self._connection.wait(self, timeout)
+        return self._value
+
+
+class _NodeRedEndpoint:
+    """
+    Request bookkeeping shared by NodeRedConnection and aio.AsyncNodeRedConnection: encodes requests, matches the
+    decoded replies to the requests in flight, passes pushed readings on to the subscribers and keeps the statistics
+    """
+
+    def __init__(self, host: str, port: int, timeout: float, min_backoff: float, max_backoff: float, framing: str,
+                 min_command_interval: float, keepalive: float):
+        if framing not in (FRAMING_RAW, FRAMING_NEWLINE):
+            raise ValueError(f'Unknown framing {framing}, expected {FRAMING_RAW} or {FRAMING_NEWLINE}')
+        self.host = host
+        self.port = port
+        self._timeout = timeout
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._backoff = min_backoff
+        self._framing = framing
+        self._replay = None
+        self._decoder = JSONStreamDecoder(delimited=framing == FRAMING_NEWLINE)
+        self._pending = deque()
+        self._next_id = 1
+        self._subscribers = []
+        self._min_command_interval = min_command_interval
+        self._keepalive = keepalive
+        self._commanded = False
+        self._deferred = None
+        self._last_command_time = -float('inf')
+
+        self._created = time.monotonic()
+        self._connected_since = None
+        self._uptime = 0.0
+        self._reconnects = 0
+        self._failed_attempts = 0
+        self._connect_latency = None
+        self._last_latency = None
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._requests = 0
+        self._failed_requests = 0
+        self._unexpected_replies = 0
+        self._pushed = 0
+        self._commands_sent = 0
+        self._commands_suppressed = 0
+        self._commands_coalesced = 0
+        self._keepalives = 0
+
+    def __str__(self):
+        return f'{self.host}:{self.port}'
+
+    @property
+    def connected(self) -> bool:
+        raise NotImplementedError
+
+    @property
+    def framing(self) -> str:
+        return self._framing
+
+    def _encode(self, command: str, request_id: int = None) -> bytes:
+        """
+        :param request_id: Id of the request, None for commands that are not answered
+        """
+        if self._framing == FRAMING_NEWLINE:
+            message = {'id': request_id, 'request': command} if request_id is not None else {'request': command}
+            return (json.dumps(message) + '\n').encode('utf-8')
+        return command.encode('utf-8')
+
+    def _connect_failed(self, ex: Exception) -> float:
+        """
+        :return: Wait before the next attempt (s)
+        """
+        self._failed_attempts += 1
+        backoff = self._backoff
+        self._backoff = min(self._backoff * 2, self._max_backoff)
+        print(f'{type(ex)} occurred while connecting to Node-RED at {self}: {ex}')
+        return backoff
+
+    def _connect_succeeded(self, started: float) -> None:
+        now = time.monotonic()
+        self._decoder.reset()
+        self._connect_latency = now - started
+        self._connected_since = now
+        self._backoff = self._min_backoff
+        print(f'Connected to Node-RED at {self}')
+
+    def _connection_lost(self, ex: Exception = None) -> None:
+        if ex is not None:
+            print(f'{type(ex)} occurred on the Node-RED connection {self}, reconnecting: {ex}')
+        if self._connected_since is not None:
+            self._uptime += time.monotonic() - self._connected_since
+        self._connected_since = None
+        while self._pending:
+            self._failed_requests += 1
+            self._pending.popleft().resolve(None)
+
+    def _coalesce(self, data: bytes, repeat: bool, now: float) -> bool:
+        """
+        Records the state an actuator is commanded to and decides whether to send the command now.  A repeated
+        command is suppressed and a command within min_command_interval of the previous one is deferred; a deferred
+        command that is replaced before it is sent is counted as coalesced.
+        :param repeat: True if data commands the state already commanded, None to compare it with the last command
+        :return: True if data is to be sent now
+        """
+        if repeat is None:
+            repeat = self._commanded and data == self._replay
+        if repeat:
+            self._commands_suppressed += 1
+            return False
+        self._replay = data
+        self._commanded = True
+        if now < self._last_command_time + self._min_command_interval:
+            if self._deferred is not None:
+                self._commands_coalesced += 1
+            self._deferred = data
+            return False
+        self._deferred = None
+        return True
+
+    def _command_sent(self, now: float, keepalive: bool = False) -> None:
+        self._last_command_time = now
+        self._deferred = None
+        if keepalive:
+            self._keepalives += 1
+        else:
+            self._commands_sent += 1
+
+    def _next_command(self) -> tuple:
+        """
+        :return: The deferred command or keepalive due next, whether it is a keepalive and when it is due (monotonic
+        s), None if nothing is due
+        """
+        if self._deferred is not None:
+            return self._deferred, False, self._last_command_time + self._min_command_interval
+        if self._commanded and self._keepalive is not None:
+            return self._replay, True, self._last_command_time + self._keepalive
+        return None
+
+    def _dispatch(self, message) -> bool:
+        """
+        Hands a decoded message to the request it answers
+        :return: True if the message is to be passed on to the subscribers
+        """
+        request = None
+        if isinstance(message, dict) and 'id' in message:
+            for pending in self._pending:
+                if pending.id == message['id']:
+                    request = pending
+                    break
+            if request is not None:
+                self._pending.remove(request)
+                message = message['value'] if 'value' in message else message
+                self._record_latency(time.monotonic() - request.sent)
+                request.resolve(message)
+                return False
+        if self._pending:  # an endpoint serves one sensor, so a reading pushed meanwhile answers a request as well
+            request = self._pending.popleft()
+            self._record_latency(time.monotonic() - request.sent)
+            request.resolve(message)
+        if self._subscribers:
+            self._pushed += 1
+            return True
+        if request is None:
+            self._unexpected_replies += 1
+        return False
+
+    def _record_latency(self, latency: float) -> None:
+        self._last_latency = latency
+        self._total_latency += latency
+        self._max_latency = max(self._max_latency, latency)
+        self._requests += 1
+
+    @property
+    def uptime(self) -> float:
+        """
+        :return: Time connected since the connection was created (s)
+        """
+        connected_since = self._connected_since
+        return self._uptime + (time.monotonic() - connected_since if connected_since is not None else 0.0)
+
+    @property
+    def latency(self) -> float:
+        """
+        :return: Round trip time of the last request (s)
+        """
+        return self._last_latency
+
+    @property
+    def statistics(self) -> dict:
+        """
+        :return: Connection counters, latencies in s
+        """
+        age = time.monotonic() - self._created
+        return {
+            'connected': self.connected,
+            'uptime': self.uptime,
+            'uptime_fraction': self.uptime / age if age > 0 else 1.0,
+            'reconnects': self._reconnects,
+            'failed_attempts': self._failed_attempts,
+            'connect_latency': self._connect_latency,
+            'requests': self._requests,
+            'failed_requests': self._failed_requests,
+            'in_flight': len(self._pending),
+            'unexpected_replies': self._unexpected_replies,
+            'pushed': self._pushed,
+            'commands_sent': self._commands_sent,
+            'commands_suppressed': self._commands_suppressed,
+            'commands_coalesced': self._commands_coalesced,
+            'keepalives': self._keepalives,
+            'decode_errors': self._decoder.errors,
+            'last_latency': self._last_latency,
+            'mean_latency': self._total_latency / self._requests if self._requests else None,
+            'max_latency': self._max_latency if self._requests else None,
+        }
+
+
+class NodeRedConnection(_NodeRedEndpoint):
+    """
+    TCP connection to one Node-RED endpoint.  A failed send or request marks the connection as down and the
+    ConnectionManager reconnects it in the background; the latest command sent with replay=True is sent again as soon
+    as the connection is back, so actuators end up in the last commanded state.
+
+    Replies are decoded as a stream of JSON values.  With FRAMING_RAW commands are sent as they are and requests are
+    answered one at a time, as the original Node-RED flows expect.  With FRAMING_NEWLINE each request is sent as
+    {"id": 1, "request": "GetMass"} followed by a newline and several requests may be in flight; the flow replies with
+    {"id": 1, "value": ...} followed by a newline.  A reply without an id answers the oldest request in flight.
+
+    After subscribe, Node-RED pushes readings without being asked.  A receiver thread then reads the connection and
+    hands every message without an id to the subscribers.
+
+    Actuators send their state with command: unchanged states are not sent again, bursts are limited to one command
+    per min_command_interval with only the latest state sent at the end of the interval, and the state is sent again
+    every keepalive seconds.  The ConnectionManager's thread sends the deferred commands and keepalives.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 10.0, connect_timeout: float = 2.0,
+                 min_backoff: float = 0.5, max_backoff: float = 30.0, framing: str = FRAMING_RAW,
+                 min_command_interval: float = 0.05, keepalive: float = 5.0):
+        """
+        :param host: Node-RED host
+        :param port: TCP port of the endpoint
+        :param timeout: Timeout of sends and requests (s)
+        :param connect_timeout: Timeout of one connection attempt (s)
+        :param min_backoff: Wait before the first reconnection attempt (s)
+        :param max_backoff: Longest wait between reconnection attempts (s)
+        :param framing: FRAMING_RAW or FRAMING_NEWLINE
+        :param min_command_interval: Shortest time between actuator commands (s)
+        :param keepalive: Time after which an actuator's state is sent again (s), None to only send changes
+        """
+        super().__init__(host, port, timeout, min_backoff, max_backoff, framing, min_command_interval, keepalive)
+        self._connect_timeout = connect_timeout
+        self.on_deferred = None  # called when a command is deferred, the ConnectionManager wakes up to send it
+        self._lock = threading.RLock()
+        self._read_lock = threading.Lock()
+        self._socket = None
+        self._next_attempt = 0.0
+        self._receiver = None
+        self._close_requested = False
+
+    @property
+    def connected(self) -> bool:
+        return self._socket is not None
+
+    def open(self) -> bool:
+        """
+        Makes one connection attempt, replaying the latest command on success
+        :return: True if connected
+        """
+        with self._lock:
+            if self._socket is not None:
+                return True
+            started = time.monotonic()
+            try:
+                connection = socket.create_connection((self.host, self.port), timeout=self._connect_timeout)
+            except OSError as ex:
+                self._next_attempt = time.monotonic() + self._connect_failed(ex)
+                return False
+
+            connection.settimeout(self._timeout)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._socket = connection
+            self._connect_succeeded(started)
+            if self._replay is not None and self._send(self._replay) and self._commanded:
+                self._command_sent(time.monotonic())
+            return self._socket is not None
+
+    def _disconnect(self, ex: Exception = None, connection: socket.socket = None) -> None:
+        """
+        :param connection: Socket that failed, nothing is done if it has been replaced meanwhile
+        """
+        with self._lock:
+            if self._socket is None or (connection is not None and connection is not self._socket):
+                return
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)  # wakes up a thread waiting for a reply
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+            self._next_attempt = time.monotonic() + self._backoff
+            self._connection_lost(ex)
+
+    def _send(self, data: bytes) -> bool:
+        connection = self._socket
+        try:
+            connection.sendall(data)
+            return True
+        except OSError as ex:
+            self._disconnect(ex, connection)
+            return False
+
+    def send(self, data: bytes, replay: bool = False) -> bool:
+        """
+        Sends a command
+        :param data: Command
+        :param replay: Remember the command and send it again after a reconnection
+        :return: True if the command was sent, False if the connection is down
+        """
+        with self._lock:
+            if replay:
+                self._replay = data
+            if self._socket is None:
+                return False
+            return self._send(data)
+
+    def command(self, data: bytes, repeat: bool = None) -> bool:
+        """
+        Commands the state of an actuator, see the class description
+        :param data: Command
+        :param repeat: True if data commands the state already commanded, e.g. a pump speed within the deadband, None
+        to compare data with the last command
+        :return: False if the command could not be sent, it is sent once Node-RED is reconnected
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not self._coalesce(data, repeat, now):
+                if self._deferred is not None and self.on_deferred is not None:
+                    self.on_deferred()
+                return True
+            if self._socket is None or not self._send(data):
+                return False
+            self._command_sent(now)
+            return True
+
+    def service(self, now: float) -> float:
+        """
+        Sends the deferred command or keepalive if it is due, called by the ConnectionManager
+        :return: Time until the next one is due (s)
+        """
+        with self._lock:
+            due = self._next_command()
+            if due is not None and now >= due[2] and self._socket is not None:
+                data, keepalive, _ = due
+                if self._send(data):
+                    self._command_sent(now, keepalive)
+                due = self._next_command()
+            return max(due[2] - now, 0.0) if due is not None else float('inf')
+
+    def submit(self, command: str) -> PendingRequest:
+        """
+        Sends a request without waiting for the reply.  With FRAMING_RAW this first waits for the reply to any
+        request still in flight.
+        :param command: Request, e.g. 'GetMass'
+        :return: Request to wait on for the reply
+        """
+        while True:
+            if self._framing == FRAMING_RAW:
+                in_flight = self._pending[0] if self._pending else None
+                if in_flight is not None:
+                    self.wait(in_flight)
+            with self._lock:
+                if self._framing == FRAMING_RAW and self._pending:
+                    continue  # another thread sent a request meanwhile
+                request = PendingRequest(self, self._next_id, command)
+                self._next_id += 1
+                if self._socket is None:
+                    self._failed_requests += 1
+                    request.resolve(None)
+                    return request
+                self._pending.append(request)
+                self._send(self._encode(command, request.id))
+                return request
+
+    def request(self, command: str, timeout: float = None):
+        """
+        Sends a request and waits for the reply
+        :param command: Request, e.g. 'GetMass'
+        :param timeout: Longest wait (s), the connection's timeout by default
+        :return: Decoded reply, None if the connection is down
+        """
+        return self.submit(command).result(timeout)
+
+    def wait(self, request: PendingRequest, timeout: float = None) -> None:
+        """
+        Reads replies until request has been answered.  Only one thread reads at a time and hands the other threads
+        their replies.
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else self._timeout)
+        while not request.done:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._disconnect(TimeoutError(f'No reply to {request.command} from Node-RED'))
+                return
+            self._receive(remaining, request)
+
+    def _receive(self, timeout: float, request: PendingRequest = None) -> None:
+        """
+        Reads once from the socket and dispatches what was received, unless another thread is reading
+        :param request: Request being waited for, nothing is read once it has been answered
+        """
+        if not self._read_lock.acquire(timeout=min(timeout, 0.01)):
+            return
+        pushed = []
+        try:
+            connection = self._socket
+            if connection is None or (request is not None and request.done):
+                return
+            try:
+                connection.settimeout(timeout)
+                data = connection.recv(4096)
+            except socket.timeout:
+                return
+            except OSError as ex:
+                self._disconnect(ex, connection)
+                return
+            if not data:
+                self._disconnect(ConnectionResetError('Connection closed by Node-RED'), connection)
+                return
+            with self._lock:
+                pushed = [message for message in self._decoder.feed(data) if self._dispatch(message)]
+                subscribers = list(self._subscribers)
+        finally:
+            self._read_lock.release()
+        for message in pushed:
+            for callback in subscribers:
+                try:
+                    callback(message)
+                except Exception as ex:
+                    print(f'{type(ex)} occurred while processing data pushed by Node-RED at {self}: {ex}')
+
+    def subscribe(self, command: str, callback: callable) -> None:
+        """
+        Asks Node-RED to push readings and calls callback with each of them on the connection's receiver thread.  The
+        request is sent again after every reconnection.
+        :param command: Request that starts the pushes, e.g. 'SubscribeMass'
+        :param callback: Called with every decoded reading
+        """
+        assert callable(callback)
+        with self._lock:
+            self._subscribers.append(callback)
+            self.send(self._encode(command), replay=True)
+            if self._receiver is None:
+                self._receiver = Thread(target=self._receive_pushes)
+                self._receiver.daemon = True
+                self._receiver.start()
+
+    def _receive_pushes(self):
+        while not self._close_requested:
+            if self._socket is None:
+                time.sleep(0.05)
+                continue
+            self._receive(0.5)
+
+    def check(self) -> None:
+        """
+        Notices a connection closed by Node-RED without consuming any data, called by the ConnectionManager
+        """
+        if not self._read_lock.acquire(blocking=False):
+            return  # a thread is reading, a failure will show up there
+        try:
+            with self._lock:
+                if self._socket is None:
+                    return
+                self._socket.setblocking(False)
+                try:
+                    if self._socket.recv(1, socket.MSG_PEEK) == b'':
+                        self._disconnect(ConnectionResetError('Connection closed by Node-RED'))
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except OSError as ex:
+                    self._disconnect(ex)
+                finally:
+                    if self._socket is not None:
+                        self._socket.settimeout(self._timeout)
+        finally:
+            self._read_lock.release()
+
+    def reconnect_due(self, now: float) -> bool:
+        return self._socket is None and not self._close_requested and now >= self._next_attempt
+
+    def reconnect(self) -> bool:
+        if self.open():
+            self._reconnects += 1
+            return True
+        return False
+
+    def close(self) -> None:
+        self._close_requested = True
+        self._disconnect()
+        if self._receiver is not None and self._receiver is not threading.current_thread():
+            self._receiver.join(1.0)
+
+
+class ConnectionManager:
+    """
+    Holds one NodeRedConnection per endpoint and runs one thread that notices dropped connections and reconnects them
+    with exponential backoff
+    """
+
+    def __init__(self, check_interval: float = 0.5):
+        """
+        :param check_interval: Time between checks of the connections (s)
+        """
+        self._check_interval = check_interval
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._close_requested = False
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def connect(self, host: str, port: int, keep_if_down: bool = True, **kwargs) -> NodeRedConnection:
+        """
+        Returns the connection to an endpoint, connecting it first if this is the first request for it
+        :param keep_if_down: Keep a new connection whose first attempt failed and reconnect it in the background;
+        otherwise it is closed and not kept
+        :param kwargs: Passed to NodeRedConnection
+        :return: Connection, it may still be down
+        """
+        with self._lock:
+            connection = self._connections.get((host, port))
+            if connection is None:
+                connection = NodeRedConnection(host, port, **kwargs)
+                connection.on_deferred = self._wakeup.set
+                if not connection.open() and not keep_if_down:
+                    connection.close()
+                    return connection
+                self._connections[(host, port)] = connection
+        return connection
+
+    @property
+    def connections(self) -> list:
+        return list(self._connections.values())
+
+    @property
+    def statistics(self) -> dict:
+        """
+        :return: Statistics of each connection, keyed by 'host:port'
+        """
+        return {str(connection): connection.statistics for connection in self.connections}
+
+    def close(self) -> None:
+        self._close_requested = True
+        self._wakeup.set()
+        self._thread.join(10.0)
+        for connection in self.connections:
+            connection.close()
+
+    def _run(self):
+        while not self._close_requested:
+            self._wakeup.clear()
+            now = time.monotonic()
+            wait = self._check_interval
+            for connection in self.connections:
+                try:
+                    if connection.connected:
+                        connection.check()
+                        wait = min(wait, connection.service(now))
+                    elif connection.reconnect_due(now):
+                        connection.reconnect()
+                except Exception as ex:
+                    print(f'{type(ex)} occurred while checking the Node-RED connection {connection}: {ex}')
+            self._wakeup.wait(wait)
+
+
+_shared_connections = None
+_shared_connections_lock = threading.Lock()
+
+
+def shared_connections() -> ConnectionManager:
+    """
+    :return: The ConnectionManager used by the Node-RED instruments unless they are given their own
+    """
+    global _shared_connections
+    with _shared_connections_lock:
+        if _shared_connections is None:
+            _shared_connections = ConnectionManager()
+        return _shared_connections
+
+
+def connect(host: str, port: int, **kwargs) -> NodeRedConnection:
+    """
+    Connects an instrument to a Node-RED endpoint, sharing the connection with any other instrument using it.  If
+    the endpoint cannot be reached on the first attempt, nothing is kept reconnecting in the background for it.
+    :keyword connections: ConnectionManager to use instead of the shared one
+    :keyword framing: FRAMING_RAW or FRAMING_NEWLINE, used if the endpoint is not connected yet
+    :keyword min_command_interval: Shortest time between actuator commands (s), used if the endpoint is not connected
+    yet
+    :keyword keepalive: Time after which an actuator's state is sent again (s), used if the endpoint is not connected
+    yet
+    :return: Connection
+    """
+    connections = kwargs['connections'] if 'connections' in kwargs else shared_connections()
+    connection = connections.connect(host, port, keep_if_down=False,
+                                     **{name: kwargs[name] for name in CONNECTION_OPTIONS if name in kwargs})
+    if not connection.connected:
+        print(f'Could not connect to the Raspberry Pi')
+        raise BrokenPipeError(f'No Raspberry Pi found')
+    return connection
+
+
+def read_all_sensors(sensors: dict, timeout: float = None) -> dict:
+    """
+    Reads several Node-RED sensors in one round trip: every request is sent before waiting for any reply.  Subscribed
+    sensors are not asked, their latest pushed reading is used.
+    :param sensors: NodeRedInstruments, e.g. {'balance': balance, 'pressure': pressure}
+    :param timeout: Longest wait for each reply (s)
+    :return: Value of each sensor, None for sensors that did not reply
+    """
+    requests = {name: sensor.request_value() for name, sensor in sensors.items() if not sensor.subscribed}
+    return {name: requests[name].result(timeout) if name in requests else sensor.value
+            for name, sensor in sensors.items()}
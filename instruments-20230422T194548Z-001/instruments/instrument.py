@@ -1,3 +1,15 @@
+import os
+import time
+from itertools import islice
+from .bulk import parse_lines
+from .connection import connect, PendingRequest, CONNECTION_OPTIONS
+from .metrics import histogram
+from .tailer import shared_tailer
+
+SAMPLES_ALL = 'all'  # every sample in a batch of new lines is processed
+SAMPLES_NEWEST = 'newest'  # only the newest sample in a batch of new lines is processed
+
+
 class Instrument:
     _range: (float, float)
 
@@ -23,3 +35,247 @@ class Instrument:
             return True
         else:
             return True
+
+
+class FileInstrument(Instrument):
+    """
+    Instrument that reads its samples from the lines a logger appends to a CSV file.  New lines are delivered in
+    batches by a FileTailer; subclasses parse the value of one line in parse_value, may calibrate it in _calibrate
+    and filter the calibrated value in _filter.
+    """
+    header_lines = 0  # lines before the first sample
+    value_column = None  # comma separated column holding the value, None if parse_value does not split columns
+
+    def __init__(self, path: str, *args, **kwargs):
+        """
+        :param path: CSV file written by the instrument's logger
+        :keyword samples: SAMPLES_ALL to process every sample of a batch, SAMPLES_NEWEST to only process the newest
+        :keyword tailer: FileTailer to use instead of the shared one
+        :keyword offset_file: File to save the read offset in, so a restart processes the lines written meanwhile
+        """
+        super().__init__(*args, **kwargs)
+        self._samples = kwargs['samples'] if 'samples' in kwargs else SAMPLES_ALL
+        if self._samples not in (SAMPLES_ALL, SAMPLES_NEWEST):
+            raise ValueError(f'Unknown samples policy {self._samples}, expected {SAMPLES_ALL} or {SAMPLES_NEWEST}')
+        self._path = path
+        self._close_requested = False
+        with open(self._path) as stream:
+            self._header = list(islice(stream, self.header_lines))
+        self._cb = None
+        self._value = None
+        self._sample_time = None
+        self._samples_received = 0
+        self._dispatch_time = histogram('instrument_dispatch_seconds', 'Parsing a batch of lines and calling on_message',
+                                        instrument=os.path.basename(path))
+        self._tailer = kwargs['tailer'] if 'tailer' in kwargs else shared_tailer()
+        self._tailed_file = self._tailer.watch(self._path, self._process_lines, header_lines=self.header_lines,
+                                               offset_file=kwargs['offset_file'] if 'offset_file' in kwargs else None,
+                                               backlog_callback=self._process_backlog)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception as ex:
+            print(f'{type(ex)} occurred while closing file: {ex}')
+
+    def close(self):
+        if not getattr(self, '_close_requested', True):  # True if __init__ failed before watching the file
+            self._close_requested = True
+            self._tailer.unwatch(self._tailed_file)
+
+    def on_message(self, callback: callable):
+        assert callable(callback)
+        self._cb = callback
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def staleness(self) -> float:
+        """
+        :return: Time since the newest sample was received (s), None before the first sample
+        """
+        if self._sample_time is None:
+            return None
+        return time.monotonic() - self._sample_time
+
+    @property
+    def backlog(self) -> int:
+        """
+        :return: Bytes appended to the file that have not been read yet, 0 while the reader keeps up
+        """
+        return self._tailed_file.backlog
+
+    @property
+    def samples_received(self) -> int:
+        """
+        :return: Number of samples parsed since the instrument was created
+        """
+        return self._samples_received
+
+    @classmethod
+    def parse_value(cls, line: str) -> float:
+        """
+        :param line: Line of the log
+        :return: Uncalibrated value of the line
+        """
+        raise NotImplementedError
+
+    def _calibrate(self, value):
+        """
+        :param value: Uncalibrated value or array of values
+        :return: Calibrated value or values
+        """
+        return value
+
+    def _parse(self, line: str) -> float:
+        return self._calibrate(self.parse_value(line))
+
+    def _filter(self, value: float) -> float:
+        return value
+
+    def _parsed(self, lines: list):
+        for line in lines:
+            try:
+                yield self._parse(line)
+            except IndexError:
+                pass
+            except Exception as ex:
+                print(f'{type(ex)} occurred while processing data from {self._path}: {ex}')
+
+    def _values(self, lines: list) -> list:
+        """
+        Parses a batch of lines according to the samples policy
+        """
+        if self._samples == SAMPLES_NEWEST:
+            values = list(islice(self._parsed(reversed(lines)), 1))
+        else:
+            values = list(self._parsed(lines))
+        if values:
+            self._sample_time = time.monotonic()
+            self._samples_received += len(values)
+        return values
+
+    def _process_lines(self, lines: list):
+        """
+        Called by the tailer with all the lines appended to the file since its last wakeup
+        """
+        with self._dispatch_time.time():
+            for value in self._values(lines):
+                self._value = self._filter(value)
+                if self._cb is not None:
+                    self._cb(self._value)
+
+    def _process_backlog(self, lines: list):
+        """
+        Called by the tailer with lines written while nobody was reading the file.  They are filtered in one pass and
+        on_message is only called with the resulting value.
+        """
+        with self._dispatch_time.time():
+            if self._samples == SAMPLES_ALL:
+                values = self._calibrate(parse_lines(lines, type(self))).tolist()
+                if values:
+                    self._sample_time = time.monotonic()
+                    self._samples_received += len(values)
+            else:
+                values = self._values(lines)
+            if not values:
+                return
+            for value in values:
+                self._value = self._filter(value)
+            if self._cb is not None:
+                self._cb(self._value)
+
+
+class NodeRedInstrument(Instrument):
+    """
+    Instrument read through a Node-RED endpoint.  By default every read of value is a request to Node-RED.  With
+    subscribe=True Node-RED is asked once to push every new reading instead; value then returns the latest reading
+    without any network traffic and on_message is called with each reading, as for the FileInstruments.
+    """
+    request_command = None  # request answered with the current reading
+    subscribe_command = None  # request after which Node-RED pushes every new reading
+    quantity = 'data'  # what is read, for error messages
+
+    def __init__(self, host: str, port: int, *args, **kwargs):
+        """
+        :param host: Node-RED host
+        :param port: TCP port of the endpoint
+        :keyword subscribe: Have Node-RED push readings instead of requesting each one
+        :keyword connections: ConnectionManager to use instead of the shared one
+        :keyword framing: FRAMING_RAW or FRAMING_NEWLINE
+        """
+        connections = {name: kwargs.pop(name) for name in ('connections',) + CONNECTION_OPTIONS if name in kwargs}
+        self._subscribed = kwargs.pop('subscribe') if 'subscribe' in kwargs else False
+        super().__init__(*args, **kwargs)
+        self._host = host
+        self._port = port
+        self._cb = None
+        self._reading = None  # (value, time.time(), time.monotonic()) of the latest reading, replaced as a whole
+        self._read_time = histogram('node_red_read_seconds', 'Round trip of a reading requested from Node-RED',
+                                    instrument=type(self).__name__)
+
+        self._connection = connect(self._host, self._port, **connections)
+        if self._subscribed:
+            self._connection.subscribe(self.subscribe_command, self._process_message)
+
+    @property
+    def connection(self):
+        """
+        :return: Connection to Node-RED, see NodeRedConnection.statistics for its latency and uptime
+        """
+        return self._connection
+
+    @property
+    def subscribed(self) -> bool:
+        return self._subscribed
+
+    def on_message(self, callback: callable):
+        assert callable(callback)
+        self._cb = callback
+
+    def request_value(self) -> PendingRequest:
+        """
+        Sends the request for the current reading without waiting for the reply, see read_all_sensors
+        """
+        return self._connection.submit(self.request_command)
+
+    @property
+    def value(self):
+        if not self._subscribed:
+            try:
+                with self._read_time.time():
+                    value = self.request_value().result()
+            except Exception as ex:
+                print(f'{type(ex)} exception occurred while getting {self.quantity} from Node-RED: {ex}')
+                return None
+            if value is not None:
+                self._reading = (value, time.time(), time.monotonic())
+            return value
+        reading = self._reading
+        return reading[0] if reading is not None else None
+
+    @property
+    def timestamp(self) -> float:
+        """
+        :return: Time the latest reading was received (s since the epoch), None before the first reading
+        """
+        reading = self._reading
+        return reading[1] if reading is not None else None
+
+    @property
+    def staleness(self) -> float:
+        """
+        :return: Time since the latest reading was received (s), None before the first reading
+        """
+        reading = self._reading
+        return time.monotonic() - reading[2] if reading is not None else None
+
+    def _process_message(self, value):
+        """
+        Called on the connection's receiver thread with every reading pushed by Node-RED
+        """
+        self._reading = (value, time.time(), time.monotonic())
+        if self._cb is not None:
+            self._cb(value)
@@ -0,0 +1,280 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+"""
+Timing of the hot paths of the control loop.  A Histogram counts durations into fixed buckets; timing a block costs two
+perf_counter calls and a bisect, about a microsecond, so the instruments, the simulation and the run log can time every
+call.  The histograms of the shared registry are served in the Prometheus text format by MetricsServer and printed as
+a table by SummaryReporter:
+
+    with histogram('valve_write_seconds', 'Valve command').time():
+        ...
+    server = MetricsServer(port=9108)  # curl http://127.0.0.1:9108/metrics
+    reporter = SummaryReporter(60.0)
+"""
+
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)  # upper bounds (s)
+
+
+class _Timer:
+    """
+    Context manager that observes the time spent in its block
+    """
+    __slots__ = ('_histogram', '_started')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started)
+        return False
+
+
+class Histogram:
+    """
+    Cumulative histogram of durations, safe to observe from any thread
+    """
+
+    def __init__(self, name: str, help: str = '', buckets=DEFAULT_BUCKETS, labels: dict = None):
+        """
+        :param name: Prometheus metric name, e.g. 'cfd_update_seconds'
+        :param help: Description of what is timed
+        :param buckets: Ascending upper bounds of the buckets (s)
+        :param labels: Prometheus labels telling histograms of the same name apart, e.g. {'instrument': 'Fluoro.csv'}
+        """
+        self.name = name
+        self.help = help
+        self.labels = dict(labels) if labels else {}
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self._buckets) + 1)  # the last one counts values above every bound
+        self._sum = 0.0
+        self._max = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def time(self) -> _Timer:
+        """
+        :return: Context manager timing its block
+        """
+        return _Timer(self)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def statistics(self) -> dict:
+        """
+        :return: Count, sum, mean and maximum, and the median and 99th percentile interpolated within their buckets
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+            maximum = self._max
+        count = sum(counts)
+        return {
+            'count': count,
+            'sum': total,
+            'mean': total / count if count else 0.0,
+            'max': maximum,
+            'p50': self._quantile(counts, 0.5, maximum),
+            'p99': self._quantile(counts, 0.99, maximum),
+        }
+
+    def _quantile(self, counts: list, q: float, maximum: float) -> float:
+        count = sum(counts)
+        if not count:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self._buckets[i - 1] if i else 0.0
+                upper = self._buckets[i] if i < len(self._buckets) else maximum
+                return min(lower + (upper - lower) * (rank - cumulative) / bucket_count, maximum)
+            cumulative += bucket_count
+        return maximum
+
+    def render(self) -> list:
+        """
+        :return: Sample lines in the Prometheus text format
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        labels = ','.join(f'{key}="{_escape(value)}"' for key, value in self.labels.items())
+        separator = ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self._buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{self.name}_bucket{{{labels}{separator}le="{le}"}} {cumulative}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{self.name}_sum{suffix} {total!r}')
+        lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """
+    Histograms by name and labels
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def histogram(self, name: str, help: str = '', buckets=DEFAULT_BUCKETS, **labels) -> Histogram:
+        """
+        :return: The histogram of that name and labels, created on first use
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(name, help, buckets, labels)
+            return self._histograms[key]
+
+    @property
+    def histograms(self) -> list:
+        with self._lock:
+            return list(self._histograms.values())
+
+    def render(self) -> str:
+        """
+        :return: Every histogram in the Prometheus text format
+        """
+        lines = []
+        described = set()
+        for histogram in sorted(self.histograms, key=lambda h: h.name):
+            if histogram.name not in described:
+                described.add(histogram.name)
+                lines.append(f'# HELP {histogram.name} {histogram.help}')
+                lines.append(f'# TYPE {histogram.name} histogram')
+            lines.extend(histogram.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """
+        :return: Table of the histograms that have observations, times in ms
+        """
+        lines = [f'{"Metric":<48}{"Count":>9}{"Mean":>10}{"p50":>10}{"p99":>10}{"Max":>10}']
+        for histogram in sorted(self.histograms, key=lambda h: (h.name, sorted(h.labels.items()))):
+            s = histogram.statistics
+            if not s['count']:
+                continue
+            labels = ','.join(str(value) for value in histogram.labels.values())
+            name = f'{histogram.name}[{labels}]' if labels else histogram.name
+            lines.append(f'{name:<48}{s["count"]:>9}{s["mean"] * 1e3:>10.3f}{s["p50"] * 1e3:>10.3f}'
+                         f'{s["p99"] * 1e3:>10.3f}{s["max"] * 1e3:>10.3f}')
+        return '\n'.join(lines)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def registry() -> MetricsRegistry:
+    """
+    :return: The registry the instruments time their calls in
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+def histogram(name: str, help: str = '', buckets=DEFAULT_BUCKETS, **labels) -> Histogram:
+    """
+    :return: The histogram of that name and labels in the shared registry
+    """
+    return registry().histogram(name, help, buckets, **labels)
+
+
+class MetricsServer:
+    """
+    Serves a registry in the Prometheus text format at /metrics from a daemon thread
+    """
+
+    def __init__(self, metrics: MetricsRegistry = None, host: str = '127.0.0.1', port: int = 9108):
+        """
+        :param metrics: Registry to serve, the shared one by default
+        :param host: Address to listen on, the default only accepts local connections
+        :param port: TCP port, 0 for any free port
+        """
+        served = metrics if metrics is not None else registry()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = served.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+class SummaryReporter:
+    """
+    Prints the summary of a registry every interval seconds from a daemon thread
+    """
+
+    def __init__(self, interval: float = 60.0, metrics: MetricsRegistry = None):
+        self._interval = interval
+        self._metrics = metrics if metrics is not None else registry()
+        self._close_requested = threading.Event()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._close_requested.wait(self._interval):
+            try:
+                print(self._metrics.summary())
+            except Exception as ex:
+                print(f'{type(ex)} occurred while summarising the metrics: {ex}')
+
+    def close(self):
+        self._close_requested.set()
+        self._thread.join()
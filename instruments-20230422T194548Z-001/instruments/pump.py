@@ -1,23 +1,27 @@
 import socket, sys, json, threading, queue
 from time import sleep
+from .connection import connect
+from .metrics import histogram
 
 
 class Pump:
 
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, **kwargs):
+        """
+        :keyword deadband: Smallest change of speed sent to the pump (%), smaller changes are suppressed
+        :keyword min_command_interval: Shortest time between commands (s), see NodeRedConnection
+        :keyword keepalive: Time after which the speed is sent again (s), None to only send changes
+        """
         self._host = host
         self._port = port
 
         self._percent = 0.0
+        self._commanded = False
+        self._deadband = kwargs['deadband'] if 'deadband' in kwargs else 0.0
 
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.settimeout(10.0)
-        try:
-            self._socket.connect((self._host, self._port))
-            print(f'Connected')
-        except socket.timeout:
-            print(f'Could not connect to the Raspberry Pi')
-            raise BrokenPipeError(f'No Raspberry Pi found')
+        self._connection = connect(self._host, self._port, **kwargs)
+        self._write_time = histogram('actuator_write_seconds', 'Pump and valve commands, not waiting for the network',
+                                     actuator=f'pump {host}:{port}')
 
     @property
     def speed_percent(self) -> float:
@@ -37,7 +41,17 @@ class Pump:
             print(ex)
 
     def _set_speed_in_percent(self, value):
-        self._socket.send(str(value).encode('utf-8'))
+        repeat = self._commanded and abs(value - self._percent) <= self._deadband
+        if not repeat:
+            self._percent = value
+            self._commanded = True
+        with self._write_time.time():
+            self._connection.command(str(value).encode('utf-8'), repeat=repeat)
 
-    def __del__(self):
-        self._socket.close()
+    @property
+    def connection(self):
+        """
+        :return: Connection to Node-RED, see NodeRedConnection.statistics for its latency, uptime and the
+        commands sent and suppressed
+        """
+        return self._connection
@@ -0,0 +1,383 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import sys
+import threading
+import time
+from threading import Thread
+from time import sleep
+
+
+# inotify flags, see <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_DIRECTORY_EVENTS = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+class _Inotify:
+    """
+    Minimal ctypes binding to Linux inotify, watching the directories of the tailed files
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._directories = set()
+
+    def watch(self, path: str) -> None:
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory in self._directories:
+            return
+        if self._add_watch(self._fd, os.fsencode(directory), _IN_DIRECTORY_EVENTS) < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {directory}')
+        self._directories.add(directory)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits for any event in the watched directories
+        :return: True if there were events
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+        self.drain()
+        return True
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def drain(self) -> None:
+        """
+        Discards the pending events, only their arrival matters
+        """
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def _identity(stat_result) -> tuple:
+    """
+    Identity of a file that changes when it is replaced, None where the file system does not report inodes
+    """
+    if not stat_result.st_ino:
+        return None
+    return stat_result.st_dev, stat_result.st_ino
+
+
+class TailedFile:
+    """
+    File registered with a FileTailer.
+
+    A file that is replaced (log rotation) is read to its end before the new file is opened, and a file that shrinks
+    (truncation) is read again from the start; in both cases the header_lines of the new content are skipped.  With an
+    offset_file the offset of the last complete line is saved there, so a restart resumes from it instead of from the
+    end of the file.
+    """
+    max_read = 1 << 22  # most bytes read per wakeup, larger backlogs are read over several wakeups
+    save_interval = 1.0  # shortest time between saves of the offset (s)
+
+    def __init__(self, path: str, callback: callable, from_end: bool = True, header_lines: int = 0,
+                 offset_file: str = None, backlog_callback: callable = None):
+        self.path = path
+        self.callback = callback
+        self.backlog_callback = backlog_callback if backlog_callback is not None else callback
+        self._header_lines = header_lines
+        self._offset_file = offset_file
+        self._saved_offset = None
+        self._save_time = 0.0
+        self._catch_up_until = 0
+        self._stream = None
+        self._open()
+
+        saved = self._load_offset()
+        size = os.fstat(self._stream.fileno()).st_size
+        if saved is not None:
+            if saved['identity'] == self._identity and saved['offset'] <= size:
+                self._seek(saved['offset'])
+            else:  # replaced or truncated while nobody was reading it
+                self._seek(0)
+            self._catch_up_until = size
+        else:
+            self._seek(size if from_end else 0)
+
+    def _open(self) -> None:
+        self._stream = open(self.path, 'rb')
+        identity = _identity(os.fstat(self._stream.fileno()))
+        self._identity = list(identity) if identity is not None else None
+
+    def _seek(self, offset: int) -> None:
+        self._offset = offset
+        self._partial = b''
+        self._skip = self._header_lines if offset == 0 else 0
+
+    def _read(self, size: int) -> list:
+        """
+        Reads from the offset up to size bytes into the file
+        """
+        if size <= self._offset:
+            return []
+        self._stream.seek(self._offset)
+        data = self._stream.read(min(size - self._offset, self.max_read))
+        self._offset += len(data)
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()  # the writer may still be writing the last line
+        if self._skip:
+            skipped = min(self._skip, len(lines))
+            del lines[:skipped]
+            self._skip -= skipped
+        return [line.rstrip(b'\r').decode('utf-8', errors='replace') + '\n' for line in lines]
+
+    def read_lines(self) -> tuple:
+        """
+        Reads what was appended since the last call, following rotation and truncation
+        :return: Complete lines, each ending in a single newline like lines read in text mode, and whether they are
+        backlog missed while nobody was reading the file
+        """
+        if self._stream.closed:
+            return [], False
+        backlog = self._offset < self._catch_up_until
+        try:
+            stat_result = os.stat(self.path)
+        except FileNotFoundError:
+            stat_result = None
+        identity = _identity(stat_result) if stat_result is not None else None
+
+        if stat_result is None or (identity is not None and list(identity) != self._identity):
+            # rotated, finish the old file and then follow the path to the new one
+            lines = self._read(os.fstat(self._stream.fileno()).st_size)
+            if self._offset < os.fstat(self._stream.fileno()).st_size:
+                return lines, backlog
+            if self._partial:
+                lines.append(self._partial.rstrip(b'\r').decode('utf-8', errors='replace') + '\n')
+            if stat_result is None:
+                self._partial = b''
+                return lines, backlog
+            self._stream.close()
+            self._open()
+            self._seek(0)
+            self._catch_up_until = 0
+            return lines + self._read(stat_result.st_size), backlog
+
+        if stat_result.st_size < self._offset:
+            print(f'{self.path} was truncated, reading it again from the start')
+            self._seek(0)
+        return self._read(stat_result.st_size), backlog
+
+    @property
+    def backlog(self) -> int:
+        """
+        :return: Bytes appended to the file that have not been read yet
+        """
+        try:
+            return max(os.stat(self.path).st_size - self._offset, 0)
+        except OSError:
+            return 0
+
+    def _load_offset(self) -> dict:
+        if self._offset_file is None or not os.path.exists(self._offset_file):
+            return None
+        try:
+            with open(self._offset_file) as stream:
+                saved = json.load(stream)
+            self._saved_offset = saved['offset']
+            return saved
+        except Exception as ex:
+            print(f'{type(ex)} occurred while reading the offset of {self.path} from {self._offset_file}: {ex}')
+            return None
+
+    def save_offset(self, force: bool = False) -> None:
+        """
+        Saves the offset of the last complete line to the offset file, at most every save_interval unless forced
+        """
+        offset = self._offset - len(self._partial)
+        if self._offset_file is None or offset == self._saved_offset:
+            return
+        now = time.monotonic()
+        if not force and now - self._save_time < self.save_interval:
+            return
+        temporary_file = self._offset_file + '.tmp'
+        with open(temporary_file, 'w') as stream:
+            json.dump({'path': self.path, 'identity': self._identity, 'offset': offset}, stream)
+        os.replace(temporary_file, self._offset_file)
+        self._saved_offset = offset
+        self._save_time = now
+
+    def close(self) -> None:
+        if self._stream.closed:
+            return
+        try:
+            self.save_offset(force=True)
+        except Exception as ex:
+            print(f'{type(ex)} occurred while saving the offset of {self.path}: {ex}')
+        self._stream.close()
+
+
+class FileTailer:
+    """
+    Tails any number of files from one thread and hands every new line to the callback of its file.
+
+    On Linux the thread sleeps on inotify events for the files' directories; elsewhere, and as a fallback for network
+    shares that do not deliver inotify events, it polls the file sizes with stat, backing off from min_interval to
+    max_interval while the files are idle.  Appended data is read in one read per file and split into lines.
+    """
+
+    def __init__(self, min_interval: float = 0.005, max_interval: float = 0.04):
+        """
+        :param min_interval: Poll interval right after data arrived (s)
+        :param max_interval: Longest poll interval, the worst case latency from append to callback (s)
+        """
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._files = []
+        self._lock = threading.Lock()
+        self._close_requested = False
+        self._inotify = None
+        if sys.platform.startswith('linux'):
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError) as ex:
+                print(f'{type(ex)} occurred while setting up inotify, polling instead: {ex}')
+        self._start()
+
+    def _start(self):
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _stop(self):
+        self._thread.join(10.0)
+
+    def close(self):
+        self._close_requested = True
+        self._stop()
+        with self._lock:
+            for tailed_file in self._files:
+                tailed_file.close()
+            self._files = []
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def watch(self, path: str, callback: callable, from_end: bool = True, header_lines: int = 0,
+              offset_file: str = None, backlog_callback: callable = None) -> TailedFile:
+        """
+        Starts tailing a file
+        :param path: File to tail
+        :param callback: Called from the tailer thread with the list of new lines
+        :param from_end: Skip what is already in the file, unless offset_file has a saved offset
+        :param header_lines: Lines to skip when the file is read from the start, e.g. after rotation
+        :param offset_file: File to save the offset in so a restart resumes from it, None to not save it
+        :param backlog_callback: Called instead of callback with the lines missed while nobody was reading the file
+        :return: Handle to pass to unwatch
+        """
+        assert callable(callback)
+        tailed_file = TailedFile(path, callback, from_end, header_lines, offset_file, backlog_callback)
+        with self._lock:
+            if self._inotify is not None:
+                try:
+                    self._inotify.watch(path)
+                except OSError as ex:
+                    print(f'{type(ex)} occurred while watching {path}, polling instead: {ex}')
+            self._files = self._files + [tailed_file]
+        return tailed_file
+
+    def unwatch(self, tailed_file: TailedFile) -> None:
+        with self._lock:
+            self._files = [f for f in self._files if f is not tailed_file]
+        tailed_file.close()
+
+    def _read(self) -> list:
+        """
+        Reads the new lines of every file, the only part of a poll that touches the files apart from _save_offsets
+        :return: File, lines and whether they are backlog, for each file that had new lines
+        """
+        read = []
+        for tailed_file in self._files:  # watch and unwatch replace the list, so callbacks may call them
+            try:
+                lines, backlog = tailed_file.read_lines()
+            except Exception as ex:
+                print(f'{type(ex)} occurred while reading {tailed_file.path}: {ex}')
+                continue
+            if lines:
+                read.append((tailed_file, lines, backlog))
+        return read
+
+    @staticmethod
+    def _dispatch(read: list) -> None:
+        """
+        Hands the lines returned by _read to the callbacks
+        """
+        for tailed_file, lines, backlog in read:
+            try:
+                if backlog:
+                    tailed_file.backlog_callback(lines)
+                else:
+                    tailed_file.callback(lines)
+            except Exception as ex:
+                print(f'{type(ex)} occurred while processing data from {tailed_file.path}: {ex}')
+
+    @staticmethod
+    def _save_offsets(read: list) -> None:
+        """
+        Saves the offsets of the files read once their lines have been processed
+        """
+        for tailed_file, _, _ in read:
+            try:
+                tailed_file.save_offset()
+            except Exception as ex:
+                print(f'{type(ex)} occurred while saving the offset of {tailed_file.path}: {ex}')
+
+    def _poll(self) -> bool:
+        """
+        Reads and dispatches new lines of every file
+        :return: True if any file had new lines
+        """
+        read = self._read()
+        self._dispatch(read)
+        self._save_offsets(read)
+        return bool(read)
+
+    def _run(self):
+        interval = self._min_interval
+        while not self._close_requested:
+            if self._poll():
+                interval = self._min_interval
+            else:
+                interval = min(interval * 2, self._max_interval)
+
+            if self._inotify is not None:
+                self._inotify.wait(self._max_interval)
+            else:
+                sleep(interval)
+
+
+_shared_tailer = None
+_shared_tailer_lock = threading.Lock()
+
+
+def shared_tailer() -> FileTailer:
+    """
+    :return: The FileTailer used by the file based instruments unless they are given their own
+    """
+    global _shared_tailer
+    with _shared_tailer_lock:
+        if _shared_tailer is None:
+            _shared_tailer = FileTailer()
+        return _shared_tailer
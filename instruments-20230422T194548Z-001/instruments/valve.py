@@ -1,23 +1,24 @@
 import socket, sys, json, threading, queue
 from time import sleep
+from .connection import connect
+from .metrics import histogram
 
 
 class Valve:
 
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, **kwargs):
+        """
+        :keyword min_command_interval: Shortest time between commands (s), see NodeRedConnection
+        :keyword keepalive: Time after which the state is sent again (s), None to only send changes
+        """
         self._host = host
         self._port = port
 
         self._open = False
 
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.settimeout(10.0)
-        try:
-            self._socket.connect((self._host, self._port))
-            print(f'Connected')
-        except socket.timeout:
-            print(f'Could not connect to the Raspberry Pi')
-            raise BrokenPipeError(f'No Raspberry Pi found')
+        self._connection = connect(self._host, self._port, **kwargs)
+        self._write_time = histogram('actuator_write_seconds', 'Pump and valve commands, not waiting for the network',
+                                     actuator=f'valve {host}:{port}')
 
     @property
     def open(self) -> bool:
@@ -28,10 +29,16 @@ class Valve:
         try:
             if not isinstance(value, bool):
                 raise TypeError
-            self._socket.send(str(value).encode('utf-8'))
             self._open = value
+            with self._write_time.time():
+                self._connection.command(str(value).encode('utf-8'))
         except Exception as ex:
             print(ex)
 
-    def __del__(self):
-        self._socket.close()
+    @property
+    def connection(self):
+        """
+        :return: Connection to Node-RED, see NodeRedConnection.statistics for its latency, uptime and the
+        commands sent and suppressed
+        """
+        return self._connection
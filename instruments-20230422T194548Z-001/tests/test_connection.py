@@ -0,0 +1,260 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+import unittest
+from threading import Thread
+from instruments import aio
+from instruments.connection import NodeRedConnection, ConnectionManager, JSONStreamDecoder, FRAMING_RAW, \
+    FRAMING_NEWLINE, connect
+
+"""
+Tests of the Node-RED connection against a stand-in endpoint on a local port.  Run from the directory holding the
+instruments package:
+
+    python -m unittest discover tests
+"""
+
+HOST = '127.0.0.1'
+
+
+def wait_until(condition, timeout: float = 2.0) -> bool:
+    """
+    :return: True once condition() is true, False if it is still false after timeout seconds
+    """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class NodeRedStub:
+    """
+    Node-RED endpoint on a local port.  Every connection is read on its own thread; the bytes received are recorded
+    per connection and handed to handler, which may reply.
+    """
+
+    def __init__(self, handler=None, port: int = 0):
+        """
+        :param handler: Called with the client socket and the bytes received, None to only record them
+        :param port: TCP port, 0 for any free port
+        """
+        self._handler = handler
+        self._listener = socket.create_server((HOST, port))
+        self.port = self._listener.getsockname()[1]
+        self.received = []  # bytes received on each connection, in the order they were accepted
+        self._clients = []
+        self._lock = threading.Lock()
+        self._thread = Thread(target=self._accept)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                index = len(self.received)
+                self.received.append(b'')
+                self._clients.append(client)
+            thread = Thread(target=self._serve, args=(client, index))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, client: socket.socket, index: int):
+        while True:
+            try:
+                data = client.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            with self._lock:
+                self.received[index] += data
+            if self._handler is not None:
+                self._handler(client, data)
+
+    def data(self, index: int = 0) -> bytes:
+        """
+        :return: Bytes received so far on the index-th connection, empty if it has not been accepted yet
+        """
+        with self._lock:
+            return self.received[index] if index < len(self.received) else b''
+
+    def close(self):
+        """
+        Stops listening and drops every connection, as a restart of Node-RED does
+        """
+        try:
+            self._listener.shutdown(socket.SHUT_RDWR)  # wakes up accept, closing alone leaves the port listening
+        except OSError:
+            pass
+        self._listener.close()
+        self._thread.join(1.0)
+        with self._lock:
+            for client in self._clients:
+                try:
+                    client.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                client.close()
+
+
+class JSONStreamDecoderTest(unittest.TestCase):
+    def test_split_value(self):
+        decoder = JSONStreamDecoder()
+        message = '{"Waste Mass": 1.5, "Label": "µg"}'.encode('utf-8')
+        values = []
+        for i in range(len(message)):  # one byte per read, splitting the two byte character too
+            values.extend(decoder.feed(message[i:i + 1]))
+        self.assertEqual(values, [{'Waste Mass': 1.5, 'Label': 'µg'}])
+
+    def test_coalesced_values(self):
+        self.assertEqual(JSONStreamDecoder().feed(b'{"a": 1}[2, 3] 4'), [{'a': 1}, [2, 3], 4])
+        self.assertEqual(JSONStreamDecoder(delimited=True).feed(b'{"a": 1}\n{"b"'), [{'a': 1}])
+
+
+class NodeRedConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+        self.connections = []
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.close()
+        for server in self.servers:
+            server.close()
+
+    def serve(self, handler=None, port: int = 0) -> NodeRedStub:
+        server = NodeRedStub(handler, port)
+        self.servers.append(server)
+        return server
+
+    def connect(self, server: NodeRedStub, **kwargs) -> NodeRedConnection:
+        connection = NodeRedConnection(HOST, server.port, timeout=2.0, **kwargs)
+        self.connections.append(connection)
+        self.assertTrue(connection.open())
+        return connection
+
+    def test_split_reply(self):
+        def reply(client, data):
+            client.sendall(b'{"Waste Mass": 12.5, "Coll')
+            time.sleep(0.05)
+            client.sendall(b'ection Mass": 3.25}')
+
+        connection = self.connect(self.serve(reply))
+        self.assertEqual(connection.request('GetMass'), {'Waste Mass': 12.5, 'Collection Mass': 3.25})
+        self.assertEqual(connection.statistics['decode_errors'], 0)
+
+    def test_raw_framing(self):
+        server = self.serve(lambda client, data: client.sendall(b'42.5'))
+        connection = self.connect(server, framing=FRAMING_RAW)
+        self.assertEqual(connection.request('GetPressure'), 42.5)  # a number ending the data is complete
+        self.assertEqual(connection.request('GetPressure'), 42.5)
+        self.assertEqual(server.data(), b'GetPressureGetPressure')  # bare commands, no delimiter
+
+    def test_newline_framing(self):
+        requests = []
+
+        def reply(client, data):
+            requests.extend(json.loads(line) for line in data.decode('utf-8').splitlines())
+            if len(requests) == 2:  # answer the pipelined requests in reverse order, in one segment
+                client.sendall(b''.join(json.dumps({'id': request['id'], 'value': request['request']}).encode('utf-8')
+                                        + b'\n' for request in reversed(requests)))
+
+        server = self.serve(reply)
+        connection = self.connect(server, framing=FRAMING_NEWLINE)
+        first = connection.submit('GetMass')
+        second = connection.submit('GetPressure')
+        self.assertEqual(second.result(), 'GetPressure')
+        self.assertEqual(first.result(), 'GetMass')
+        self.assertEqual([request['request'] for request in requests], ['GetMass', 'GetPressure'])
+        self.assertNotEqual(requests[0]['id'], requests[1]['id'])
+        self.assertTrue(server.data().endswith(b'\n'))
+        self.assertEqual(connection.statistics['unexpected_replies'], 0)
+
+    def test_reconnect_replays_last_coalesced_command(self):
+        server = self.serve()
+        port = server.port
+        connection = self.connect(server, min_backoff=0.1, max_backoff=0.4, min_command_interval=10.0, keepalive=None)
+        self.assertTrue(connection.command(b'A'))
+        self.assertTrue(connection.command(b'B'))  # deferred by min_command_interval
+        self.assertTrue(connection.command(b'C'))  # replaces B before it is sent
+        self.assertEqual(connection.statistics['commands_coalesced'], 1)
+        self.assertTrue(wait_until(lambda: server.data() == b'A'))
+
+        server.close()
+        self.assertTrue(wait_until(lambda: connection.check() or not connection.connected))
+
+        # nothing listens, so each attempt fails and the wait before the next one doubles up to max_backoff
+        for backoff in (0.1, 0.2, 0.4, 0.4):
+            self.assertTrue(wait_until(lambda: connection.reconnect_due(time.monotonic())))
+            before = time.monotonic()
+            self.assertFalse(connection.reconnect())
+            after = time.monotonic()
+            self.assertFalse(connection.reconnect_due(before + backoff - 0.01))
+            self.assertTrue(connection.reconnect_due(after + backoff))
+        self.assertEqual(connection.statistics['failed_attempts'], 4)
+
+        server = self.serve(port=port)
+        self.assertTrue(wait_until(lambda: connection.reconnect_due(time.monotonic())))
+        self.assertTrue(connection.reconnect())
+        self.assertTrue(wait_until(lambda: server.data() == b'C'))
+        self.assertEqual(connection.service(time.monotonic() + 60.0), float('inf'))  # the deferred command was sent
+        time.sleep(0.1)
+        self.assertEqual(server.data(), b'C')
+        self.assertEqual(connection.statistics['reconnects'], 1)
+
+
+def unused_port() -> int:
+    """
+    :return: A local port nothing listens on
+    """
+    with socket.create_server((HOST, 0)) as listener:
+        return listener.getsockname()[1]
+
+
+class ConnectTest(unittest.TestCase):
+    def test_failed_first_connection_is_not_kept(self):
+        connections = ConnectionManager(check_interval=0.05)
+        try:
+            with self.assertRaises(BrokenPipeError):
+                connect(HOST, unused_port(), connections=connections)
+            self.assertEqual(connections.connections, [])
+        finally:
+            connections.close()
+
+    def test_shared_connection_is_kept_while_down(self):
+        server = NodeRedStub()
+        connections = ConnectionManager(check_interval=0.05)
+        try:
+            connection = connect(HOST, server.port, connections=connections, keepalive=None)
+            server.close()
+            self.assertTrue(wait_until(lambda: not connection.connected))
+            with self.assertRaises(BrokenPipeError):
+                connect(HOST, server.port, connections=connections)
+            self.assertEqual(connections.connections, [connection])  # another instrument still holds it
+        finally:
+            connections.close()
+
+    def test_failed_first_async_connection_is_not_kept(self):
+        async def attempt():
+            connections = aio.AsyncConnectionManager()
+            try:
+                with self.assertRaises(BrokenPipeError):
+                    await aio.connect(connections, HOST, unused_port())
+                return connections.connections
+            finally:
+                await connections.close()
+
+        self.assertEqual(asyncio.run(attempt()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,21 @@
 from instruments import FlowMeter, JKemTemperature, Pump, Valve, SynTQ, MovingAverage, Balance, PressureTransmitter
+from instruments import InstrumentLoop, MetricsServer, SummaryReporter, histogram
+from functools import partial
 from time import sleep
 from datetime import datetime, timedelta
 from threading import Thread
 from pid_control import PIDController
-from sched import scheduler
 from cfd import CFDModel
-import sched, time
+from ensemble import EnsembleCFDModel
+from clock import Clock
+from process_model import ProcessCFDModel
+from reactor_network import ReactorNetwork
+from simulation_worker import SimulationWorker
+from run_logger import RunLogger, SCHEMA_FILE, export_pending
+from control_scheduler import ControlScheduler, COALESCE
+import time
+import os
+import numpy as np
 
 
 PUMP_OFF = 0.0
@@ -14,44 +24,152 @@ PUMP_TWO_AND_A_HALF_ML_MIN = 50.0
 DIVERT_TO_WASTE = False
 DIVERT_TO_COLLECTION = True
 
-fluoro_flow = FlowMeter("\\\\PC-C6N8JC2\\Users\\Mettler\\Documents\\ContinuousFlowControl\\Fluoro.csv", 0.0038,
-                        -0.7274)
-cyclo_flow = FlowMeter("\\\\PC-C6N8JC2\\Users\\Mettler\\Documents\\ContinuousFlowControl\\Cyclo.csv", 0.0041,
-                       -1.0507)
-acrylate_flow = FlowMeter("\\\\PC-C6N8JC2\\Users\\Mettler\\Documents\\ContinuousFlowControl\\Acrylate.csv", 0.0048,
-                          -0.9793)
+CFD_IN_WORKER_PROCESSES = False  # run each reactor model in its own process, see process_model.py
+INSTRUMENTS_ON_EVENT_LOOP = False  # run all instruments on one asyncio event loop thread, see instruments/aio.py
+BALANCE_PUSH = False  # have Node-RED push balance readings instead of requesting one every tick, needs SubscribeMass
+METRICS_PORT = 9108  # serve the timing histograms at http://127.0.0.1:9108/metrics, None to not serve them
+METRICS_SUMMARY_INTERVAL = 300.0  # s between the timing summaries printed to the console, None to not print them
+# simulate this many variants of each reactor (perturbed kinetics and flow meter calibration, see ensemble.py) and
+# divert on the DIVERT_PERCENTILE band of the predicted product concentration, 0 to divert on a single prediction
+DIVERT_ENSEMBLE_MEMBERS = 0
+DIVERT_PERCENTILE = 5.0
+DIVERT_THRESHOLD = 100  # predicted reactor 2 product concentration below which the product goes to waste (mg/mL)
+
+# periods (s) of the step 3 and 4 tasks, each runs on its own fixed-rate grid, see control_scheduler.py
+INPUT_PERIOD = 0.1
+VALVE_PERIOD = 0.1
+BALANCE_PERIOD = 0.1
+LOG_PERIOD = 0.1
+
+ACRYLATE_DENSITY = 0.817
+FLUORO_DENSITY = 0.901
+CYCLO_DENSITY = 0.788
+
+# instruments and reactors are created by connect_instruments and create_reactors, replay.py substitutes its own
+fluoro_flow = None
+cyclo_flow = None
+acrylate_flow = None
+temperature_probe = None
+
+valve = None
+cyclo_pump = None
+fluoro_pump = None
+acrylate_pump = None
+balance_data = None
 
 acrylate_ma = MovingAverage(10)
 fluoro_ma = MovingAverage(10)
 cyclo_ma = MovingAverage(10)
 
-ACRYLATE_DENSITY = 0.817
-FLUORO_DENSITY = 0.901
-CYCLO_DENSITY = 0.788
+reactor1 = None
+reactor2 = None
+reactor_network = None
+
+clock = Clock()
+
+# latest results of the step 3 and 4 tasks
+latest_inputs = None  # acrylate, fluoro and cyclo flowrate (m3/s), reactor 1 temperature (degrees Celsius)
+predicted_concentration = (0.0, 0.0)
+balance_values = {}
 
-# acrylate_raman = SynTQ("\\\\DESKTOP-PG7HAVP\\synTQ_Shared_Data\\AcrylateRamanFileWriter.csv")
-# product_ir = SynTQ("\\\\DESKTOP-PG7HAVP\\SynTQRoot\\synTQ_Shared_Data\\ProductIR.csv")
-# fluoro_raman = SynTQ("\\\\DESKTOP-PG7HAVP\\SynTQRoot\\synTQ_Shared_Data\\FluoroRaman.csv")
 
-temperature_probe = JKemTemperature(
-    "\\\\PC-C6N8JC2\\Users\\Mettler\\Documents\\ContinuousFlowControl\\Temperature.csv")
+def connect_instruments():
+    """
+    Opens the instrument files and connects to Node-RED
+    :return: None
+    """
+    global fluoro_flow, cyclo_flow, acrylate_flow, temperature_probe
+    global valve, cyclo_pump, fluoro_pump, acrylate_pump, balance_data
+
+    if INSTRUMENTS_ON_EVENT_LOOP:
+        instruments = InstrumentLoop()
+        flow_meter = partial(instruments.file_instrument, FlowMeter)
+        jkem_temperature = partial(instruments.file_instrument, JKemTemperature)
+        create_valve, create_pump, create_balance = instruments.valve, instruments.pump, instruments.balance
+    else:
+        flow_meter, jkem_temperature = FlowMeter, JKemTemperature
+        create_valve, create_pump, create_balance = Valve, Pump, Balance
+
+    # the offset files let a restart pick up the samples logged while the program was not running
+    fluoro_flow = flow_meter("\\\\PC-C6N8JC2\\Users\\Mettler\\Documents\\ContinuousFlowControl\\Fluoro.csv", 0.0038,
+                             -0.7274, offset_file='Fluoro.offset')
+    cyclo_flow = flow_meter("\\\\PC-C6N8JC2\\Users\\Mettler\\Documents\\ContinuousFlowControl\\Cyclo.csv", 0.0041,
+                            -1.0507, offset_file='Cyclo.offset')
+    acrylate_flow = flow_meter("\\\\PC-C6N8JC2\\Users\\Mettler\\Documents\\ContinuousFlowControl\\Acrylate.csv", 0.0048,
+                               -0.9793, offset_file='Acrylate.offset')
+
+    # acrylate_raman = SynTQ("\\\\DESKTOP-PG7HAVP\\synTQ_Shared_Data\\AcrylateRamanFileWriter.csv")
+    # product_ir = SynTQ("\\\\DESKTOP-PG7HAVP\\SynTQRoot\\synTQ_Shared_Data\\ProductIR.csv")
+    # fluoro_raman = SynTQ("\\\\DESKTOP-PG7HAVP\\SynTQRoot\\synTQ_Shared_Data\\FluoroRaman.csv")
+
+    temperature_probe = jkem_temperature(
+        "\\\\PC-C6N8JC2\\Users\\Mettler\\Documents\\ContinuousFlowControl\\Temperature.csv", offset_file='Temperature.offset')
+
+    nodered_ip = '10.1.10.104'
+    valve = create_valve(nodered_ip, 56000)
+
+    cyclo_pump = create_pump(nodered_ip, 56001)
+    fluoro_pump = create_pump(nodered_ip, 56002)
+    acrylate_pump = create_pump(nodered_ip, 56003)
+    balance_data = create_balance(nodered_ip, 56004, subscribe=BALANCE_PUSH)
+    # pressure = PressureTransmitter(nodered_ip, 56005)
+
+
+def create_reactors(model=CFDModel):
+    """
+    Creates the two reactor models, reactor 1 feeding reactor 2, or ensembles of them if DIVERT_ENSEMBLE_MEMBERS is set
+    :param model: CFDModel, or ProcessCFDModel to run each model in its own process; ensembles run in this process
+    :return: None
+    """
+    global reactor1, reactor2, reactor_network
 
-nodered_ip = '10.1.10.104'
-valve = Valve(nodered_ip, 56000)
+    if DIVERT_ENSEMBLE_MEMBERS:
+        create_reactor_ensembles(DIVERT_ENSEMBLE_MEMBERS)
+        return
 
-cyclo_pump = Pump(nodered_ip, 56001)
-fluoro_pump = Pump(nodered_ip, 56002)
-acrylate_pump = Pump(nodered_ip, 56003)
-balance_data = Balance(nodered_ip, 56004)
-# pressure = PressureTransmitter(nodered_ip, 56005)
+    reactor1 = model(1200, 1000, nx= 500, Volume=10e-6, dt=0.005, RateTable=True)
+    #reactor2 = CFDModel(1, 1250, nx=500, Volume=5e-6 + 4.7e-6, dt=0.005, ArrheniusFactor=11.3, ActivationEnergy=23681, MolecularWeight=346.0)
+    reactor2 = model(1, 1250, nx=400, Volume=5e-6 + 3.36e-6, dt=0.005, ArrheniusFactor=11.3, ActivationEnergy=23681, MolecularWeight=346.0,
+                     RateTemperatureTolerance=0.0)  # isothermal at 25 degC, k1 never needs re-evaluating
 
-reactor1 = CFDModel(1200, 1000, nx= 500, Volume=10e-6, dt=0.005)
-#reactor2 = CFDModel(1, 1250, nx=500, Volume=5e-6 + 4.7e-6, dt=0.005, ArrheniusFactor=11.3, ActivationEnergy=23681, MolecularWeight=346.0)
-reactor2 = CFDModel(1, 1250, nx=400, Volume=5e-6 + 3.36e-6, dt=0.005, ArrheniusFactor=11.3, ActivationEnergy=23681, MolecularWeight=346.0)
+    reactor_network = ReactorNetwork()
+    reactor_network.add(reactor1)
+    reactor_network.add(reactor2, upstream=reactor1)  # reactor 1 outlet feeds species A of reactor 2
+
+
+def create_reactor_ensembles(members: int, seed: int = 0):
+    """
+    Creates the two reactors as ensembles whose members perturb the kinetics and the flow meter calibration slopes,
+    each member of reactor 1 feeding the same member of reactor 2
+    :param members: Number of variants of each reactor
+    :param seed: Seed of the perturbations
+    :return: None
+    """
+    global reactor1, reactor2, reactor_network
+
+    rng = np.random.default_rng(seed)
+    reactor1 = EnsembleCFDModel(1200, 1000, members, nx=500, Volume=10e-6, dt=0.005,
+                                ArrheniusFactor=923.8 * rng.lognormal(0.0, 0.1, members),
+                                ActivationEnergy=rng.normal(51080, 500, members),
+                                SpeciesAFlowrateScale=rng.normal(1.0, 0.02, members),
+                                SpeciesBFlowrateScale=rng.normal(1.0, 0.02, members))
+    reactor2 = EnsembleCFDModel(1, 1250, members, nx=400, Volume=5e-6 + 3.36e-6, dt=0.005,
+                                ArrheniusFactor=11.3 * rng.lognormal(0.0, 0.1, members),
+                                ActivationEnergy=rng.normal(23681, 500, members), MolecularWeight=346.0,
+                                RateTemperatureTolerance=0.0,
+                                SpeciesBFlowrateScale=rng.normal(1.0, 0.02, members))  # species A is reactor 1's outlet
+
+    reactor_network = ReactorNetwork()
+    reactor_network.add(reactor1)
+    reactor_network.add(reactor2, upstream=reactor1)
 
 start_time = None
 
-log_file = None
+run_log = None  # RunLogger of the current run
+
+CONSOLE_INTERVAL = 1.0  # s between the status lines of each kind the control loop prints
+last_console_times = {}  # time each kind of status line was last printed, keyed by name
+log_write_time = histogram('run_log_write_seconds', 'RunLogger.log on the control thread')
 
 
 def set_pump(pump, cv):
@@ -89,50 +207,56 @@ def set_pump(pump, cv):
 #     log_file.write('\n')
 #     log_file.flush()
 
+def _console_due(name: str = 'log') -> bool:
+    """
+    :param name: Kind of status line, each kind is throttled separately so one cannot hold back the others
+    :return: Whether CONSOLE_INTERVAL has passed since that kind of status line was last printed, printing every tick
+    costs the control thread more than logging does
+    """
+    now = time.monotonic()
+    last_console_time = last_console_times.get(name)
+    if last_console_time is not None and now - last_console_time < CONSOLE_INTERVAL:
+        return False
+    last_console_times[name] = now
+    return True
+
+
 def _log_data():
-    global log_file
-    human_time = datetime.now()
-    log_time = human_time.timestamp()
-    print(f'{human_time}')
+    log_time = clock.time()
+    if _console_due():
+        print(f'{datetime.fromtimestamp(log_time)}')
     # print(f'Pressure: {pressure.value}')
-    balance_values = balance_data.value
-    waste_mass = balance_values['Waste Mass']
-    collection_mass = balance_values['Collection Mass']
-    log_file.write(','.join(
-        [str(value) for value in
-         [log_time, human_time, acrylate_pump.speed_percent, fluoro_pump.speed_percent, cyclo_pump.speed_percent,
-          acrylate_flow.value, fluoro_flow.value, cyclo_flow.value, temperature_probe.value, valve.open, waste_mass, collection_mass,
-          None, None, None]]))
-          # None, None, pressure.value]]))
-    # product_ir.value, temperature_probe.value, valve.open, balance_data.value['Waste Mass'], balance_data.value['Collection Mass'], pressure.value]]))
-    log_file.write('\n')
-    log_file.flush()
+    poll_balance()
+    waste_mass = balance_values.get('Waste Mass')
+    collection_mass = balance_values.get('Collection Mass')
+    if run_log is not None:
+        with log_write_time.time():
+            run_log.log(log_time, acrylate_pump.speed_percent, fluoro_pump.speed_percent, cyclo_pump.speed_percent,
+                        acrylate_flow.value, fluoro_flow.value, cyclo_flow.value, temperature_probe.value, valve.open,
+                        waste_mass, collection_mass, None, None, None)
+            # None, None, pressure.value)
 
 
 def log_data(acrylate_flowrate, fluoro_flowrate, cyclo_flowrate, reactor_1_temperature, valve_state, pressure,
              concentrations):
-    global log_file
-    human_time = datetime.now()
-    log_time = human_time.timestamp()
-    print(f'{human_time}')
-    print(f'Pressure: {pressure}')
-    print(
-        f'\tReactor 1 Output Concentration: {concentrations[0]:6.4} mg/mL\tReactor 2 Output Concentration: {concentrations[1]:6.4} mg/mL')
-
-    balance_values = balance_data.value
-    waste_mass = balance_values['Waste Mass']
-    collection_mass = balance_values['Collection Mass']
+    log_time = clock.time()
+    if _console_due():
+        print(f'{datetime.fromtimestamp(log_time)}')
+        print(f'Pressure: {pressure}')
+        print(
+            f'\tReactor 1 Output Concentration: {concentrations[0]:6.4} mg/mL\tReactor 2 Output Concentration: {concentrations[1]:6.4} mg/mL')
+
+    waste_mass = balance_values.get('Waste Mass')  # read by poll_balance
+    collection_mass = balance_values.get('Collection Mass')
 
     # print(f'\tCalculated flow rates from balance data:\n\t\tFluoro: {balance_values["Fluoro Mass Flowrate"]/FLUORO_DENSITY:6.4}\tAcrylate: {balance_values["Acrylate Mass Flowrate"]/ACRYLATE_DENSITY:6.4}\tCyclo: {balance_values["Cyclo Mass Flowrate"]/CYCLO_DENSITY:6.4}')
     # print(f'\tFluoro: {fluoro_flowrate:6.4}\tAcrylate: {acrylate_flowrate:6.4}\tCyclo: {cyclo_flowrate:6.4}')
 
-    log_file.write(','.join(
-        [str(value) for value in
-         [log_time, human_time, acrylate_pump.speed_percent, fluoro_pump.speed_percent, cyclo_pump.speed_percent,
-          acrylate_flowrate, fluoro_flowrate, cyclo_flowrate, reactor_1_temperature, valve_state, waste_mass, collection_mass,
-          concentrations[0], concentrations[1], pressure]]))
-    log_file.write('\n')
-    log_file.flush()
+    if run_log is not None:
+        with log_write_time.time():
+            run_log.log(log_time, acrylate_pump.speed_percent, fluoro_pump.speed_percent, cyclo_pump.speed_percent,
+                        acrylate_flowrate, fluoro_flowrate, cyclo_flowrate, reactor_1_temperature, valve_state,
+                        waste_mass, collection_mass, concentrations[0], concentrations[1], pressure)
 
 
 # def pid_tune_function():
@@ -171,7 +295,7 @@ def step_2():
         print(
             f'Step 2: Waiting for temperature to reach {temperature_probe.normal_operating_range[0]} degrees.  Current value: {temperature_probe.value}')
         _log_data()
-        sleep(2.0)
+        clock.sleep(2.0)
 
     # Set fluoro and acrylate pumps to 2.5 ml/min
     # fluoro_controller.setpoint = 2.4
@@ -181,12 +305,165 @@ def step_2():
     cyclo_pump.speed_percent = PUMP_TWO_AND_A_HALF_ML_MIN
 
 
+def read_inputs() -> dict:
+    """
+    Reads the smoothed flow meter readings and the temperature
+    :return: Property values to set on each reactor, as taken by SimulationWorker.set_inputs
+    """
+    temperature = temperature_probe.value
+    # balance_values = balance_data.value
+
+    # acrylate_flowrate = acrylate_ma(acrylate_flow.value*1.667e-8)
+    # fluoro_flowrate = fluoro_ma(fluoro_flow.value*1.667e-8)
+    # cyclo_flowrate = cyclo_ma(cyclo_flow.value*1.667e-8)
+
+    acrylate_flowrate = acrylate_ma(acrylate_flow.value)
+    fluoro_flowrate = fluoro_ma(fluoro_flow.value)
+    cyclo_flowrate = cyclo_ma(cyclo_flow.value)
+
+    # calculated_acrylate_flowrate = balance_values['Acrylate Mass Flowrate']/ACRYLATE_DENSITY
+    # calculated_fluoro_flowrate = balance_values['Fluoro Mass Flowrate'] / FLUORO_DENSITY
+    # calculated_cyclo_flowrate = balance_values['Cyclo Mass Flowrate'] / FLUORO_DENSITY
+    #
+    # calculated_acrylate_flowrate = calculated_acrylate_flowrate if calculated_acrylate_flowrate < 5 else acrylate_flowrate
+    # calculated_fluoro_flowrate = calculated_fluoro_flowrate if calculated_fluoro_flowrate < 5 else fluoro_flowrate
+    # calculated_cyclo_flowrate = calculated_cyclo_flowrate if calculated_cyclo_flowrate < 5 else cyclo_flowrate
+    #
+    # acrylate_flowrate = acrylate_flowrate if acrylate_flowrate < 1 else calculated_acrylate_flowrate
+    # fluoro_flowrate = fluoro_flowrate if fluoro_flowrate < 1 else calculated_fluoro_flowrate
+    # cyclo_flowrate = cyclo_flowrate if cyclo_flowrate < 1 else calculated_cyclo_flowrate
+
+    # print(f'Acrylate flowrate: {acrylate_ma.value:5.2}\tFluoro flowrate: {fluoro_ma.value:5.2}')
+
+    acrylate_flowrate = acrylate_flowrate if acrylate_flowrate > 0 else 0.0
+    fluoro_flowrate = fluoro_flowrate if fluoro_flowrate > 0 else 0.0
+    cyclo_flowrate = cyclo_flowrate if cyclo_flowrate > 0 else 0.0
+
+    if _console_due('inputs'):
+        print(f'Acrylate flowrate: {acrylate_flowrate:6.4}\tFluoro flowrate: {fluoro_flowrate:6.4}\tCyclo flowrate: {cyclo_flowrate:6.4}')
+
+    acrylate_flowrate = acrylate_flowrate*1.667e-8
+    fluoro_flowrate = fluoro_flowrate*1.667e-8
+    cyclo_flowrate = cyclo_flowrate*1.667e-8
+
+    global latest_inputs
+    latest_inputs = (acrylate_flowrate, fluoro_flowrate, cyclo_flowrate, temperature)
+
+    return {
+        reactor1: {'temperature': temperature + 273.15,
+                   'species_A_flowrate': acrylate_flowrate,
+                   'species_B_flowrate': fluoro_flowrate},
+        reactor2: {'temperature': 25.0 + 273.15,
+                   'species_B_flowrate': cyclo_flowrate}}
+
+
+def update_inputs(simulation: SimulationWorker) -> None:
+    """
+    Hands the smoothed flow meter readings and the temperature to the simulation
+    """
+    simulation.set_inputs(read_inputs())
+
+
+def initialise_reactors() -> None:
+    """
+    Starts the reactors from their steady state at the current flowrates and temperature instead of the uniform
+    profiles of reset_arrays, which take a residence time to wash out before the predictions mean anything.
+    Without any flow there is no steady state to start from and the reactors keep their reset profiles.
+    :return: None
+    """
+    inputs = read_inputs()
+    for reactor, values in inputs.items():
+        for name, value in values.items():
+            setattr(reactor, name, value)
+    if not any(latest_inputs[:3]):
+        print('No flow yet, starting the reactors from their reset profiles')
+        return
+
+    try:
+        reactor_network.solve_steady_state()
+    except Exception as ex:
+        print(f'{type(ex)} occurred while solving the steady state, starting from the reset profiles: {ex}')
+        for reactor in reactor_network.reactors:
+            reactor.reset_arrays()
+
+
+def update_valve(simulation: SimulationWorker) -> tuple:
+    """
+    Sets the valve from the latest predicted product concentration
+    :return: Predicted product concentration of reactor 1 and 2 (mg/mL)
+    """
+    global predicted_concentration
+    # print(
+    #     f'Solvent: {cyclo_flow.value:0.2}\tFluoro: {fluoro_flow.value:0.2}\tAcrylate: {acrylate_flow.value:0.2}')
+    # if all([ins.within_range for ins in checked_instruments]):
+    #     print('Inside normal operating conditions.  Diverting to collection.')
+    #     valve.open = DIVERT_TO_COLLECTION
+    # else:
+    #     print('Outside normal operating conditions. Diverting to waste. ')
+    #     for ins in checked_instruments:
+    #         if not ins.within_range:
+    #             print(f'{ins} outside of normal operating range {ins.normal_operating_range}: {ins.value:0.2}')
+    #     valve.open = DIVERT_TO_WASTE
+
+    # latest published results, the simulation itself runs on the worker thread
+    snapshot = simulation.snapshot
+    if snapshot is not None:
+        if _console_due('lag'):
+            print(f'Simulation lag: {snapshot.lag:0.3} s')
+        predicted_concentration = (snapshot.product_concentrations[0]*0.96*0.98,
+                                   snapshot.product_concentrations[1]*0.96*0.98)
+        band = snapshot.product_concentration_bands[1]
+        # an ensemble diverts on its lower band (the first of the worker's percentiles), so most members agree
+        divert_concentration = band[0]*0.96*0.98 if band is not None else predicted_concentration[1]
+    else:
+        predicted_concentration = (0.0, 0.0)  # no prediction yet, keep diverting to waste
+        divert_concentration = 0.0
+
+    if divert_concentration < DIVERT_THRESHOLD:
+        valve.open = DIVERT_TO_WASTE
+    else:
+        valve.open = DIVERT_TO_COLLECTION
+    return predicted_concentration
+
+
+def poll_balance() -> None:
+    """
+    Reads the balance, a Node-RED round trip unless it pushes its readings
+    """
+    global balance_values
+    balance_values = balance_data.value or {}  # None until the first reading or while Node-RED is reconnecting
+
+
+def log_step() -> None:
+    """
+    Logs the latest inputs, valve state and predictions
+    """
+    if latest_inputs is None:
+        return
+    acrylate_flowrate, fluoro_flowrate, cyclo_flowrate, temperature = latest_inputs
+    # log_data(acrylate_flowrate, fluoro_flowrate, cyclo_flowrate, temperature, valve.open, pressure.value,
+    #          predicted_concentration)
+    log_data(acrylate_flowrate, fluoro_flowrate, cyclo_flowrate, temperature, valve.open, None,
+             predicted_concentration)
+
+
+def control_step(simulation: SimulationWorker) -> tuple:
+    """
+    One pass of all the step 3 and 4 tasks in order: hands the instrument readings to the simulation, sets the valve
+    from the latest predicted product concentration, reads the balance and logs the data
+    :return: Predicted product concentration of reactor 1 and 2 (mg/mL)
+    """
+    update_inputs(simulation)
+    concentrations = update_valve(simulation)
+    poll_balance()
+    log_step()
+    return concentrations
+
+
 def step_3_and_4():
-    start_time = datetime.now()
+    start_time = clock.now()
     duration = timedelta(days=1, minutes=25.0)
 
-    continue_current_step = True
-
     # acrylate_raman.normal_operating_range = (1.05, 1.35)
     # fluoro_raman.normal_operating_range = (0.85, 1.15)
     # product_ir.normal_operating_range = (150, 190)
@@ -200,112 +477,31 @@ def step_3_and_4():
     # checked_instruments = [acrylate_raman, fluoro_raman, product_ir, temperature_probe]
     checked_instruments = [temperature_probe]
 
-    # s = sched.scheduler(time.time, time.sleep)
+    initialise_reactors()
+    simulation = SimulationWorker(reactor_network, clock=clock,
+                                  percentiles=(DIVERT_PERCENTILE, 50.0, 100.0 - DIVERT_PERCENTILE))
 
-    def process_inputs():
-        while continue_current_step:
-            try:
-                # print(
-                #     f'Solvent: {cyclo_flow.value:0.2}\tFluoro: {fluoro_flow.value:0.2}\tAcrylate: {acrylate_flow.value:0.2}')
-                # if all([ins.within_range for ins in checked_instruments]):
-                #     print('Inside normal operating conditions.  Diverting to collection.')
-                #     valve.open = DIVERT_TO_COLLECTION
-                # else:
-                #     print('Outside normal operating conditions. Diverting to waste. ')
-                #     for ins in checked_instruments:
-                #         if not ins.within_range:
-                #             print(f'{ins} outside of normal operating range {ins.normal_operating_range}: {ins.value:0.2}')
-                #     valve.open = DIVERT_TO_WASTE
-                # log_data()
-                # sleep(1.0)
-                temperature = temperature_probe.value
-                # balance_values = balance_data.value
-
-                # acrylate_flowrate = acrylate_ma(acrylate_flow.value*1.667e-8)
-                # fluoro_flowrate = fluoro_ma(fluoro_flow.value*1.667e-8)
-                # cyclo_flowrate = cyclo_ma(cyclo_flow.value*1.667e-8)
-
-                acrylate_flowrate = acrylate_ma(acrylate_flow.value)
-                fluoro_flowrate = fluoro_ma(fluoro_flow.value)
-                cyclo_flowrate = cyclo_ma(cyclo_flow.value)
-
-                # calculated_acrylate_flowrate = balance_values['Acrylate Mass Flowrate']/ACRYLATE_DENSITY
-                # calculated_fluoro_flowrate = balance_values['Fluoro Mass Flowrate'] / FLUORO_DENSITY
-                # calculated_cyclo_flowrate = balance_values['Cyclo Mass Flowrate'] / FLUORO_DENSITY
-                #
-                # calculated_acrylate_flowrate = calculated_acrylate_flowrate if calculated_acrylate_flowrate < 5 else acrylate_flowrate
-                # calculated_fluoro_flowrate = calculated_fluoro_flowrate if calculated_fluoro_flowrate < 5 else fluoro_flowrate
-                # calculated_cyclo_flowrate = calculated_cyclo_flowrate if calculated_cyclo_flowrate < 5 else cyclo_flowrate
-                #
-                # acrylate_flowrate = acrylate_flowrate if acrylate_flowrate < 1 else calculated_acrylate_flowrate
-                # fluoro_flowrate = fluoro_flowrate if fluoro_flowrate < 1 else calculated_fluoro_flowrate
-                # cyclo_flowrate = cyclo_flowrate if cyclo_flowrate < 1 else calculated_cyclo_flowrate
-
-                # print(f'Acrylate flowrate: {acrylate_ma.value:5.2}\tFluoro flowrate: {fluoro_ma.value:5.2}')
-
-                acrylate_flowrate = acrylate_flowrate if acrylate_flowrate > 0 else 0.0
-                fluoro_flowrate = fluoro_flowrate if fluoro_flowrate > 0 else 0.0
-                cyclo_flowrate = cyclo_flowrate if cyclo_flowrate > 0 else 0.0
-
-                print(f'Acrylate flowrate: {acrylate_flowrate:6.4}\tFluoro flowrate: {fluoro_flowrate:6.4}\tCyclo flowrate: {cyclo_flowrate:6.4}')
-
-                acrylate_flowrate = acrylate_flowrate*1.667e-8
-                fluoro_flowrate = fluoro_flowrate*1.667e-8
-                cyclo_flowrate = cyclo_flowrate*1.667e-8
-
-                reactor1.set_temperature_in_degrees_celsius(temperature)
-                reactor1.species_A_flowrate = acrylate_flowrate
-                reactor1.species_B_flowrate = fluoro_flowrate
-
-                reactor1.update()
-
-                reactor2.set_temperature_in_degrees_celsius(25.0)
-                reactor2.species_A_flowrate = reactor1.combined_flowrate
-                reactor2.species_B_flowrate = cyclo_flowrate
-                reactor2.species_A_stock_concentration = reactor1.default_product_concentration
-
-                reactor2.update()
-
-                predicted_concentration = (reactor1.product_concentration*0.96*0.98, reactor2.product_concentration*0.96*0.98)
-
-                # def print_time(a='default'):
-                #     print("From print_time", time.time(), a)
-                #
-                # def print_some_times():
-                #     print(time.time())
-                #
-                # s.enter(10, 1, print_time)
-                # s.enter(5, 2, print_time, argument=('positional',))
-                # s.enter(5, 1, print_time, kwargs={'a': 'keyword'})
-                # s.run()
-                # print(time.time())
-
-                if predicted_concentration[1] < 100:
-                    valve.open = DIVERT_TO_WASTE
-                else:
-                    valve.open = DIVERT_TO_COLLECTION
-                # log_data(acrylate_flowrate, fluoro_flowrate, cyclo_flowrate, temperature, valve.open, pressure.value,
-                #          predicted_concentration)
-                log_data(acrylate_flowrate, fluoro_flowrate, cyclo_flowrate, temperature, valve.open, None,
-                         predicted_concentration)
-            except Exception as ex:
-                print(ex)
-
-            # sleep(0.038)
-            sleep(0.1)
+    # added in the order control_step runs them, which is also the order they run in when due together
+    scheduler = ControlScheduler(clock)
+    scheduler.add('inputs', INPUT_PERIOD, partial(update_inputs, simulation))
+    scheduler.add('valve', VALVE_PERIOD, partial(update_valve, simulation), overrun=COALESCE)
+    scheduler.add('balance', BALANCE_PERIOD, poll_balance)
+    scheduler.add('log', LOG_PERIOD, log_step, overrun=COALESCE)
 
     try:
-        process_thread = Thread(target=process_inputs)
+        process_thread = Thread(target=scheduler.run)
         process_thread.start()
 
         print(f'Waiting for a duration of {duration}')
-        while (datetime.now() - start_time) < duration:
-            sleep(1.0)
+        while (clock.now() - start_time) < duration:
+            clock.sleep(1.0)
     except KeyboardInterrupt:
         pass
 
-    continue_current_step = False
+    scheduler.stop()
     process_thread.join(10.0)
+    simulation.close()
+    print(scheduler.report())
 
 
 def step_5():
@@ -333,30 +529,51 @@ def step_6():
     # # solvent_controller.override_control_value = 0.0
 
 
-def main(filename: str):
-    global log_file
+def open_run_log(filename: str) -> RunLogger:
+    """
+    Opens the run log log_data writes to: a directory of binary columns named after the CSV file, which main exports
+    to the CSV at the end of the run.  Rows a crashed run left in the directory are exported first.
+    :param filename: CSV file, e.g. 'Run1.csv' logs to the directory 'Run1'
+    :return: The logger
+    """
     # log_file = open('C:\\Users\\Mettler\\Desktop\\PythonOrchestration\\InstrumentData.csv', 'a+')
-    log_file = open(filename, 'a+')
-    log_file.write(
-        'Timestamp,'
-        'Human Timestamp,'
-        'Acrylate Pump,'
-        'Fluoro Pump,'
-        'Cyclo Pump,'
-        'Acrylate Flowrate,'
-        'Fluoro Flowrate,'
-        'Cyclo Flowrate,'
-        # 'Acrylate Concentration,'
-        # 'Cyclo Concentration,'
-        # 'Product Concentration,'
-        'Temperature,'
-        'Valve Set to Collection,'
-        'Waste Mass,'
-        'Collection Mass,'
-        'Reactor 1 Product Concentration,'
-        'Reactor 2 Product Concentration,'
-        'Pressure\n')
+    directory = os.path.splitext(filename)[0]
+    if os.path.exists(os.path.join(directory, SCHEMA_FILE)):
+        rows = export_pending(directory, filename)
+        if rows:
+            print(f'Exported {rows} rows an unfinished run left in {directory} to {filename}')
+    return RunLogger(directory)
+
+
+def close_run_log(filename: str = None) -> None:
+    """
+    Writes out and closes the run log, then appends it to a CSV file in the format main.py used to write
+    :param filename: CSV file, None to keep only the binary columns
+    """
+    global run_log
+    if run_log is None:
+        return
+    run_log.close()
+    if filename is not None:
+        # only the rows not exported yet, the directory also holds earlier runs logged under the same name
+        rows = export_pending(run_log.directory, filename)
+        print(f'Exported {rows} rows from {run_log.directory} to {filename}')
+    run_log = None
+
+
+def main(filename: str):
+    global run_log
+    run_log = open_run_log(filename)
+    metrics_server = None
+    summary_reporter = None
     try:
+        if METRICS_PORT is not None:
+            try:
+                metrics_server = MetricsServer(port=METRICS_PORT)
+            except OSError as ex:  # e.g. the port is in use, the run goes on without serving the metrics
+                print(f'{type(ex)} occurred while starting the metrics server on port {METRICS_PORT}: {ex}')
+        if METRICS_SUMMARY_INTERVAL is not None:
+            summary_reporter = SummaryReporter(METRICS_SUMMARY_INTERVAL)
         print('Starting step 1')
         step_1()
         print('Starting step 2')
@@ -369,13 +586,20 @@ def main(filename: str):
         step_6()
         print('Done')
     finally:
-        log_file.close()
+        close_run_log(filename)
+        if summary_reporter is not None:
+            summary_reporter.close()
+        if metrics_server is not None:
+            metrics_server.close()
 
 
 if __name__ == '__main__':
 
     filename = input('Enter the name for the CSV file (minus the .csv): ') + '.csv'
 
+    connect_instruments()
+    create_reactors(ProcessCFDModel if CFD_IN_WORKER_PROCESSES else CFDModel)
+
     try:
         print('Waiting for data from instruments')
         for instrument in [temperature_probe, fluoro_flow, acrylate_flow, cyclo_flow]:
@@ -0,0 +1,333 @@
+import multiprocessing
+import numpy as np
+from multiprocessing.shared_memory import SharedMemory
+from numpy import ndarray
+from cfd import CFDModel
+
+"""
+CFDModel hosted in a worker process so the solver runs on its own core and never holds the GIL of the control
+process.  The proxy keeps the model inputs and outputs in a shared memory block and only sends short commands over a
+pipe; per sub-step inlet and outlet histories go through a second shared memory block.
+
+With the spawn start method (Windows) the worker re-imports the main module, so proxies must only be created under
+if __name__ == '__main__' or from a function, never at import time.
+"""
+
+# inputs written by the proxy before each command, read by the worker
+_INPUTS = ('temperature', 'species_A_flowrate', 'species_B_flowrate', 'species_A_stock_concentration',
+           'species_B_stock_concentration')
+# outputs written by the worker after each command
+_OUTPUTS = ('dt1', 'default_product_concentration', 'last_step_count', 'total_steps', 'simulated_time')
+_STATE = {name: i for i, name in enumerate(_INPUTS + _OUTPUTS)}
+
+
+def _serve(connection, state_name: str, args: tuple, kwargs: dict) -> None:
+    """
+    Worker process loop, runs commands sent by ProcessCFDModel until told to close
+    """
+    state_memory = SharedMemory(name=state_name)
+    state = np.ndarray((len(_STATE),), dtype=float, buffer=state_memory.buf)
+    history_memory = None
+    history = None
+
+    def write_outputs():
+        state[_STATE['dt1']] = model.dt1
+        state[_STATE['default_product_concentration']] = model.default_product_concentration
+        state[_STATE['last_step_count']] = model.last_step_count
+        state[_STATE['total_steps']] = model.total_steps
+        state[_STATE['simulated_time']] = model.simulated_time
+
+    try:
+        model = CFDModel(*args, **kwargs)
+        for name in _INPUTS:
+            state[_STATE[name]] = getattr(model, name)
+        write_outputs()
+        connection.send((True, (model.adaptive_time_step, model.courant_limit, model.nx1)))
+    except Exception as ex:
+        connection.send((False, ex))
+        state_memory.close()
+        return
+
+    while True:
+        command, arguments = connection.recv()
+        if command == 'close':
+            break
+        try:
+            for name in _INPUTS:
+                setattr(model, name, float(state[_STATE[name]]))
+
+            result = None
+            if command == 'advance':
+                n_steps, history_name, capacity, use_inlet, use_outlet = arguments
+                if history_name is not None and (history_memory is None or history_memory.name != history_name):
+                    if history_memory is not None:
+                        history = None
+                        history_memory.close()
+                    history_memory = SharedMemory(name=history_name)
+                    history = np.ndarray((2, capacity), dtype=float, buffer=history_memory.buf)
+                model.advance(n_steps, inlet_A_history=history[0, :n_steps] if use_inlet else None,
+                              outlet_history=history[1, :n_steps] if use_outlet else None)
+            elif command == 'update':
+                model.update(*arguments)
+            elif command == 'record_steps':
+                model._record_steps(*arguments)
+            elif command == 'set_time_step':
+                model._set_time_step(*arguments)
+            elif command == 'stable_time_step':
+                result = model.stable_time_step
+            elif command == 'reset_arrays':
+                model.reset_arrays()
+            elif command == 'solve_steady_state':
+                result = model.solve_steady_state(*arguments)
+            else:
+                raise ValueError(f'Unknown command {command}')
+
+            write_outputs()
+            connection.send((True, result))
+        except Exception as ex:
+            connection.send((False, ex))
+
+    if history_memory is not None:
+        history = None
+        history_memory.close()
+    state = None
+    state_memory.close()
+
+
+class ProcessCFDModel:
+    """
+    Stand-in for CFDModel that runs the model in a worker process.  It takes the same arguments and supports the
+    parts of the CFDModel interface used by main.py and ReactorNetwork: the input properties, the outlet
+    concentrations, update, advance and the time step properties.
+    """
+
+    def __init__(self, species_A_concentration: float, species_B_concentration: float, **kwargs):
+        """
+        :param species_A_concentration: Stock concentration of species A (acrylate) (mol/m3)
+        :param species_B_concentration: Stock concentration of species B (fluoro) (mol/m3)
+        """
+        self._state_memory = SharedMemory(create=True, size=len(_STATE) * 8)
+        self._state = np.ndarray((len(_STATE),), dtype=float, buffer=self._state_memory.buf)
+        self._history_memory = None
+        self._history = np.empty((2, 0))
+
+        self._connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(child_connection, self._state_memory.name,
+                                 (species_A_concentration, species_B_concentration), kwargs))
+        self._process.daemon = True
+        self._process.start()
+        child_connection.close()
+
+        try:
+            self.adaptive_time_step, self.courant_limit, self.nx1 = self._receive()
+        except Exception:
+            self.close()
+            raise
+
+    def __del__(self):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stops the worker process and releases the shared memory
+        """
+        if getattr(self, '_state_memory', None) is None:
+            return
+        try:
+            if self._process.is_alive():
+                self._connection.send(('close', ()))
+                self._process.join(10.0)
+        except (BrokenPipeError, OSError):
+            pass
+        if self._process.is_alive():
+            self._process.terminate()
+        self._connection.close()
+
+        self._state = None
+        self._history = None
+        for memory in (self._state_memory, self._history_memory):
+            if memory is not None:
+                memory.close()
+                memory.unlink()
+        self._state_memory = self._history_memory = None
+
+    def _receive(self):
+        succeeded, result = self._connection.recv()
+        if not succeeded:
+            raise result
+        return result
+
+    def _call(self, command: str, *arguments):
+        self._connection.send((command, arguments))
+        return self._receive()
+
+    def _history_buffer(self, n_steps: int) -> ndarray:
+        """
+        Shared (inlet, outlet) history rows with room for at least n_steps sub-steps
+        """
+        if self._history.shape[1] < n_steps:
+            capacity = max(n_steps, 2 * self._history.shape[1], 1024)
+            if self._history_memory is not None:
+                self._history = None
+                self._history_memory.close()
+                self._history_memory.unlink()
+            self._history_memory = SharedMemory(create=True, size=2 * capacity * 8)
+            self._history = np.ndarray((2, capacity), dtype=float, buffer=self._history_memory.buf)
+        return self._history
+
+    # region Inputs
+    @property
+    def temperature(self) -> float:
+        """
+        :return: Temperature (degrees K)
+        """
+        return float(self._state[_STATE['temperature']])
+
+    @temperature.setter
+    def temperature(self, value: float):
+        self._state[_STATE['temperature']] = value
+
+    def set_temperature_in_degrees_celsius(self, value: float) -> None:
+        self.temperature = value + 273.15
+
+    @property
+    def species_A_flowrate(self) -> float:
+        """
+        :return: Acrylate flowrate (m3/s)
+        """
+        return float(self._state[_STATE['species_A_flowrate']])
+
+    @species_A_flowrate.setter
+    def species_A_flowrate(self, value: float):
+        self._state[_STATE['species_A_flowrate']] = value
+
+    @property
+    def species_B_flowrate(self) -> float:
+        """
+        :return: Fluoro flowrate (m3/s)
+        """
+        return float(self._state[_STATE['species_B_flowrate']])
+
+    @species_B_flowrate.setter
+    def species_B_flowrate(self, value: float):
+        self._state[_STATE['species_B_flowrate']] = value
+
+    @property
+    def combined_flowrate(self) -> float:
+        """
+        :return: Combined flowrate of species A and B (m3/s)
+        """
+        return self.species_A_flowrate + self.species_B_flowrate
+
+    @property
+    def species_A_stock_concentration(self) -> float:
+        return float(self._state[_STATE['species_A_stock_concentration']])
+
+    @species_A_stock_concentration.setter
+    def species_A_stock_concentration(self, value: float):
+        self._state[_STATE['species_A_stock_concentration']] = value
+
+    @property
+    def species_B_stock_concentration(self) -> float:
+        return float(self._state[_STATE['species_B_stock_concentration']])
+
+    @species_B_stock_concentration.setter
+    def species_B_stock_concentration(self, value: float):
+        self._state[_STATE['species_B_stock_concentration']] = value
+
+    # endregion
+
+    # region Outputs
+    @property
+    def default_product_concentration(self) -> float:
+        """
+        :return: Product concentration (mol/m^3)
+        """
+        return float(self._state[_STATE['default_product_concentration']])
+
+    @property
+    def product_concentration(self) -> float:
+        """
+        :return: Product concentration (mg/mL)
+        """
+        return (self.default_product_concentration / 1000) * 334.17
+
+    @property
+    def dt1(self) -> float:
+        return float(self._state[_STATE['dt1']])
+
+    @property
+    def time_step(self) -> float:
+        """
+        :return: Time step currently used by the solver (s)
+        """
+        return self.dt1
+
+    @property
+    def last_step_count(self) -> int:
+        """
+        :return: Number of time steps taken by the last call to update
+        """
+        return int(self._state[_STATE['last_step_count']])
+
+    @property
+    def total_steps(self) -> int:
+        """
+        :return: Number of time steps taken since the model was created
+        """
+        return int(self._state[_STATE['total_steps']])
+
+    @property
+    def simulated_time(self) -> float:
+        """
+        :return: Reactor time simulated since the model was created (s)
+        """
+        return float(self._state[_STATE['simulated_time']])
+
+    @property
+    def stable_time_step(self) -> float:
+        """
+        :return: Largest time step of the model's scheme, see CFDModel.stable_time_step (s)
+        """
+        return self._call('stable_time_step')
+
+    # endregion
+
+    def _set_time_step(self, dt: float) -> None:
+        self._call('set_time_step', dt)
+
+    def _record_steps(self, num_steps: int) -> None:
+        self._call('record_steps', num_steps)
+
+    def reset_arrays(self) -> None:
+        self._call('reset_arrays')
+
+    def solve_steady_state(self, max_iterations: int = 50) -> tuple:
+        return self._call('solve_steady_state', max_iterations)
+
+    def advance(self, n_steps: int, inlet_A_history: ndarray = None, outlet_history: ndarray = None) -> None:
+        """
+        Advances the model by n_steps time steps, see CFDModel.advance
+        :return: None
+        """
+        if n_steps <= 0:
+            return
+        history_name = None
+        capacity = 0
+        if inlet_A_history is not None or outlet_history is not None:
+            history = self._history_buffer(n_steps)
+            history_name = self._history_memory.name
+            capacity = history.shape[1]
+            if inlet_A_history is not None:
+                history[0, :n_steps] = inlet_A_history[:n_steps]
+        self._call('advance', n_steps, history_name, capacity, inlet_A_history is not None, outlet_history is not None)
+        if outlet_history is not None:
+            outlet_history[:n_steps] = self._history[1, :n_steps]
+
+    def update(self, dt=None) -> None:
+        """
+        Advances the model by dt, or by the wall time since the last call when dt is None, see CFDModel.update
+        :return: None
+        """
+        self._call('update', dt)
@@ -0,0 +1,126 @@
+import numpy as np
+from numpy import ndarray
+from cfd import CFDModel, step_count
+
+
+class ReactorNetwork:
+    """
+    Reactors connected outlet to inlet.  A downstream reactor takes the whole stream of its upstream reactor as its
+    species A feed, with the upstream product as species A, and its own species B feed.
+
+    All reactors are advanced over the same sub-steps.  Because the coupling only runs downstream, each reactor is
+    advanced through the whole tick in one call while recording its outlet after every sub-step, and the downstream
+    reactor then consumes that outlet history as its inlet sub-step by sub-step.
+    """
+
+    def __init__(self):
+        self._reactors = []
+        self._upstream = []
+        self._histories = []
+        self._inlet = np.empty(0)
+        self._last_sample_time = None
+        self._last_step_count = 0
+
+    def add(self, reactor: CFDModel, upstream: CFDModel = None) -> CFDModel:
+        """
+        Adds a reactor to the network
+        :param reactor: Reactor to add
+        :param upstream: Reactor whose outlet feeds species A of this reactor; it must already be in the network
+        :return: The reactor
+        """
+        if upstream is not None and not any(upstream is r for r in self._reactors):
+            raise ValueError('The upstream reactor has to be added to the network first')
+        if self._reactors and reactor.dt1 != self._reactors[0].dt1:
+            raise ValueError(f'All reactors in a network need the same time step ({self._reactors[0].dt1} s)')
+        self._reactors.append(reactor)
+        self._upstream.append(None if upstream is None else self._index(upstream))
+        self._histories.append(np.empty((0,) + np.shape(reactor.default_product_concentration)))
+        return reactor
+
+    def _index(self, reactor: CFDModel) -> int:
+        return next(i for i, r in enumerate(self._reactors) if r is reactor)
+
+    @property
+    def reactors(self) -> list:
+        return list(self._reactors)
+
+    @property
+    def last_step_count(self) -> int:
+        """
+        :return: Number of sub-steps taken by the last call to update
+        """
+        return self._last_step_count
+
+    def outlet_history(self, reactor: CFDModel) -> ndarray:
+        """
+        :param reactor: Reactor in the network
+        :return: Outlet product concentration (mol/m3) of the reactor after each sub-step of the last update
+        """
+        return self._histories[self._index(reactor)][:self._last_step_count].copy()
+
+    def solve_steady_state(self, max_iterations: int = 50) -> None:
+        """
+        Replaces the profiles of every reactor with its steady state at the current flowrates and temperatures.  The
+        reactors are solved in upstream order, each downstream reactor fed the steady state outlet of its upstream one.
+        :param max_iterations: Maximum number of Newton iterations per reactor
+        :return: None
+        """
+        for reactor, upstream in zip(self._reactors, self._upstream):
+            if upstream is not None:
+                feed = self._reactors[upstream]
+                reactor.species_A_flowrate = feed.combined_flowrate
+                reactor.species_A_stock_concentration = feed.default_product_concentration
+            reactor.solve_steady_state(max_iterations)
+
+    def update(self, dt=None) -> None:
+        """
+        Advances every reactor by dt, or by the wall time since the last call when dt is None, like CFDModel.update.
+        The step count follows cfd.step_count; if any reactor uses AdaptiveTimeStep, the network takes the time step
+        the most restrictive reactor allows.
+        :return: None
+        """
+        if not self._reactors:
+            return
+        adaptive = any(reactor.adaptive_time_step for reactor in self._reactors)
+        num_steps, time_step, self._last_sample_time = step_count(
+            dt, self._reactors[0].dt1, self._last_sample_time,
+            (lambda: min(reactor.courant_limit * reactor.stable_time_step for reactor in self._reactors))
+            if adaptive else None)
+        for reactor in self._reactors:
+            if reactor.dt1 != time_step:
+                reactor._set_time_step(time_step)
+
+        self.advance(num_steps)
+        for reactor in self._reactors:
+            reactor._record_steps(num_steps)
+
+    def advance(self, n_steps: int) -> None:
+        """
+        Advances every reactor by n_steps sub-steps
+        :param n_steps: Number of sub-steps
+        :return: None
+        """
+        self._last_step_count = max(n_steps, 0)
+        if n_steps <= 0:
+            return
+
+        for i, (reactor, upstream) in enumerate(zip(self._reactors, self._upstream)):
+            if self._histories[i].shape[0] < n_steps:
+                self._histories[i] = np.empty((n_steps,) + self._histories[i].shape[1:])
+            history = self._histories[i][:n_steps]
+
+            if upstream is None:
+                reactor.advance(n_steps, outlet_history=history)
+                continue
+
+            feed = self._reactors[upstream]
+            upstream_history = self._histories[upstream][:n_steps]
+            reactor.species_A_flowrate = feed.combined_flowrate
+            combined_flowrate = reactor.combined_flowrate
+            fraction = np.divide(reactor.species_A_flowrate, combined_flowrate,
+                                 out=np.zeros(np.shape(combined_flowrate)), where=combined_flowrate != 0)
+            if self._inlet.shape[0] < n_steps or self._inlet.shape[1:] != upstream_history.shape[1:]:
+                self._inlet = np.empty(upstream_history.shape)
+            inlet = np.multiply(upstream_history, fraction, out=self._inlet[:n_steps])
+            reactor.advance(n_steps, inlet_A_history=inlet, outlet_history=history)
+            reactor.species_A_stock_concentration = feed.default_product_concentration
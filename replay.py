@@ -0,0 +1,308 @@
+import argparse
+import csv
+import os
+import time
+from contextlib import nullcontext, redirect_stdout
+import numpy as np
+from numpy import ndarray
+from instruments import MovingAverage
+from instruments.instrument import Instrument
+from instruments.bulk import read_log
+from cfd import CFDModel
+from clock import ReplayClock
+from process_model import ProcessCFDModel
+from run_archive import RunArchive
+from simulation_worker import SimulationWorker
+import main
+
+"""
+Replays a recorded run through the step 3 and 4 control loop of main.py without the rig.  The flow meters and the
+temperature probe are replaced by ReplaySource objects that follow the recording on a ReplayClock, the pumps, valve
+and balance by mocks, and the simulation is stepped on the replay thread so the run is deterministic.  The replay runs
+at a multiple of real time or as fast as possible and reports its throughput.
+
+    python replay.py Run.csv --speed 10
+"""
+
+FLOWRATE_UNITS = 1.667e-8  # m3/s per mL/min, as used by main.control_step
+
+
+class ReplaySource(Instrument):
+    """
+    Instrument whose value follows a recorded series on a replay clock
+    """
+
+    def __init__(self, clock: ReplayClock, times: ndarray, values: ndarray, *args, **kwargs):
+        """
+        :param clock: Clock of the replay
+        :param times: Time of each sample (s since the epoch), ascending
+        :param values: Value of each sample
+        """
+        super().__init__(*args, **kwargs)
+        self._clock = clock
+        self._times = np.asarray(times, dtype=float)
+        self._values = np.asarray(values, dtype=float)
+
+    def close(self):
+        pass
+
+    @property
+    def samples_replayed(self) -> int:
+        """
+        :return: Number of samples at or before the current replay time
+        """
+        return int(np.searchsorted(self._times, self._clock.time(), side='right'))
+
+    @property
+    def value(self):
+        index = self.samples_replayed
+        return float(self._values[index - 1]) if index else None
+
+    @property
+    def staleness(self) -> float:
+        index = self.samples_replayed
+        return self._clock.time() - self._times[index - 1] if index else None
+
+
+class MockPump:
+    """
+    Stand-in for Pump that records the commanded speed
+    """
+
+    def __init__(self):
+        self._percent = 0.0
+        self.commands = 0
+
+    @property
+    def speed_percent(self) -> float:
+        return self._percent
+
+    @speed_percent.setter
+    def speed_percent(self, value: float):
+        self._percent = min(max(float(value), 0.0), 100.0)
+        self.commands += 1
+
+
+class MockValve:
+    """
+    Stand-in for Valve that counts how often the valve switches
+    """
+
+    def __init__(self):
+        self._open = None
+        self.commands = 0
+        self.switches = 0
+
+    @property
+    def open(self) -> bool:
+        return self._open
+
+    @open.setter
+    def open(self, value: bool):
+        if self._open is not None and value != self._open:
+            self.switches += 1
+        self._open = value
+        self.commands += 1
+
+
+class MockBalance:
+    """
+    Stand-in for Balance returning the recorded masses, if the recording has them
+    """
+
+    def __init__(self, waste_mass: ReplaySource = None, collection_mass: ReplaySource = None):
+        self._waste_mass = waste_mass
+        self._collection_mass = collection_mass
+
+    @property
+    def value(self) -> dict:
+        return {'Waste Mass': self._waste_mass.value if self._waste_mass is not None else None,
+                'Collection Mass': self._collection_mass.value if self._collection_mass is not None else None}
+
+
+REPLAYED_COLUMNS = ['Acrylate Flowrate', 'Fluoro Flowrate', 'Cyclo Flowrate', 'Temperature', 'Waste Mass',
+                    'Collection Mass']
+
+
+def load_run_log(path: str) -> dict:
+    """
+    Reads a CSV written by main.py, or the run directory next to it.  The flowrates are converted back to the mL/min
+    the flow meters report: rows logged by log_data hold m3/s, rows logged by _log_data (no product concentrations)
+    hold the flow meter values.
+    :param path: CSV written by main.py, possibly holding several runs, or run directory
+    :return: Time and value arrays for each of the replayed columns
+    """
+    if os.path.isdir(path):
+        return load_run_archive(path)
+    columns = REPLAYED_COLUMNS
+    series = {column: ([], []) for column in columns}
+    with open(path, newline='') as stream:
+        reader = csv.reader(stream)
+        header = None
+        for row in reader:
+            if row and row[0] == 'Timestamp':  # main.py writes the header again at the start of every run
+                header = {name: i for i, name in enumerate(row)}
+                continue
+            if header is None or len(row) < len(header):
+                continue
+            try:
+                timestamp = float(row[header['Timestamp']])
+            except ValueError:
+                continue
+            logged_by_log_data = row[header['Reactor 1 Product Concentration']] not in ('None', '')
+            for column in columns:
+                try:
+                    value = float(row[header[column]])
+                except ValueError:
+                    continue
+                if logged_by_log_data and column.endswith('Flowrate'):
+                    value /= FLOWRATE_UNITS
+                series[column][0].append(timestamp)
+                series[column][1].append(value)
+
+    recording = {}
+    for column, (times, values) in series.items():
+        if times:
+            order = np.argsort(times, kind='stable')
+            recording[column] = (np.asarray(times)[order], np.asarray(values)[order])
+    return recording
+
+
+def load_run_archive(directory: str) -> dict:
+    """
+    Reads a run directory written by main.py, see load_run_log
+    :return: Time and value arrays for each of the replayed columns
+    """
+    archive = RunArchive(directory)
+    times = np.asarray(archive['Timestamp'])
+    logged_by_log_data = ~np.isnan(archive['Reactor 1 Product Concentration'])
+    order = np.argsort(times, kind='stable')
+    recording = {}
+    for column in REPLAYED_COLUMNS:
+        values = np.array(archive[column])
+        if column.endswith('Flowrate'):
+            values[logged_by_log_data] /= FLOWRATE_UNITS
+        present = ~np.isnan(values[order])
+        if present.any():
+            recording[column] = (times[order][present], values[order][present])
+    return recording
+
+
+def load_instrument_log(path: str, instrument_class, start_time: float, sample_period: float, m: float = 1.0,
+                        b: float = 0.0) -> tuple:
+    """
+    Reads a log written by the instrument software itself, e.g. Fluoro.csv, with the bulk parser, to replay it in
+    place of the flowrate or temperature columns of a run log
+    :param start_time: Time of the first sample (s since the epoch)
+    :param sample_period: Time between samples (s)
+    :return: Time and value arrays
+    """
+    values = read_log(path, instrument_class, m, b)
+    return start_time + np.arange(len(values)) * sample_period, values
+
+
+def replay(recording: dict, speed: float = None, tick: float = 0.1, duration: float = None, log_filename: str = None,
+           model=CFDModel, verbose: bool = False) -> dict:
+    """
+    Replays a recording through main.control_step
+    :param recording: Time and value arrays for 'Acrylate Flowrate', 'Fluoro Flowrate', 'Cyclo Flowrate' (mL/min) and
+    'Temperature' (degrees Celsius), optionally 'Waste Mass' and 'Collection Mass'
+    :param speed: Multiple of real time to replay at, None to replay as fast as possible
+    :param tick: Control loop period (s)
+    :param duration: Replay only the first duration seconds of the recording (s)
+    :param log_filename: CSV to log the replayed run to, like main.py does, the binary columns go to the directory
+    of the same name
+    :param model: CFDModel or ProcessCFDModel
+    :param verbose: Show what the control loop prints
+    :return: Throughput and control statistics of the replay
+    """
+    start_time = min(times[0] for times, _ in recording.values())
+    end_time = max(times[-1] for times, _ in recording.values())
+    if duration is not None:
+        end_time = min(end_time, start_time + duration)
+
+    clock = ReplayClock(start_time)
+    sources = {column: ReplaySource(clock, times, values) for column, (times, values) in recording.items()}
+    main.clock = clock
+    main.acrylate_flow = sources['Acrylate Flowrate']
+    main.fluoro_flow = sources['Fluoro Flowrate']
+    main.cyclo_flow = sources['Cyclo Flowrate']
+    main.temperature_probe = sources['Temperature']
+    main.valve = MockValve()
+    main.acrylate_pump = MockPump()
+    main.fluoro_pump = MockPump()
+    main.cyclo_pump = MockPump()
+    main.balance_data = MockBalance(sources.get('Waste Mass'), sources.get('Collection Mass'))
+    main.acrylate_ma = MovingAverage(10)
+    main.fluoro_ma = MovingAverage(10)
+    main.cyclo_ma = MovingAverage(10)
+    main.create_reactors(model)
+    simulation = SimulationWorker(main.reactor_network, clock=clock, start=False,
+                                  percentiles=(main.DIVERT_PERCENTILE, 50.0, 100.0 - main.DIVERT_PERCENTILE))
+    main.run_log = main.open_run_log(log_filename) if log_filename is not None else None
+
+    ticks = 0
+    collected = 0
+    update_time = 0.0
+    with open(os.devnull, 'w') as devnull, nullcontext() if verbose else redirect_stdout(devnull):
+        main.initialise_reactors()  # as step_3_and_4 does before starting the simulation
+        wall_start = time.perf_counter()
+        try:
+            while clock.time() < end_time:
+                main.control_step(simulation)
+                collected += main.valve.open == main.DIVERT_TO_COLLECTION
+                update_time += simulation.step(tick).update_duration
+                clock.advance(tick)
+                ticks += 1
+                if speed:
+                    time.sleep(max(wall_start + (clock.time() - start_time) / speed - time.perf_counter(), 0.0))
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            steps = sum(reactor.total_steps for reactor in main.reactor_network.reactors)
+            main.close_run_log(log_filename)
+            for reactor in main.reactor_network.reactors:
+                if hasattr(reactor, 'close'):
+                    reactor.close()
+
+    replayed_time = clock.time() - start_time
+    samples = sum(source.samples_replayed for source in sources.values())
+    return {
+        'replayed_time': replayed_time,
+        'wall_time': wall_time,
+        'speed': replayed_time / wall_time,
+        'ticks': ticks,
+        'samples': samples,
+        'samples_per_second': samples / wall_time,
+        'sim_seconds_per_wall_second': simulation.snapshot.simulated_time / wall_time if ticks else 0.0,
+        'cfd_steps_per_second': steps / update_time if update_time else 0.0,
+        'cfd_time_fraction': update_time / wall_time,
+        'valve_switches': main.valve.switches,
+        'collected_fraction': collected / ticks if ticks else 0.0,
+        'final_concentrations': simulation.snapshot.product_concentrations if ticks else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a run recorded by main.py through the control loop')
+    parser.add_argument('recording', help='CSV or run directory written by main.py')
+    parser.add_argument('--speed', type=float, default=0.0, help='multiple of real time, 0 for as fast as possible')
+    parser.add_argument('--tick', type=float, default=0.1, help='control loop period (s)')
+    parser.add_argument('--duration', type=float, default=None, help='only replay this many seconds')
+    parser.add_argument('--log', default=None, help='CSV to log the replayed run to')
+    parser.add_argument('--processes', action='store_true', help='run the reactor models in worker processes')
+    parser.add_argument('--verbose', action='store_true', help='show what the control loop prints')
+    parser.add_argument('--ensemble', type=int, default=0,
+                        help='divert on the percentile band of an ensemble of this many members, see main.py')
+    args = parser.parse_args()
+
+    main.DIVERT_ENSEMBLE_MEMBERS = args.ensemble
+
+    report = replay(load_run_log(args.recording), speed=args.speed or None, tick=args.tick, duration=args.duration,
+                    log_filename=args.log, model=ProcessCFDModel if args.processes else CFDModel,
+                    verbose=args.verbose)
+    print(f'Replayed {report["replayed_time"]:0.1f} s in {report["wall_time"]:0.2f} s ({report["speed"]:0.1f}x)')
+    print(f'{report["ticks"]} control ticks, {report["samples"]} samples ({report["samples_per_second"]:0.0f} samples/s)')
+    print(f'CFD: {report["sim_seconds_per_wall_second"]:0.1f} sim-seconds per wall-second, '
+          f'{report["cfd_steps_per_second"]:0.0f} steps/s, {report["cfd_time_fraction"]:0.0%} of the wall time')
+    print(f'Valve: {report["valve_switches"]} switches, collecting {report["collected_fraction"]:0.0%} of the time')
+    print(f'Final product concentrations: {report["final_concentrations"]} mg/mL')
@@ -0,0 +1,188 @@
+import argparse
+import csv
+import warnings
+from datetime import datetime
+import numpy as np
+from run_logger import RunLogger, RUN_LOG_SCHEMA, read_columns, MISSING_INTEGER
+
+"""
+Post-run queries on the run directories RunLogger writes.  RunArchive memory-maps the fixed-width columns and keeps a
+sparse index of every TIME_INDEX_STRIDE-th timestamp, so a time window is found with two small binary searches and
+returned as views of the files: nothing is parsed, and only the pages of the window are read.  convert_csv turns a CSV
+written by main.py into a run directory.
+
+    python run_archive.py convert Run1.csv Run1
+    python run_archive.py info Run1
+"""
+
+TIME_INDEX_STRIDE = 1024  # rows between the timestamps of the sparse time index
+
+
+def _seconds(moment) -> float:
+    """
+    :param moment: datetime or seconds since the epoch
+    """
+    return moment.timestamp() if isinstance(moment, datetime) else float(moment)
+
+
+class RunArchive:
+    """
+    Read-only view of a run directory.  The timestamps are expected to ascend, as main.py logs them.
+    """
+
+    def __init__(self, directory: str, time_column: str = 'Timestamp'):
+        """
+        :param directory: Run directory written by RunLogger or convert_csv
+        :param time_column: Column the time index is built on
+        """
+        self._directory = directory
+        self._time_column = time_column
+        self._columns = {}
+        self._time_index = np.empty(0)
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Maps the rows logged since the archive was opened, for a run that is still being logged
+        """
+        self._columns = read_columns(self._directory)
+        self._time_index = np.array(self._columns[self._time_column][::TIME_INDEX_STRIDE])
+
+    def __len__(self) -> int:
+        return len(self._columns[self._time_column])
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self._columns[column]
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def columns(self) -> list:
+        return list(self._columns)
+
+    @property
+    def start_time(self) -> float:
+        return float(self._columns[self._time_column][0]) if len(self) else None
+
+    @property
+    def end_time(self) -> float:
+        return float(self._columns[self._time_column][-1]) if len(self) else None
+
+    def _search(self, moment: float, side: str) -> int:
+        block = max(int(np.searchsorted(self._time_index, moment, side)) - 1, 0)
+        start = block * TIME_INDEX_STRIDE
+        times = self._columns[self._time_column][start:start + 2 * TIME_INDEX_STRIDE]
+        return start + int(np.searchsorted(times, moment, side))
+
+    def rows(self, start=None, end=None) -> slice:
+        """
+        :param start: Start of the window, datetime or seconds since the epoch, None for the start of the run
+        :param end: End of the window (exclusive), None for the end of the run
+        :return: Rows of the window
+        """
+        first = 0 if start is None else self._search(_seconds(start), 'left')
+        last = len(self) if end is None else self._search(_seconds(end), 'left')
+        return slice(first, max(first, last))
+
+    def window(self, start=None, end=None, columns: list = None) -> dict:
+        """
+        :param columns: Columns to return, None for all
+        :return: Array of each column in the window, keyed by name; views of the files, copy them to keep them
+        """
+        rows = self.rows(start, end)
+        return {name: self._columns[name][rows] for name in (columns or self._columns)}
+
+    def downsample(self, points: int, start=None, end=None, columns: list = None, method: str = 'mean') -> dict:
+        """
+        Reduces a window to at most points rows
+        :param method: 'mean' averages the float columns over each of the points bins, ignoring missing values, and
+        takes the first value of the other columns; 'stride' takes every n-th row
+        :return: Array of each column, keyed by name
+        """
+        rows = self.rows(start, end)
+        count = rows.stop - rows.start
+        step = max(-(-count // points) if points else count, 1)
+        if method == 'stride' or step == 1:
+            return {name: np.array(values[::step]) for name, values in self.window(start, end, columns).items()}
+        if method != 'mean':
+            raise ValueError(f'Unknown downsampling method {method}')
+
+        bins = count // step
+        downsampled = {}
+        for name, values in self.window(start, end, columns).items():
+            if values.dtype.kind != 'f':
+                downsampled[name] = np.array(values[::step])
+                continue
+            full = np.asarray(values[:bins * step]).reshape(bins, step)
+            tail = np.asarray(values[bins * step:])
+            with warnings.catch_warnings():  # bins that only hold missing values average to NaN
+                warnings.simplefilter('ignore', RuntimeWarning)
+                means = np.nanmean(full, axis=1)
+                if len(tail):
+                    means = np.append(means, np.nanmean(tail))
+            downsampled[name] = means
+        return downsampled
+
+
+def _parse(value: str):
+    if value in ('None', ''):
+        return None
+    if value in ('True', 'False'):
+        return value == 'True'
+    return float(value)
+
+
+def convert_csv(filename: str, directory: str, schema=RUN_LOG_SCHEMA) -> int:
+    """
+    Converts a CSV written by main.py, possibly holding several runs, to a run directory.  Columns the CSV lacks are
+    logged as missing; Human Timestamp is dropped, the archive derives it from Timestamp.
+    :return: Number of rows converted
+    """
+    names = [name for name, _ in schema]
+    integer = [np.dtype(dtype).kind != 'f' for _, dtype in schema]
+    logger = RunLogger(directory, schema, batch_rows=65536, flush_interval=float('inf'))
+    rows = 0
+    try:
+        with open(filename, newline='') as stream:
+            positions = None
+            for row in csv.reader(stream):
+                if row and row[0] == 'Timestamp':  # main.py writes the header again at the start of every run
+                    header = {name: i for i, name in enumerate(row)}
+                    positions = [header.get(name) for name in names]
+                    continue
+                if positions is None or len(row) < len(header):
+                    continue
+                try:
+                    values = [None if i is None else _parse(row[i]) for i in positions]
+                except ValueError:
+                    continue
+                for i, value in enumerate(values):
+                    if integer[i] and value is not None:
+                        values[i] = MISSING_INTEGER if value != value else int(value)
+                logger.log(*values)
+                rows += 1
+    finally:
+        logger.close()
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run archive tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help='convert a CSV written by main.py to a run directory')
+    convert.add_argument('csv', help='CSV written by main.py')
+    convert.add_argument('directory', help='run directory to write')
+    info = commands.add_parser('info', help='summarise a run directory')
+    info.add_argument('directory', help='run directory')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        print(f'Converted {convert_csv(args.csv, args.directory)} rows to {args.directory}')
+    elif args.command == 'info':
+        archive = RunArchive(args.directory)
+        print(f'{len(archive)} rows')
+        if len(archive):
+            print(f'{datetime.fromtimestamp(archive.start_time)} to {datetime.fromtimestamp(archive.end_time)}')
+        print(f'Columns: {", ".join(archive.columns)}')
@@ -0,0 +1,358 @@
+import argparse
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from threading import Thread
+import numpy as np
+
+"""
+Run log written off the control thread.  RunLogger.log stores a row in a preallocated batch and returns; full batches
+are handed to a writer thread that converts them to typed columns, appends each column to its own binary file in the
+run directory and fsyncs them periodically.  schema.json in the directory names the columns, their dtypes and files, so the
+columns can be memory-mapped by any reader.  export_csv writes a run directory in the CSV format of main.py, and
+export_pending the rows not exported yet, which it records in exported.json.
+
+main.py exports each run when it ends.  If it crashed instead, the next run logged to the same directory exports the
+rows left behind first, or they can be exported by hand:
+
+    python run_logger.py export Run1 Run1.csv --pending
+"""
+
+RUN_LOG_SCHEMA = (  # the columns of main.py's run log, in the order of its CSV header
+    ('Timestamp', 'f8'),
+    ('Acrylate Pump', 'f8'),
+    ('Fluoro Pump', 'f8'),
+    ('Cyclo Pump', 'f8'),
+    ('Acrylate Flowrate', 'f8'),
+    ('Fluoro Flowrate', 'f8'),
+    ('Cyclo Flowrate', 'f8'),
+    ('Temperature', 'f8'),
+    ('Valve Set to Collection', 'i1'),
+    ('Waste Mass', 'f8'),
+    ('Collection Mass', 'f8'),
+    ('Reactor 1 Product Concentration', 'f8'),
+    ('Reactor 2 Product Concentration', 'f8'),
+    ('Pressure', 'f8'),
+)
+
+SCHEMA_FILE = 'schema.json'
+EXPORT_FILE = 'exported.json'
+MISSING_INTEGER = -1  # stored for None in integer and boolean columns, None is NaN in float columns
+
+
+def column_file(name: str) -> str:
+    """
+    :return: File name of a column, e.g. 'reactor_1_product_concentration.bin'
+    """
+    return re.sub(r'[^0-9a-z]+', '_', name.lower()).strip('_') + '.bin'
+
+
+def complete_rows(directory: str) -> int:
+    """
+    :return: Number of rows every column of a run directory holds, the last row may be incomplete after a crash
+    """
+    return min((os.path.getsize(os.path.join(directory, file)) // dtype.itemsize
+                if os.path.exists(os.path.join(directory, file)) else 0 for _, dtype, file in read_schema(directory)),
+               default=0)
+
+
+def read_schema(directory: str) -> list:
+    """
+    :return: Name, dtype and file of each column of a run directory
+    """
+    with open(os.path.join(directory, SCHEMA_FILE)) as stream:
+        schema = json.load(stream)
+    return [(column['name'], np.dtype(column['dtype']), column['file']) for column in schema['columns']]
+
+
+class RunLogger:
+    """
+    Logs rows of values to a run directory from a background thread.  log costs a couple of microseconds: the row is
+    stored in a slot of the current batch, and the batch is queued for the writer when it is full or flush_interval has
+    passed since its first row.  Converting the rows to typed columns is left to the writer, which never blocks the
+    logging thread; if it falls behind, more batches are allocated.
+    """
+
+    def __init__(self, directory: str, schema=RUN_LOG_SCHEMA, batch_rows: int = 1024, flush_interval: float = 1.0,
+                 fsync_interval: float = 10.0):
+        """
+        :param directory: Run directory, created if needed; logging to an existing run appends to it, after cutting
+        every column to the rows all of them hold
+        :param schema: Name and NumPy dtype of each column, e.g. (('Timestamp', 'f8'), ('Valve', 'i1'))
+        :param batch_rows: Rows per batch
+        :param flush_interval: Longest time a row waits in a batch (s)
+        :param fsync_interval: Longest time written data waits to be synced to disk (s)
+        """
+        self._directory = directory
+        self._dtype = np.dtype([(name, dtype) for name, dtype in schema])
+        self._names = self._dtype.names
+        self._batch_rows = batch_rows
+        self._flush_interval = flush_interval
+        self._fsync_interval = fsync_interval
+        self._write_schema()
+
+        self._lock = threading.Lock()
+        self._free = queue.SimpleQueue()
+        self._batch = [None] * batch_rows
+        self._row = 0
+        self._batch_time = None
+        self._rows_logged = 0
+        self._rows_written = 0
+        self._batches_allocated = 1
+        self._conversion_errors = 0
+
+        self._start_row = complete_rows(directory)
+        self._files = []
+        for name in self._names:
+            file = open(os.path.join(directory, column_file(name)), 'ab')
+            file.truncate(self._start_row * self._dtype[name].itemsize)  # drop a row a crash left half written
+            self._files.append(file)
+        self._queue = queue.SimpleQueue()
+        self._close_requested = False
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write_schema(self) -> None:
+        os.makedirs(self._directory, exist_ok=True)
+        path = os.path.join(self._directory, SCHEMA_FILE)
+        columns = [{'name': name, 'dtype': self._dtype[name].str, 'file': column_file(name)} for name in self._names]
+        if os.path.exists(path):
+            existing = [(name, dtype.str, file) for name, dtype, file in read_schema(self._directory)]
+            if existing != [(c['name'], c['dtype'], c['file']) for c in columns]:
+                raise ValueError(f'{self._directory} holds a run log with different columns')
+            return
+        temporary_file = path + '.tmp'
+        with open(temporary_file, 'w') as stream:
+            json.dump({'format': 1, 'created': time.time(), 'columns': columns}, stream, indent=2)
+        os.replace(temporary_file, path)
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def start_row(self) -> int:
+        """
+        :return: Rows the run directory held before this logger appended to it
+        """
+        return self._start_row
+
+    @property
+    def rows_logged(self) -> int:
+        return self._rows_logged
+
+    @property
+    def rows_written(self) -> int:
+        """
+        :return: Rows written to the column files, not necessarily synced to disk yet
+        """
+        return self._rows_written
+
+    @property
+    def conversion_errors(self) -> int:
+        """
+        :return: Values logged as missing because they could not be converted to the dtype of their column
+        """
+        return self._conversion_errors
+
+    def log(self, *values) -> None:
+        """
+        Logs one row
+        :param values: Value of each column in schema order, None for missing values; values that cannot be converted
+        to the dtype of their column are logged as missing too
+        """
+        if len(values) != len(self._names):
+            raise ValueError(f'{len(values)} values logged, the run log has {len(self._names)} columns')
+        with self._lock:
+            self._batch[self._row] = values
+            self._row += 1
+            self._rows_logged += 1
+            now = time.monotonic()
+            if self._batch_time is None:
+                self._batch_time = now
+            if self._row == self._batch_rows or now - self._batch_time >= self._flush_interval:
+                self._hand_over()
+
+    def flush(self) -> None:
+        """
+        Hands the rows logged so far to the writer
+        """
+        with self._lock:
+            if self._row:
+                self._hand_over()
+
+    def _hand_over(self) -> None:
+        self._queue.put((self._batch, self._row))
+        try:
+            self._batch = self._free.get_nowait()
+        except queue.Empty:
+            self._batch = [None] * self._batch_rows
+            self._batches_allocated += 1
+        self._row = 0
+        self._batch_time = None
+
+    def close(self, timeout: float = 10.0) -> None:
+        if self._close_requested:
+            return
+        self.flush()
+        self._close_requested = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _column(self, values: tuple, name: str) -> np.ndarray:
+        """
+        :return: values as the dtype of the column, values that cannot be converted are logged as missing
+        """
+        dtype = self._dtype[name]
+        missing = np.nan if dtype.kind == 'f' else MISSING_INTEGER
+        try:
+            if dtype.kind == 'f':
+                return np.array(values, dtype=dtype)  # None becomes NaN
+            return np.array([MISSING_INTEGER if value is None else value for value in values], dtype=dtype)
+        except (TypeError, ValueError, OverflowError):
+            pass
+        column = np.full(len(values), missing, dtype=dtype)
+        for i, value in enumerate(values):
+            if value is None:
+                continue
+            try:
+                column[i] = np.array(value, dtype=dtype)
+            except (TypeError, ValueError, OverflowError):
+                self._conversion_errors += 1
+        return column
+
+    def _write(self, batch: list, rows: int) -> None:
+        # every column is converted before any is written, so the column files always hold the same rows
+        columns = [self._column(values, name) for name, values in zip(self._names, zip(*batch[:rows]))]
+        for column, file in zip(columns, self._files):
+            file.write(column.tobytes())
+        self._rows_written += rows
+
+    def _sync(self) -> None:
+        for file in self._files:
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _run(self):
+        last_sync = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self._fsync_interval)
+            except queue.Empty:
+                item = False
+            try:
+                if item:
+                    batch, rows = item
+                    self._write(batch, rows)
+                    self._free.put(batch)
+                if item is None or time.monotonic() - last_sync >= self._fsync_interval:
+                    self._sync()
+                    last_sync = time.monotonic()
+            except Exception as ex:
+                print(f'{type(ex)} occurred while writing the run log to {self._directory}: {ex}')
+            if item is None:
+                break
+        for file in self._files:
+            file.close()
+
+
+def read_columns(directory: str) -> dict:
+    """
+    Memory-maps the columns of a run directory, cut to the rows every column holds (the last row may be incomplete
+    after a crash)
+    :return: Array of each column, keyed by name
+    """
+    schema = read_schema(directory)
+    rows = complete_rows(directory)
+    return {name: np.memmap(os.path.join(directory, file), dtype=dtype, mode='r', shape=(rows,)) if rows else
+            np.empty(0, dtype) for name, dtype, file in schema}
+
+
+def _format(values: np.ndarray, boolean: bool) -> list:
+    """
+    Formats values like str() of the Python values main.py used to log
+    """
+    if values.dtype.kind == 'f':
+        return ['None' if value != value else repr(value) for value in values.tolist()]
+    if boolean:
+        return ['None' if value == MISSING_INTEGER else str(bool(value)) for value in values.tolist()]
+    return ['None' if value == MISSING_INTEGER else str(value) for value in values.tolist()]
+
+
+def export_csv(directory: str, filename: str, start: int = 0, stop: int = None, chunk_rows: int = 100000) -> int:
+    """
+    Appends rows of a run directory to a CSV file in the format main.py used to write, header first
+    :param start: First row to export, e.g. RunLogger.start_row to only export the rows of one run
+    :param stop: Row to stop before, None for the end of the directory
+    :return: Number of rows exported
+    """
+    columns = read_columns(directory)
+    names = list(columns)
+    rows = len(columns[names[0]]) if names else 0
+    stop = rows if stop is None else min(stop, rows)
+    header = names[:1] + ['Human Timestamp'] + names[1:] if names[0] == 'Timestamp' else names
+    with open(filename, 'a+') as stream:
+        stream.write(','.join(header) + '\n')
+        for first in range(start, stop, chunk_rows):
+            last = min(first + chunk_rows, stop)
+            cells = [_format(np.asarray(columns[name][first:last]), name == 'Valve Set to Collection')
+                     for name in names]
+            if names[0] == 'Timestamp':
+                human = [str(datetime.fromtimestamp(t)) for t in columns['Timestamp'][first:last].tolist()]
+                cells.insert(1, human)
+            stream.writelines(','.join(row) + '\n' for row in zip(*cells))
+    return max(stop - start, 0)
+
+
+def exported_rows(directory: str) -> int:
+    """
+    :return: Rows of a run directory export_pending has exported
+    """
+    path = os.path.join(directory, EXPORT_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path) as stream:
+        return json.load(stream)['rows']
+
+
+def export_pending(directory: str, filename: str) -> int:
+    """
+    Appends the rows of a run directory that have not been exported yet to a CSV file, see export_csv, and records
+    them as exported
+    :return: Number of rows exported
+    """
+    start = exported_rows(directory)
+    stop = complete_rows(directory)
+    if stop <= start:
+        return 0
+    rows = export_csv(directory, filename, start, stop)
+    path = os.path.join(directory, EXPORT_FILE)
+    temporary_file = path + '.tmp'
+    with open(temporary_file, 'w') as stream:
+        json.dump({'rows': stop, 'file': filename, 'exported': time.time()}, stream, indent=2)
+    os.replace(temporary_file, path)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run log tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='append a run directory to a CSV file in the format of main.py')
+    export.add_argument('directory', help='run directory written by RunLogger')
+    export.add_argument('csv', help='CSV file to append to')
+    export.add_argument('--start', type=int, default=0, help='first row to export')
+    export.add_argument('--stop', type=int, default=None, help='row to stop before, the end by default')
+    export.add_argument('--pending', action='store_true',
+                        help='export the rows not exported yet, e.g. those of a run that crashed, and record them')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        if args.pending:
+            print(f'Exported {export_pending(args.directory, args.csv)} rows to {args.csv}')
+        else:
+            print(f'Exported {export_csv(args.directory, args.csv, args.start, args.stop)} rows to {args.csv}')
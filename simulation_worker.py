@@ -0,0 +1,137 @@
+import time
+from threading import Thread
+from typing import NamedTuple
+import numpy as np
+from clock import Clock
+from instruments.metrics import histogram
+from ensemble import EnsembleCFDModel
+from reactor_network import ReactorNetwork
+
+
+class SimulationSnapshot(NamedTuple):
+    """
+    Immutable view of the simulation published after every update
+    """
+    wall_time: float  # clock time when the snapshot was taken
+    simulated_time: float  # reactor time simulated since the worker started (s)
+    lag: float  # clock time elapsed since the worker started minus simulated_time (s)
+    update_duration: float  # wall time the last update took (s)
+    product_concentrations: tuple  # outlet product concentration of each reactor, the median of an ensemble (mg/mL)
+    default_product_concentrations: tuple  # outlet product concentration of each reactor, as above (mol/m3)
+    product_concentration_bands: tuple  # percentiles of the outlet product concentration of each ensemble (mg/mL),
+    # None for single models
+
+
+class SimulationWorker:
+    """
+    Runs a ReactorNetwork on its own thread so the control loop never waits for the solver.  The control loop hands
+    over the latest sensor inputs with set_inputs and reads the latest results from snapshot, both without blocking.
+
+    Each update simulates the time since the previous one, capped at max_catch_up, so a solver that falls behind
+    shows up as a growing lag instead of ever longer updates.  With start=False no thread is started and the owner
+    advances the simulation itself with step, e.g. when replaying a recorded run.
+    """
+
+    def __init__(self, network: ReactorNetwork, period: float = 0.1, max_catch_up: float = 1.0, clock: Clock = None,
+                 start: bool = True, percentiles=(5.0, 50.0, 95.0)):
+        """
+        :param network: Reactors to simulate
+        :param period: Target time between updates (s)
+        :param max_catch_up: Most reactor time simulated in one update (s)
+        :param clock: Clock the simulation keeps up with, wall time by default
+        :param start: Start the worker thread
+        :param percentiles: Percentiles (0-100) of the ensemble predictions published in product_concentration_bands
+        """
+        self._network = network
+        self._period = period
+        self._max_catch_up = max_catch_up
+        self._percentiles = tuple(percentiles)
+        self._clock = clock if clock is not None else Clock()
+        self._inputs = None
+        self._applied = None
+        self._snapshot = None
+        self._start_time = self._clock.time()
+        self._simulated_time = 0.0
+        self._update_time = histogram('cfd_update_seconds', 'CFDModel.update of every reactor in one simulation step')
+        self._close_requested = False
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        if start:
+            self._thread.start()
+
+    def __del__(self):
+        self.close()
+
+    def close(self, timeout: float = 10.0):
+        self._close_requested = True
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def set_inputs(self, inputs: dict) -> None:
+        """
+        Replaces the inputs applied before the next update.  Only the latest inputs are kept.
+        :param inputs: Property values to set on each reactor, e.g. {reactor1: {'species_A_flowrate': 4e-8}}
+        :return: None
+        """
+        self._inputs = {reactor: dict(values) for reactor, values in inputs.items()}
+
+    @property
+    def snapshot(self) -> SimulationSnapshot:
+        """
+        :return: Latest published snapshot, None until the first update has finished
+        """
+        return self._snapshot
+
+    @property
+    def lag(self) -> float:
+        """
+        :return: How far the simulation is behind wall time (s)
+        """
+        snapshot = self._snapshot
+        return snapshot.lag if snapshot is not None else 0.0
+
+    def step(self, dt: float) -> SimulationSnapshot:
+        """
+        Applies the latest inputs, advances the network by dt and publishes a new snapshot
+        :param dt: Reactor time to simulate (s)
+        :return: The new snapshot
+        """
+        inputs = self._inputs
+        if inputs is not self._applied:
+            for reactor, values in inputs.items():
+                for name, value in values.items():
+                    setattr(reactor, name, value)
+            self._applied = inputs
+
+        started = time.perf_counter()
+        self._network.update(dt=dt)
+        self._simulated_time += dt
+        update_duration = time.perf_counter() - started
+        self._update_time.observe(update_duration)
+
+        now = self._clock.time()
+        reactors = self._network.reactors
+        self._snapshot = SimulationSnapshot(
+            wall_time=now,
+            simulated_time=self._simulated_time,
+            lag=(now - self._start_time) - self._simulated_time,
+            update_duration=update_duration,
+            product_concentrations=tuple(float(np.median(r.product_concentration)) for r in reactors),
+            default_product_concentrations=tuple(float(np.median(r.default_product_concentration)) for r in reactors),
+            product_concentration_bands=tuple(tuple(r.product_concentration_percentiles(self._percentiles).tolist())
+                                              if isinstance(r, EnsembleCFDModel) else None for r in reactors))
+        return self._snapshot
+
+    def _run(self):
+        self._start_time = self._clock.time()
+        last_time = self._start_time
+        while not self._close_requested:
+            try:
+                now = self._clock.time()
+                dt = min(now - last_time, self._max_catch_up)
+                last_time = now
+                snapshot = self.step(dt)
+                self._clock.sleep(max(self._period - snapshot.update_duration, 0.0))
+            except Exception as ex:
+                print(f'{type(ex)} occurred while updating the simulation: {ex}')
+                self._clock.sleep(self._period)
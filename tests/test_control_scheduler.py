@@ -0,0 +1,54 @@
+import unittest
+from clock import ReplayClock
+from control_scheduler import ControlScheduler, SKIP, COALESCE
+
+"""
+Tests of the control loop scheduler on a ReplayClock.  Run from the repository root:
+
+    python -m unittest discover tests
+"""
+
+
+class ControlSchedulerTest(unittest.TestCase):
+    def run_overrunning_task(self, overrun: str):
+        """
+        Runs a task with a period of 1 s for 5 s, the first run taking 2.5 s
+        :return: The task and the clock times it started at
+        """
+        clock = ReplayClock(100.0)
+        started = []
+
+        def task():
+            started.append(clock.monotonic() - 100.0)
+            if len(started) == 1:
+                clock.advance(2.5)
+
+        scheduler = ControlScheduler(clock)
+        scheduled_task = scheduler.add('task', 1.0, task, overrun=overrun)
+        scheduler.run(duration=5.0)
+        return scheduled_task, started
+
+    def test_skip_drops_the_missed_ticks(self):
+        task, started = self.run_overrunning_task(SKIP)
+        self.assertEqual(started, [0.0, 3.0, 4.0])  # the ticks at 1 and 2 s passed while the first run was busy
+        self.assertEqual((task.runs, task.overruns, task.skipped_ticks), (3, 1, 2))
+        self.assertEqual(task.max_lateness, 0.0)
+
+    def test_coalesce_runs_once_for_the_missed_ticks(self):
+        task, started = self.run_overrunning_task(COALESCE)
+        self.assertEqual(started, [0.0, 2.5, 3.0, 4.0])  # once straight away for 1 and 2 s, then back on the grid
+        self.assertEqual((task.runs, task.overruns, task.skipped_ticks), (4, 1, 1))
+        self.assertEqual(task.max_lateness, 0.5)
+
+    def test_tasks_due_together_run_in_the_order_added(self):
+        clock = ReplayClock(0.0)
+        started = []
+        scheduler = ControlScheduler(clock)
+        scheduler.add('slow', 1.0, lambda: started.append(('slow', clock.monotonic())))
+        scheduler.add('fast', 0.5, lambda: started.append(('fast', clock.monotonic())))
+        scheduler.run(duration=1.5)
+        self.assertEqual(started, [('slow', 0.0), ('fast', 0.0), ('fast', 0.5), ('slow', 1.0), ('fast', 1.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from run_logger import RunLogger, read_columns, complete_rows, export_csv, export_pending, exported_rows, \
+    MISSING_INTEGER
+
+"""
+Tests of the run log.  Run from the repository root:
+
+    python -m unittest discover tests
+"""
+
+SCHEMA = (('a', 'f8'), ('b', 'f8'), ('c', 'i1'))
+
+
+class RunLoggerTest(unittest.TestCase):
+    def setUp(self):
+        self._temporary_directory = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self._temporary_directory.name, 'run')
+
+    def tearDown(self):
+        self._temporary_directory.cleanup()
+
+    def test_round_trip(self):
+        logger = RunLogger(self.directory, SCHEMA, batch_rows=2)  # several batches and a partial one
+        rows = [(i / 4, None if i == 3 else 1.5 * i, i % 2) for i in range(7)]
+        for row in rows:
+            logger.log(*row)
+        logger.close()
+        self.assertEqual((logger.rows_logged, logger.rows_written), (7, 7))
+
+        columns = read_columns(self.directory)
+        self.assertEqual(list(columns), ['a', 'b', 'c'])
+        np.testing.assert_array_equal(columns['a'], [row[0] for row in rows])
+        np.testing.assert_array_equal(columns['b'], [np.nan if row[1] is None else row[1] for row in rows])
+        np.testing.assert_array_equal(columns['c'], [row[2] for row in rows])
+        self.assertEqual(columns['c'].dtype, np.int8)
+
+        filename = self.directory + '.csv'
+        self.assertEqual(export_csv(self.directory, filename, 2, 4), 2)
+        with open(filename) as stream:
+            self.assertEqual(stream.read().splitlines(), ['a,b,c', '0.5,3.0,0', '0.75,None,1'])
+
+    def test_resume_after_a_crash(self):
+        logger = RunLogger(self.directory, SCHEMA)
+        for i in range(3):
+            logger.log(float(i), float(i), i)
+        logger.close()
+        with open(os.path.join(self.directory, 'a.bin'), 'ab') as stream:
+            stream.write(np.float64(3.0).tobytes()[:4])  # half a value, as a crash mid-write leaves behind
+        self.assertEqual(complete_rows(self.directory), 3)
+
+        logger = RunLogger(self.directory, SCHEMA)
+        self.assertEqual(logger.start_row, 3)
+        logger.log(4.0, 4.0, 4)
+        logger.close()
+        columns = read_columns(self.directory)
+        np.testing.assert_array_equal(columns['a'], [0.0, 1.0, 2.0, 4.0])
+        np.testing.assert_array_equal(columns['c'], [0, 1, 2, 4])
+
+    def test_resume_with_other_columns_is_refused(self):
+        RunLogger(self.directory, SCHEMA).close()
+        with self.assertRaises(ValueError):
+            RunLogger(self.directory, (('a', 'f8'), ('b', 'f4')))
+
+    def test_unconvertible_values_are_logged_as_missing(self):
+        logger = RunLogger(self.directory, SCHEMA, batch_rows=4)
+        logger.log(1.0, 10.0, 1)
+        logger.log(2.0, 'not a number', 0)
+        logger.log(3.0, 30.0, 'not a number')
+        logger.log(4.0, 40.0, 1000)  # out of range for i1
+        logger.log(5.0, 50.0, None)
+        logger.close()
+
+        self.assertEqual(complete_rows(self.directory), 5)
+        sizes = {os.path.getsize(os.path.join(self.directory, file)) // itemsize
+                 for file, itemsize in (('a.bin', 8), ('b.bin', 8), ('c.bin', 1))}
+        self.assertEqual(sizes, {5})
+        columns = read_columns(self.directory)
+        np.testing.assert_array_equal(columns['a'], [1.0, 2.0, 3.0, 4.0, 5.0])
+        np.testing.assert_array_equal(columns['b'], [10.0, np.nan, 30.0, 40.0, 50.0])
+        np.testing.assert_array_equal(columns['c'], [1, 0, MISSING_INTEGER, MISSING_INTEGER, MISSING_INTEGER])
+        self.assertEqual(logger.conversion_errors, 3)
+
+    def test_row_of_the_wrong_length_is_rejected(self):
+        logger = RunLogger(self.directory, SCHEMA)
+        try:
+            with self.assertRaises(ValueError):
+                logger.log(1.0, 2.0)
+        finally:
+            logger.close()
+        self.assertEqual(complete_rows(self.directory), 0)
+
+    def test_rows_of_an_unfinished_run_are_exported_once(self):
+        filename = self.directory + '.csv'
+        logger = RunLogger(self.directory, SCHEMA)
+        logger.log(1.0, 10.0, 1)
+        logger.close()  # the run ends before exporting, as after a crash
+        self.assertEqual(exported_rows(self.directory), 0)
+
+        self.assertEqual(export_pending(self.directory, filename), 1)  # as main.open_run_log does for the next run
+        logger = RunLogger(self.directory, SCHEMA)
+        logger.log(2.0, 20.0, 0)
+        logger.close()
+        self.assertEqual(export_pending(self.directory, filename), 1)
+        self.assertEqual(export_pending(self.directory, filename), 0)
+        self.assertEqual(exported_rows(self.directory), 2)
+
+        with open(filename) as stream:
+            lines = stream.read().splitlines()
+        self.assertEqual(lines, ['a,b,c', '1.0,10.0,1', 'a,b,c', '2.0,20.0,0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from cfd import CFDModel
+from clock import ReplayClock
+from reactor_network import ReactorNetwork
+from simulation_worker import SimulationWorker
+
+"""
+Tests of the simulation worker on a ReplayClock.  Run from the repository root with the instruments package on the
+path:
+
+    PYTHONPATH=instruments-20230422T194548Z-001 python -m unittest discover tests
+"""
+
+
+class StallingClock(ReplayClock):
+    """
+    ReplayClock whose sleeps take stall seconds longer than asked, as when the machine is suspended or the solver
+    stalls, and that closes the worker after a number of sleeps
+    """
+
+    def __init__(self, start_time: float, stall: float, sleeps: int):
+        super().__init__(start_time)
+        self._stall = stall
+        self._sleeps = sleeps
+        self.worker = None
+
+    def sleep(self, seconds: float) -> None:
+        self.advance(seconds + self._stall)
+        self._sleeps -= 1
+        if self._sleeps == 0:
+            self.worker.close()
+
+
+class SimulationWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.reactor = CFDModel(1200, 1000, nx=50, Volume=10e-6, dt=0.005)
+        self.network = ReactorNetwork()
+        self.network.add(self.reactor)
+
+    def test_catch_up_is_capped(self):
+        clock = StallingClock(1000.0, stall=5.0, sleeps=4)
+        worker = SimulationWorker(self.network, period=0.1, max_catch_up=1.0, clock=clock, start=False)
+        clock.worker = worker
+        worker._run()  # on this thread, until the clock closes the worker
+
+        snapshot = worker.snapshot
+        self.assertAlmostEqual(snapshot.simulated_time, 3.0)  # 0 s on the first update, then 1 s for each stall
+        self.assertGreater(snapshot.lag, 3 * 5.0 - 3.0)  # the rest shows up as lag, not as a longer update
+        self.assertEqual(self.network.last_step_count, 200)  # max_catch_up in steps of dt1
+        self.assertEqual(self.reactor.total_steps, 600)
+
+    def test_step_applies_the_latest_inputs(self):
+        worker = SimulationWorker(self.network, clock=ReplayClock(0.0), start=False)
+        worker.set_inputs({self.reactor: {'species_A_flowrate': 1e-8}})
+        worker.set_inputs({self.reactor: {'species_A_flowrate': 4e-8}})  # replaces the inputs not applied yet
+        snapshot = worker.step(0.5)
+        self.assertEqual(self.reactor.species_A_flowrate, 4e-8)
+        self.assertEqual(snapshot.simulated_time, 0.5)
+        self.assertEqual(snapshot.product_concentration_bands, (None,))
+
+
+if __name__ == '__main__':
+    unittest.main()